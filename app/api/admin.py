@@ -0,0 +1,193 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.orm import Session
+from typing import Any, Optional
+
+from app.api.documents import purge_owner, purge_status
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.principal_cache import Principal
+from app.core.profiling import ProfilerBusyError, memory_tracker, request_profiles, sampling_profiler
+from app.core.security import get_current_admin
+from app.core.tracing import trace_exporter
+from app.db import crud
+from app.db.query_log import query_log
+from app.rag.reaper import reaper
+from app.rag.sharding import shard_client
+
+router = APIRouter()
+
+@router.get("/traces")
+def list_traces(
+    limit: int = Query(50, ge=1, le=500),
+    slow_only: bool = False,
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Most recent request traces of this worker, newest first."""
+    return trace_exporter.list(limit, slow_only)
+
+@router.get("/traces/{trace_id}")
+def get_trace(
+    trace_id: str,
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Full span tree of one request (see the X-Trace-Id response header)."""
+    trace = trace_exporter.find(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found in this worker's buffer")
+    return trace
+
+def require_profiling() -> None:
+    # PROFILING_ENABLED covers the /profile and /memory endpoints as well as
+    # the X-Profile header
+    if not settings.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+
+@router.post("/profile/sample", response_class=PlainTextResponse, dependencies=[Depends(require_profiling)])
+def sample_profile(
+    seconds: float = Query(10, gt=0, le=settings.PROFILING_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Sample all threads of this worker and return collapsed stacks for a flamegraph."""
+    try:
+        return sampling_profiler.sample(seconds, interval_ms / 1000)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/profile/requests", dependencies=[Depends(require_profiling)])
+def list_request_profiles(admin: Principal = Depends(get_current_admin)) -> Any:
+    """Requests profiled through the X-Profile header, newest first."""
+    return request_profiles.list()
+
+@router.get("/profile/requests/{profile_id}", response_class=PlainTextResponse, dependencies=[Depends(require_profiling)])
+def get_request_profile(
+    profile_id: str,
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """cProfile stats of one request, sorted by cumulative time."""
+    profile = request_profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found in this worker")
+    return profile["stats"]
+
+@router.post("/memory/start", dependencies=[Depends(require_profiling)])
+def start_memory_tracing(
+    frames: int = Query(10, ge=1, le=50),
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Start tracemalloc in this worker (adds allocation overhead until stopped)."""
+    memory_tracker.start(frames)
+    return {"tracing": True}
+
+@router.post("/memory/snapshot", dependencies=[Depends(require_profiling)])
+def take_memory_snapshot(
+    limit: int = Query(20, ge=1, le=200),
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Take a tracemalloc snapshot and return its largest allocation sites."""
+    try:
+        return memory_tracker.snapshot(limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/memory/diff", dependencies=[Depends(require_profiling)])
+def diff_memory_snapshots(
+    from_id: Optional[str] = None,
+    to_id: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=200),
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Allocation growth between two snapshots (oldest and newest by default)."""
+    try:
+        return memory_tracker.diff(from_id, to_id, limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Snapshot not found in this worker")
+
+@router.post("/memory/stop", dependencies=[Depends(require_profiling)])
+def stop_memory_tracing(admin: Principal = Depends(get_current_admin)) -> Any:
+    """Stop tracemalloc and drop the kept snapshots."""
+    memory_tracker.stop()
+    return {"tracing": False}
+
+@router.get("/shards")
+def shard_stats(admin: Principal = Depends(get_current_admin)) -> Any:
+    """Index statistics of every retrieval shard."""
+    if not shard_client.enabled:
+        raise HTTPException(status_code=400, detail="Sharded retrieval is not enabled")
+    return shard_client.broadcast("stats")
+
+@router.post("/shards/snapshot")
+def snapshot_shards(admin: Principal = Depends(get_current_admin)) -> Any:
+    """Have every shard write its index snapshot to SHARD_SNAPSHOT_FOLDER."""
+    if not shard_client.enabled:
+        raise HTTPException(status_code=400, detail="Sharded retrieval is not enabled")
+    return shard_client.broadcast("snapshot", timeout=settings.SHARD_SNAPSHOT_TIMEOUT_SECONDS)
+
+@router.post("/users/{user_id}/purge", status_code=202)
+def purge_user_documents(
+    user_id: int,
+    db: Session = Depends(get_db),
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Delete all documents of a tenant; they are removed in the background."""
+    if crud.get_user(db, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return purge_owner(db, user_id)
+
+def set_user_active(db: Session, user_id: int, is_active: bool) -> Any:
+    user = crud.set_user_active(db, user_id, is_active)
+    return {"id": user.id, "email": user.email, "is_active": user.is_active}
+
+@router.post("/users/{user_id}/deactivate")
+def deactivate_user(
+    user_id: int,
+    db: Session = Depends(get_db),
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Reject every request of a user, whatever token they hold.
+
+    Takes effect at once in this worker; other workers drop their cached
+    principal of the user within AUTH_CACHE_TTL_SECONDS.
+    """
+    if user_id == admin.id:
+        raise HTTPException(status_code=400, detail="Admins can't deactivate themselves")
+    return set_user_active(db, user_id, False)
+
+@router.post("/users/{user_id}/reactivate")
+def reactivate_user(
+    user_id: int,
+    db: Session = Depends(get_db),
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Let a deactivated user back in."""
+    return set_user_active(db, user_id, True)
+
+@router.get("/purges/{job_id}")
+def get_purge_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Progress of any tenant's purge."""
+    job = crud.get_purge_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Purge job not found")
+    return purge_status(db, job)
+
+@router.post("/reaper/run")
+def run_reaper(
+    gc: bool = False,
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Run one reaper pass now, optionally with garbage collection."""
+    return reaper.run_once(gc=gc)
+
+@router.post("/query-log/maintain")
+def maintain_query_log(
+    admin: Principal = Depends(get_current_admin)
+) -> Any:
+    """Create the coming query log partitions and archive expired months now."""
+    return query_log.maintain()
@@ -1,29 +1,41 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from typing import Any
 
-from app.core.database import get_db
+from app.core.database import get_async_db
+from app.core.hashing import password_hasher, throttle
+from app.core.profiling import ProfilingRoute
 from app.core.security import create_access_token
-from app.db import crud
+from app.db import async_crud
 from app.core.config import settings
 
-router = APIRouter()
+router = APIRouter(route_class=ProfilingRoute)
 
 @router.post("/token")
-def login_for_access_token(
-    db: Session = Depends(get_db),
+async def login_for_access_token(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
     form_data: OAuth2PasswordRequestForm = Depends()
 ) -> Any:
-    user = crud.get_user_by_email(db, form_data.username)
-    if not user or not crud.verify_password(form_data.password, user.hashed_password):
+    throttle(request, form_data.username)
+    
+    user = await async_crud.get_user_by_email(db, form_data.username)
+    verified = False
+    if user:
+        verified, new_hash = await password_hasher.verify_and_update(form_data.password, user.hashed_password)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Stored hash used an outdated scheme or cost: replace it transparently
+    if new_hash:
+        await async_crud.update_user_password_hash(db, user.id, new_hash)
+    
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": str(user.id)}, expires_delta=access_token_expires
@@ -35,17 +47,21 @@ def login_for_access_token(
     }
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-def register_user(
+async def register_user(
+    request: Request,
     email: str,
     password: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Any:
-    user = crud.get_user_by_email(db, email)
+    throttle(request)
+    
+    user = await async_crud.get_user_by_email(db, email)
     if user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    user = crud.create_user(db, email, password)
+    hashed_password = await password_hasher.hash(password)
+    user = await async_crud.create_user(db, email, hashed_password)
     return {"email": user.email, "id": user.id}
\ No newline at end of file
@@ -1,40 +1,83 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks
-from typing import List, Any
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks, Query, Request, Response
+from typing import List, Any, Optional
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import json
+import logging
+import os
 
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, get_async_db, get_db, get_read_db
+from app.core.metrics import track_ingestion_stage
+from app.core.principal_cache import Principal
+from app.core.profiling import ProfilingRoute
+from app.core.progress import progress_broker
+from app.core.responses import json_response
 from app.core.security import get_current_user
-from app.db import crud, models
-from app.rag import document_processor, embeddings
+from app.core.tracing import untraced
+from app.api.schemas import DocumentDetail, DocumentSummary
+from app.db import async_crud, crud
+from app.rag import document_processor, embeddings, ingestion
+from app.rag.projection import projection_registry
+from app.rag.sharding import shard_client
 
-router = APIRouter()
+logger = logging.getLogger(__name__)
 
-async def process_document_task(document_id: int, file: UploadFile, db: Session):
-    """Background task to process a document after upload."""
-    # Process the document to extract text chunks
-    text_chunks = await document_processor.process_document(file, document_id, db)
-    
-    # Generate embeddings for the chunks
-    for chunk in text_chunks:
-        chunk_embedding = embeddings.generate_embeddings([chunk])[0]
-        crud.create_document_chunk(db, chunk, chunk_embedding, document_id)
-    
-    # Mark document as processed
-    document = db.query(models.Document).filter(models.Document.id == document_id).first()
-    document.processed = True
-    db.commit()
+router = APIRouter(route_class=ProfilingRoute)
+
+@untraced
+async def process_document_task(document_id: int, owner_id: int, file: UploadFile):
+    """Background task to process a document after upload.
+
+    Progress is published to the owner's event stream (see /documents/events).
+    """
+    try:
+        # The request's session is gone by now, so the task opens its own
+        async with AsyncSessionLocal() as db:
+            # Process the document to extract text chunks
+            text_chunks = await document_processor.process_document(file, document_id, db)
+            
+            # Generate embeddings for the chunks (CPU bound, off the event loop),
+            # a slice at a time so progress can be reported in between
+            chunk_embeddings = []
+            step = settings.PROGRESS_EMBEDDING_BATCH
+            with track_ingestion_stage("embedding"):
+                for start in range(0, len(text_chunks), step):
+                    chunk_embeddings.extend(
+                        await run_in_threadpool(embeddings.generate_embeddings, text_chunks[start:start + step])
+                    )
+                    await progress_broker.publish(
+                        owner_id, document_id, "embedding",
+                        chunks=len(text_chunks), chunks_embedded=len(chunk_embeddings)
+                    )
+            projection = await run_in_threadpool(projection_registry.active_for, owner_id)
+            with track_ingestion_stage("chunk_insert"):
+                await async_crud.create_document_chunks(db, text_chunks, chunk_embeddings, document_id, projection, commit=False)
+            
+            # Mark document as processed, committing its chunks with it
+            with track_ingestion_stage("mark_processed"):
+                await async_crud.mark_document_processed(db, document_id)
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        logger.error(f"Processing document {document_id} failed: {error}")
+        await progress_broker.publish(owner_id, document_id, "failed", error=error)
+        raise
+    await progress_broker.publish(owner_id, document_id, "done", chunks=len(text_chunks))
 
 @router.post("/")
 async def upload_document(
     background_tasks: BackgroundTasks,
     title: str = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
 ) -> Any:
     """Upload a new document for processing."""
     # Create document record
-    document = crud.create_document(
+    document = await async_crud.create_document(
         db, 
         title=title, 
         filename=file.filename, 
@@ -44,7 +87,7 @@ async def upload_document(
     )
     
     # Process document in background
-    background_tasks.add_task(process_document_task, document.id, file, db)
+    background_tasks.add_task(process_document_task, document.id, current_user.id, file)
     
     return {
         "id": document.id,
@@ -53,51 +96,199 @@ async def upload_document(
         "status": "processing"
     }
 
-@router.get("/")
+@router.post("/bulk", status_code=202)
+async def upload_documents_bulk(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+) -> Any:
+    """Upload many documents at once, as separate files and/or zip/tar archives.
+
+    Archive members are streamed to storage one by one, every document is
+    created in a single transaction and the whole batch is processed by one
+    pipelined job. Follow it with GET /documents/jobs/{job_id} or the event
+    stream; files of unsupported types are listed under "skipped".
+    """
+    job = await async_crud.create_ingestion_job(db, current_user.id)
+    directory = os.path.join(settings.UPLOAD_FOLDER, f"user_{current_user.id}", f"job_{job.id}")
+    stager = ingestion.Stager(directory)
+    try:
+        with track_ingestion_stage("save_file"):
+            for upload in files:
+                await run_in_threadpool(stager.add_upload, upload.filename, upload.file, upload.content_type)
+    except Exception:
+        await run_in_threadpool(stager.discard)
+        await async_crud.finish_ingestion_job(db, job.id, "failed")
+        raise
+    
+    documents = await async_crud.create_job_documents(db, job.id, current_user.id, stager.staged)
+    if documents:
+        background_tasks.add_task(
+            ingestion.run_ingestion_job, job.id, current_user.id,
+            [(doc.id, doc.file_path, doc.content_type) for doc in documents]
+        )
+    else:
+        await async_crud.finish_ingestion_job(db, job.id, "done")
+    
+    return {
+        "job_id": job.id,
+        "status": "processing" if documents else "done",
+        "documents": len(documents),
+        "skipped": stager.skipped
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_ingestion_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+) -> Any:
+    """Progress of a bulk upload."""
+    job = await async_crud.get_ingestion_job(db, job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "id": job.id,
+        "status": job.status,
+        "total_documents": job.total_documents,
+        "processed_documents": job.processed_documents,
+        "failed_documents": job.failed_documents,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at
+    }
+
+@router.get("/", response_model=List[DocumentSummary])
 def get_user_documents(
-    skip: int = 0, 
-    limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-) -> List[Any]:
-    """Get all documents for the current user."""
-    documents = crud.get_documents(db, current_user.id, skip, limit)
-    return [
-        {
-            "id": doc.id,
-            "title": doc.title,
-            "filename": doc.filename,
-            "processed": doc.processed,
-            "created_at": doc.created_at
-        }
-        for doc in documents
-    ]
-
-@router.get("/{document_id}")
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+) -> Response:
+    """Get the current user's documents, newest first.
+
+    Pass the X-Next-Cursor response header back as `cursor` to get the next page.
+    Send the ETag back as If-None-Match to get a 304 when the page is unchanged.
+    """
+    documents, next_cursor = crud.get_documents(db, current_user.id, cursor, limit)
+    return json_response(
+        [DocumentSummary.model_validate(doc) for doc in documents],
+        request,
+        {"X-Next-Cursor": next_cursor} if next_cursor else None
+    )
+
+@router.get("/events")
+async def document_events(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+) -> StreamingResponse:
+    """Server-sent events with the processing progress of the user's documents.
+
+    Each `progress` event carries document_id, status (saving, extracting,
+    chunking, embedding, done, failed, deleted) and what is known so far:
+    pages/total_pages, chunks, chunks_embedded or error. Documents still being
+    processed are replayed on connect, so clients can simply reconnect.
+    """
+    # The stream can stay open for hours: don't keep the auth session's connection
+    await db.close()
+    owner_id = current_user.id
+    
+    async def stream():
+        async with progress_broker.subscribe(owner_id) as queue:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), settings.PROGRESS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                payload = {key: value for key, value in event.items() if key != "owner_id"}
+                yield f"event: progress\ndata: {json.dumps(payload)}\n\n"
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/{document_id}", response_model=DocumentDetail)
 def get_document(
     document_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
 ) -> Any:
     """Get a specific document by ID."""
     document = crud.get_document(db, document_id, current_user.id)
     if document is None:
         raise HTTPException(status_code=404, detail="Document not found")
     
+    return DocumentDetail(
+        id=document.id,
+        title=document.title,
+        filename=document.filename,
+        processed=document.processed,
+        created_at=document.created_at,
+        chunk_count=crud.count_document_chunks(db, document.id)
+    )
+
+def purge_owner(db: Session, owner_id: int) -> Any:
+    """Soft-delete all of an owner's documents; the reaper removes them in the background."""
+    job = crud.create_purge_job(db, owner_id)
+    if shard_client.enabled:
+        shard_client.broadcast("remove_owner", owner_id=owner_id)
+    return purge_status(db, job)
+
+def purge_status(db: Session, job) -> Any:
+    remaining = 0 if job.status == "done" else crud.count_pending_deletions(db, job.owner_id, job.created_at)
     return {
-        "id": document.id,
-        "title": document.title,
-        "filename": document.filename,
-        "processed": document.processed,
-        "created_at": document.created_at,
-        "chunk_count": len(document.chunks)
+        "job_id": job.id,
+        "owner_id": job.owner_id,
+        "status": job.status,
+        "total_documents": job.total_documents,
+        "deleted_documents": job.total_documents - remaining,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at
     }
 
+@router.delete("/", status_code=202)
+def purge_documents(
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+) -> Any:
+    """Delete all of the user's documents.
+
+    They disappear at once; follow the removal with GET /documents/purges/{job_id}.
+    """
+    return purge_owner(db, current_user.id)
+
+@router.get("/purges/{job_id}")
+def get_purge_job(
+    job_id: int,
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+) -> Any:
+    """Progress of a purge: documents removed so far out of the total."""
+    job = crud.get_purge_job(db, job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Purge job not found")
+    return purge_status(db, job)
+
 @router.delete("/{document_id}")
 def delete_document(
     document_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ) -> Any:
-    """Delete a document by ID."""
-    return crud.delete_document(db, document_id, current_user.id)
\ No newline at end of file
+    """Delete a document by ID.
+
+    The document is hidden at once; its chunks and file are removed in the background.
+    """
+    result = crud.delete_document(db, document_id, current_user.id)
+    progress_broker.publish_threadsafe(current_user.id, document_id, "deleted")
+    if shard_client.enabled:
+        # Shards only notice deletions on their next full reload otherwise
+        shard_client.broadcast("remove_documents", document_ids=[document_id])
+    return result
\ No newline at end of file
@@ -1,64 +1,276 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List, Any
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Any, Optional
 from sqlalchemy.orm import Session
+import asyncio
+import json
 
-from app.core.database import get_db
+from app.core.admission import admission
+from app.core.config import settings
+from app.core.database import get_read_db
+from app.core.metrics import track_stage
+from app.core.principal_cache import Principal
+from app.core.profiling import ProfilingRoute
+from app.core.responses import json_response
 from app.core.security import get_current_user
-from app.db import crud, models
+from app.api.schemas import Answer, QueryRecord, SessionAnswer
+from app.db import crud
+from app.db.query_log import query_log
 from app.rag import embeddings, llm
+from app.rag.projection import Projection, projection_registry
+from app.rag.sessions import session_store
+from app.rag.sharding import shard_client
 
-router = APIRouter()
+router = APIRouter(route_class=ProfilingRoute)
 
-@router.post("/")
-def ask_question(
-    question: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-) -> Any:
-    """Ask a question about documents and get an AI-generated answer."""
+NO_RELEVANT_CHUNKS_ANSWER = "I couldn't find any relevant information in your documents to answer this question."
+
+def load_chunk_data(db: Session, owner_id: int, projection: Optional[Projection] = None) -> List[dict]:
+    """Load every chunk of the owner's documents as a dict for similarity search.
+
+    Under a projection the chunks come with their reduced vectors; chunks
+    stored before it was activated are projected here.
+    """
+    with track_stage("chunk_fetch"):
+        if projection is None:
+            chunk_data = [
+                {"id": chunk.id, "content": chunk.content, "embedding": chunk.embedding}
+                for chunk in crud.get_owner_chunks(db, owner_id)
+            ]
+        else:
+            chunk_data = [
+                {"id": row.id, "content": row.content, "embedding": row.projected}
+                for row in crud.get_owner_projected_chunks(db, owner_id, projection.id)
+            ]
+            missing = [chunk for chunk in chunk_data if not chunk["embedding"]]
+            full = crud.get_chunk_embeddings(db, [chunk["id"] for chunk in missing])
+            missing = [chunk for chunk in missing if full.get(chunk["id"])]
+            if missing:
+                for chunk, vector in zip(missing, projection.apply([full[chunk["id"]] for chunk in missing])):
+                    chunk["embedding"] = vector.tolist()
+    # End the read transaction so its pooled connection isn't held through the LLM call
+    db.rollback()
+    return chunk_data
+
+def search_shards(
+    db: Session,
+    question_embeddings: List[List[float]],
+    owner_id: int,
+    projection: Optional[Projection] = None
+) -> List[List[dict]]:
+    """Scatter-gather search over the retrieval shards, then fetch the winners' text."""
+    with track_stage("scoring"):
+        hits, _ = shard_client.search(question_embeddings, owner_id, projection_id=projection.id if projection else 0)
+    with track_stage("chunk_fetch"):
+        contents = crud.get_chunk_contents(db, sorted({chunk_id for row in hits for chunk_id, _ in row}), owner_id)
+    db.rollback()
+    return [
+        [
+            {"id": chunk_id, "content": contents[chunk_id], "score": score}
+            for chunk_id, score in row if chunk_id in contents
+        ]
+        for row in hits
+    ]
+
+def project_questions(question_embeddings: List[List[float]], owner_id: int):
+    """Reduce question embeddings with the owner's active projection, if there is one."""
+    projection = projection_registry.active_for(owner_id)
+    if projection is None or not all(question_embeddings):
+        return question_embeddings, None
+    return projection.apply(question_embeddings).tolist(), projection
+
+def retrieve_relevant_chunks(db: Session, question: str, owner_id: int) -> List[dict]:
+    """Embed the question and return the owner's most relevant document chunks."""
     # Generate embedding for the question
-    question_embedding = embeddings.generate_embeddings([question])[0]
+    with track_stage("query_embedding"):
+        question_embeddings, projection = project_questions(embeddings.generate_embeddings([question]), owner_id)
+        question_embedding = question_embeddings[0]
+    
+    if shard_client.enabled:
+        return search_shards(db, [question_embedding], owner_id, projection)[0]
     
-    # Get all document chunks
-    all_chunks = db.query(models.DocumentChunk).all()
+    chunk_data = load_chunk_data(db, owner_id, projection)
     
     # Find relevant chunks
-    chunk_data = [
-        {"id": chunk.id, "content": chunk.content, "embedding": chunk.embedding}
-        for chunk in all_chunks
-    ]
-    relevant_chunks = embeddings.find_relevant_chunks(question_embedding, chunk_data)
+    with track_stage("scoring"):
+        return embeddings.find_relevant_chunks(question_embedding, chunk_data)
+
+def retrieve_relevant_chunks_batch(db: Session, questions: List[str], owner_id: int) -> List[List[dict]]:
+    """Embed all questions in one call and score them against the chunks in one product."""
+    with track_stage("query_embedding"):
+        question_embeddings, projection = project_questions(embeddings.generate_embeddings(questions), owner_id)
+    if shard_client.enabled:
+        return search_shards(db, question_embeddings, owner_id, projection)
+    chunk_data = load_chunk_data(db, owner_id, projection)
+    with track_stage("scoring"):
+        return embeddings.find_relevant_chunks_batch(question_embeddings, chunk_data)
+
+@router.post("/", response_model=Answer)
+def ask_question(
+    question: str,
+    read_db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+) -> Any:
+    """Ask a question about documents and get an AI-generated answer."""
+    # Shed load before doing any work if the LLM queue is already too long
+    admission.check("retrieval", "llm", user_id=current_user.id)
+    with admission.admit("retrieval", current_user.id):
+        relevant_chunks = retrieve_relevant_chunks(read_db, question, current_user.id)
     
     if not relevant_chunks:
-        answer = "I couldn't find any relevant information in your documents to answer this question."
+        answer = NO_RELEVANT_CHUNKS_ANSWER
     else:
         # Generate response with RAG
-        answer = llm.generate_rag_response(question, relevant_chunks)
+        with admission.admit("llm", current_user.id):
+            answer = llm.generate_rag_response(question, relevant_chunks)
+    
+    # Save the query; written in the next batch, off the request path
+    with track_stage("save_query"):
+        query = query_log.append(question, answer, current_user.id)
     
-    # Save the query
-    query = crud.save_query(db, question, answer, current_user.id)
+    return Answer(id=query.id, question=question, answer=answer)
+
+class BatchQuestions(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=settings.BATCH_MAX_QUESTIONS)
+
+@router.post("/batch")
+def ask_questions_batch(
+    batch: BatchQuestions,
+    read_db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+) -> StreamingResponse:
+    """Answer many questions in one request.
+
+    Retrieval for the whole batch happens up front; answers are generated
+    concurrently (at most BATCH_LLM_CONCURRENCY at a time, and never more than
+    the LLM stage has slots) and streamed back as newline-delimited JSON in
+    completion order, each line carrying the index of its question. The batch
+    is admitted once up front; its items then wait for an LLM slot instead of
+    being shed one by one, and don't count against the user's queue limit.
+    """
+    questions = batch.questions
+    user_id = current_user.id
+    admission.check("retrieval", "llm", user_id=user_id)
+    with admission.admit("retrieval", user_id):
+        relevant_chunks = retrieve_relevant_chunks_batch(read_db, questions, user_id)
+    
+    def generate_admitted(index: int) -> str:
+        with admission.admit("llm", user_id, blocking=True):
+            return llm.generate_rag_response(questions[index], relevant_chunks[index])
+    
+    async def generate_answers():
+        # More in flight than the stage has slots would only sit in its queue
+        # and inflate the expected wait seen by interactive questions
+        semaphore = asyncio.Semaphore(min(settings.BATCH_LLM_CONCURRENCY, admission.stages["llm"].concurrency))
+        
+        async def answer(index: int):
+            if not relevant_chunks[index]:
+                return index, NO_RELEVANT_CHUNKS_ANSWER
+            async with semaphore:
+                try:
+                    return index, await run_in_threadpool(generate_admitted, index)
+                except HTTPException as e:
+                    return index, e
+        
+        tasks = [asyncio.create_task(answer(index)) for index in range(len(questions))]
+        try:
+            for completed in asyncio.as_completed(tasks):
+                index, result = await completed
+                if isinstance(result, HTTPException):
+                    yield json.dumps({
+                        "index": index,
+                        "question": questions[index],
+                        "error": result.detail,
+                        "retry_after": int(result.headers["Retry-After"])
+                    }) + "\n"
+                    continue
+                answer_text = result
+                with track_stage("save_query"):
+                    # Only reserving an id can touch the database
+                    query = await run_in_threadpool(query_log.append, questions[index], answer_text, user_id)
+                yield json.dumps({
+                    "index": index,
+                    "question": questions[index],
+                    "answer": answer_text,
+                    "id": query.id
+                }) + "\n"
+        finally:
+            # Client went away: don't start generations nobody will read
+            for task in tasks:
+                task.cancel()
     
-    return {
-        "question": question,
-        "answer": answer,
-        "id": query.id
-    }
+    return StreamingResponse(generate_answers(), media_type="application/x-ndjson")
 
-@router.get("/history")
+@router.get("/history", response_model=List[QueryRecord])
 def get_query_history(
-    skip: int = 0,
-    limit: int = 10,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-) -> List[Any]:
-    """Get the user's query history."""
-    queries = crud.get_user_queries(db, current_user.id, skip, limit)
-    return [
-        {
-            "id": query.id,
-            "question": query.question,
-            "answer": query.answer,
-            "created_at": query.created_at
-        }
-        for query in queries
-    ]
\ No newline at end of file
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+) -> Response:
+    """Get the user's query history, newest first.
+
+    Pass the X-Next-Cursor response header back as `cursor` to get the next page.
+    Send the ETag back as If-None-Match to get a 304 when the page is unchanged.
+    """
+    queries, next_cursor = crud.get_user_queries(db, current_user.id, cursor, limit)
+    return json_response(
+        [QueryRecord.model_validate(query) for query in queries],
+        request,
+        {"X-Next-Cursor": next_cursor} if next_cursor else None
+    )
+
+@router.post("/sessions")
+def create_conversation_session(
+    current_user: Principal = Depends(get_current_user)
+) -> Any:
+    """Start a conversation session for multi-turn questions."""
+    session = session_store.create(current_user.id)
+    return {"session_id": session.id}
+
+@router.post("/sessions/{session_id}", response_model=SessionAnswer)
+def ask_in_session(
+    session_id: str,
+    question: str,
+    read_db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+) -> Any:
+    """Ask a question within a conversation, reusing the model context of earlier turns."""
+    session = session_store.get(session_id, current_user.id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Conversation session not found or expired")
+    
+    admission.check("retrieval", "llm", user_id=current_user.id)
+    with admission.admit("retrieval", current_user.id):
+        relevant_chunks = retrieve_relevant_chunks(read_db, question, current_user.id)
+    # Passages sent on an earlier turn are already part of the model context
+    new_chunks = [
+        chunk for chunk in relevant_chunks
+        if not session.context or chunk["id"] not in session.sent_chunk_ids
+    ]
+    
+    if not relevant_chunks and not session.context:
+        answer = NO_RELEVANT_CHUNKS_ANSWER
+        context = None
+    else:
+        with admission.admit("llm", current_user.id):
+            answer, context = llm.generate_conversation_response(question, new_chunks, session.context)
+    
+    session_store.update(session, context, [chunk["id"] for chunk in new_chunks])
+    with track_stage("save_query"):
+        query = query_log.append(question, answer, current_user.id)
+    
+    return SessionAnswer(id=query.id, question=question, answer=answer, session_id=session.id, turn=session.turns)
+
+@router.delete("/sessions/{session_id}")
+def end_conversation_session(
+    session_id: str,
+    current_user: Principal = Depends(get_current_user)
+) -> Any:
+    """End a conversation session and free its model context."""
+    if not session_store.delete(session_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Conversation session not found or expired")
+    return {"success": True}
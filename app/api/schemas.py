@@ -0,0 +1,43 @@
+"""Response models of the API.
+
+Listing endpoints serialize these straight to bytes with orjson
+(app/core/responses.py); the others go through FastAPI's response_model.
+"""
+import datetime
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+class DocumentSummary(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    title: str
+    filename: Optional[str] = None
+    processed: bool
+    created_at: datetime.datetime
+
+
+class DocumentDetail(DocumentSummary):
+    chunk_count: int
+
+
+class QueryRecord(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    question: str
+    answer: Optional[str] = None
+    created_at: datetime.datetime
+
+
+class Answer(BaseModel):
+    id: int
+    question: str
+    answer: str
+
+
+class SessionAnswer(Answer):
+    session_id: str
+    turn: int
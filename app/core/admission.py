@@ -0,0 +1,234 @@
+"""Admission control for the query path.
+
+Each stage (retrieval, llm) has a fixed number of slots. Requests beyond that
+wait in per-user queues that are served round-robin, so one user firing many
+questions cannot starve everyone else. A request is rejected straight away
+when waiting would blow the latency target:
+
+- 429 when the user already has ADMISSION_MAX_QUEUED_PER_USER requests in a stage,
+- 503 when the expected queueing delay (queue length x recent service time /
+  slots) exceeds ADMISSION_QUEUE_TARGET_SECONDS, or when a queued request
+  reaches its deadline without getting a slot.
+
+Both carry Retry-After. Batch items, already admitted as a whole, instead
+wait for a slot without either limit (blocking mode). Limits are per worker process; size them so that
+workers x ADMISSION_LLM_CONCURRENCY matches what the Ollama worker can serve.
+"""
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+from app.core.metrics import ADMISSION_DECISIONS, ADMISSION_QUEUE_SECONDS
+from app.core.tracing import span
+
+
+class _Waiter:
+    __slots__ = ("user_id", "event", "granted")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.granted = False
+
+
+class StageLimiter:
+    """Bounded concurrency with fair, deadline-aware queueing for one stage.
+
+    Endpoints on this path are sync and run in the threadpool, so waiting is a
+    blocking Event.wait; the lock only guards a few deque/dict operations.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_target: float, max_per_user: int, initial_service_time: float = 1.0):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_target = queue_target
+        self.max_per_user = max_per_user
+        self.active = 0
+        self.queued = 0
+        # Exponentially weighted average of how long a slot is held
+        self.service_time = initial_service_time
+        self._queues: Dict[int, Deque[_Waiter]] = {}
+        self._rotation: Deque[int] = deque()
+        self._per_user: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def expected_wait(self, queued: Optional[int] = None) -> float:
+        queued = self.queued if queued is None else queued
+        if self.active < self.concurrency and queued == 0:
+            return 0.0
+        return (queued + 1) * self.service_time / self.concurrency
+
+    def _reject(self, status_code: int, reason: str, retry_after: float) -> HTTPException:
+        ADMISSION_DECISIONS.labels(self.name, reason).inc()
+        return HTTPException(
+            status_code=status_code,
+            detail="Too many requests, please retry later" if status_code == 429 else "Server is busy, please retry later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    def check(self, user_id: int) -> None:
+        """Reject now if this request would be turned away when it reaches the stage."""
+        with self._lock:
+            if self._per_user.get(user_id, 0) >= self.max_per_user:
+                raise self._reject(status.HTTP_429_TOO_MANY_REQUESTS, "user_limit", self.service_time)
+            wait = self.expected_wait()
+            if wait > self.queue_target:
+                raise self._reject(status.HTTP_503_SERVICE_UNAVAILABLE, "overloaded", wait)
+
+    def acquire(self, user_id: int, blocking: bool = False) -> None:
+        """Take a slot, queueing fairly behind other users if none is free.
+
+        With blocking=True the request is neither counted against the user's
+        limit nor rejected on the queue target or deadline: it waits as long
+        as it takes. Only for work already admitted through check().
+        """
+        with self._lock:
+            if not blocking and self._per_user.get(user_id, 0) >= self.max_per_user:
+                raise self._reject(status.HTTP_429_TOO_MANY_REQUESTS, "user_limit", self.service_time)
+            if self.active < self.concurrency and self.queued == 0:
+                self.active += 1
+                if not blocking:
+                    self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+                ADMISSION_DECISIONS.labels(self.name, "admitted").inc()
+                ADMISSION_QUEUE_SECONDS.labels(self.name).observe(0.0)
+                return
+            wait = self.expected_wait()
+            if not blocking and wait > self.queue_target:
+                raise self._reject(status.HTTP_503_SERVICE_UNAVAILABLE, "overloaded", wait)
+
+            waiter = _Waiter(user_id)
+            if user_id not in self._queues:
+                self._queues[user_id] = deque()
+                self._rotation.append(user_id)
+            self._queues[user_id].append(waiter)
+            if not blocking:
+                self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            self.queued += 1
+
+        started = time.perf_counter()
+        with span("admission_wait", stage=self.name):
+            waiter.event.wait(None if blocking else self.queue_target)
+        with self._lock:
+            if not waiter.granted:
+                # Deadline passed while queued: give up our place
+                self._queues[user_id].remove(waiter)
+                if not self._queues[user_id]:
+                    del self._queues[user_id]
+                    self._rotation.remove(user_id)
+                self.queued -= 1
+                self._release_user(user_id)
+                raise self._reject(status.HTTP_503_SERVICE_UNAVAILABLE, "deadline", self.expected_wait())
+        ADMISSION_DECISIONS.labels(self.name, "admitted").inc()
+        ADMISSION_QUEUE_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+
+    def release(self, user_id: int, service_time: float, counted: bool = True) -> None:
+        with self._lock:
+            self.service_time = 0.8 * self.service_time + 0.2 * service_time
+            if counted:
+                self._release_user(user_id)
+            if not self._rotation:
+                self.active -= 1
+                return
+            # Hand the slot over directly to the next user in round-robin order
+            next_user = self._rotation.popleft()
+            queue = self._queues[next_user]
+            waiter = queue.popleft()
+            if queue:
+                self._rotation.append(next_user)
+            else:
+                del self._queues[next_user]
+            self.queued -= 1
+            waiter.granted = True
+            waiter.event.set()
+
+    def _release_user(self, user_id: int) -> None:
+        remaining = self._per_user.get(user_id, 0) - 1
+        if remaining > 0:
+            self._per_user[user_id] = remaining
+        else:
+            self._per_user.pop(user_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "active": self.active,
+                "queued": self.queued,
+                "queued_users": len(self._rotation),
+                "service_time_seconds": round(self.service_time, 3),
+                "expected_wait_seconds": round(self.expected_wait(), 3)
+            }
+
+
+class AdmissionController:
+    def __init__(self):
+        target = settings.ADMISSION_QUEUE_TARGET_SECONDS
+        per_user = settings.ADMISSION_MAX_QUEUED_PER_USER
+        self.stages: Dict[str, StageLimiter] = {
+            "retrieval": StageLimiter("retrieval", settings.ADMISSION_RETRIEVAL_CONCURRENCY, target, per_user, 0.2),
+            "llm": StageLimiter("llm", settings.ADMISSION_LLM_CONCURRENCY, target, per_user, 5.0),
+        }
+
+    def check(self, *stages: str, user_id: int) -> None:
+        """Fail fast before any work is done if a later stage is already saturated."""
+        for stage in stages:
+            self.stages[stage].check(user_id)
+
+    @contextmanager
+    def admit(self, stage: str, user_id: int, blocking: bool = False):
+        limiter = self.stages[stage]
+        limiter.acquire(user_id, blocking)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            limiter.release(user_id, time.perf_counter() - started, counted=not blocking)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: limiter.stats() for name, limiter in self.stages.items()}
+
+
+class RetryBudget:
+    """Allows retries only up to a fraction of recent first attempts.
+
+    When Ollama is overloaded every request fails; unbounded retries would
+    triple the load exactly when it hurts most.
+    """
+
+    def __init__(self, ratio: float = settings.LLM_RETRY_BUDGET_RATIO, window_seconds: float = 10.0, min_retries: int = 3):
+        self.ratio = ratio
+        self.window_seconds = window_seconds
+        self.min_retries = min_retries
+        self._attempts: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float) -> None:
+        for events in (self._attempts, self._retries):
+            while events and events[0] <= now - self.window_seconds:
+                events.popleft()
+
+    def record_attempt(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._attempts.append(now)
+
+    def try_retry(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            if len(self._retries) >= max(self.min_retries, self.ratio * len(self._attempts)):
+                return False
+            self._retries.append(now)
+            return True
+
+
+admission = AdmissionController()
+llm_retry_budget = RetryBudget()
@@ -6,6 +6,19 @@ class Settings(BaseSettings):
     API_V1_STR: str = "/api/v1"
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8  # 8 days
+    # Authenticated principals are cached in memory to skip the users lookup.
+    # The cache is per worker: a user deactivated through the admin API, or
+    # directly in the database, keeps working in other workers for up to this long
+    AUTH_CACHE_TTL_SECONDS: int = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+    AUTH_CACHE_MAX_ENTRIES: int = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+    
+    # Password hashing (bcrypt runs on a separate process pool)
+    PASSWORD_BCRYPT_ROUNDS: int = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_MAX_PENDING: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+    # Login/register attempts allowed per minute
+    AUTH_RATE_LIMIT_PER_IP: int = int(os.getenv("AUTH_RATE_LIMIT_PER_IP", "30"))
+    AUTH_RATE_LIMIT_PER_EMAIL: int = int(os.getenv("AUTH_RATE_LIMIT_PER_EMAIL", "10"))
     
     # GCP Instance IPs
     FILE_SERVER_INTERNAL_IP: str = os.getenv("FILE_SERVER_INTERNAL_IP", "10.128.0.8")
@@ -22,9 +35,15 @@ class Settings(BaseSettings):
     DB_INSTANCE_CONNECTION_NAME: str = os.getenv("DB_INSTANCE_CONNECTION_NAME", "")
     USE_CLOUD_SQL_AUTH_PROXY: bool = os.getenv("USE_CLOUD_SQL_AUTH_PROXY", "False").lower() == "true"
     
+    # Explicit SQLAlchemy URL (docker-compose, local Postgres or SQLite stand-ins);
+    # when empty the URL is built from the Cloud SQL settings above
+    DATABASE_URL_OVERRIDE: str = os.getenv("DATABASE_URL", "")
+    
     # Construct DATABASE_URL
     @property
     def DATABASE_URL(self) -> str:
+        if self.DATABASE_URL_OVERRIDE:
+            return self.DATABASE_URL_OVERRIDE
         if self.USE_CLOUD_SQL_AUTH_PROXY:
             # For connecting through Cloud SQL Auth Proxy
             return f"postgresql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
@@ -32,13 +51,159 @@ class Settings(BaseSettings):
             # Direct connection to Cloud SQL (using socket)
             return f"postgresql+pg8000://{self.DB_USER}:{self.DB_PASSWORD}@/{self.DB_NAME}?unix_sock=/cloudsql/{self.DB_INSTANCE_CONNECTION_NAME}/.s.PGSQL.5432"
     
+    # Same database through asyncpg, for the async engine
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        if self.DATABASE_URL_OVERRIDE:
+            # Same database through the async driver of its dialect
+            scheme, rest = self.DATABASE_URL_OVERRIDE.split("://", 1)
+            async_driver = "sqlite+aiosqlite" if scheme.startswith("sqlite") else "postgresql+asyncpg"
+            return f"{async_driver}://{rest}"
+        if self.USE_CLOUD_SQL_AUTH_PROXY:
+            return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+        else:
+            # asyncpg takes the socket directory as host
+            return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}@/{self.DB_NAME}?host=/cloudsql/{self.DB_INSTANCE_CONNECTION_NAME}"
+    
+    # Connection pools. DB_POOL_SIZE=0 derives the size from the connection budget:
+    # DB_MAX_CONNECTIONS is shared by WEB_CONCURRENCY gunicorn workers on this host
+    DB_MAX_CONNECTIONS: int = int(os.getenv("DB_MAX_CONNECTIONS", "50"))
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", "4"))
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "0"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "2"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    
+    # Read replicas for read-only traffic (comma-separated SQLAlchemy URLs)
+    DB_REPLICA_URLS: str = os.getenv("DB_REPLICA_URLS", "")
+    # Replicas lagging more than this are skipped in favour of the primary
+    DB_REPLICA_MAX_LAG_SECONDS: float = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+    DB_REPLICA_CHECK_INTERVAL_SECONDS: float = float(os.getenv("DB_REPLICA_CHECK_INTERVAL_SECONDS", "5"))
+    
     # File storage
     UPLOAD_FOLDER: str = os.getenv("UPLOAD_FOLDER", "/mnt/filestore")
     FILE_SERVER_URL: str = os.getenv("FILE_SERVER_URL", f"http://{FILE_SERVER_INTERNAL_IP}:8080")
+    # Compressed extracted text, keyed by file hash and extractor version
+    ARTIFACT_FOLDER: str = os.getenv("ARTIFACT_FOLDER", os.path.join(UPLOAD_FOLDER, "artifacts"))
+    # Embedding projection matrices (app/rag/projection.py)
+    PROJECTION_FOLDER: str = os.getenv("PROJECTION_FOLDER", os.path.join(UPLOAD_FOLDER, "projections"))
+    # How long a worker trusts its cached view of which projection is active
+    PROJECTION_CACHE_SECONDS: float = float(os.getenv("PROJECTION_CACHE_SECONDS", "30"))
     
     # Ollama configuration (running on worker instance)
     OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL", f"http://{WORKER_INTERNAL_IP}:11434")
     OLLAMA_MODEL: str = os.getenv("OLLAMA_MODEL", "tinyllama")
+    # How long Ollama keeps the model loaded after a request (e.g. "30m", "-1" for forever)
+    OLLAMA_KEEP_ALIVE: str = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+    
+    # Conversation sessions (Ollama context reuse across follow-up questions)
+    CONVERSATION_SESSION_TTL_SECONDS: int = int(os.getenv("CONVERSATION_SESSION_TTL_SECONDS", "1800"))
+    CONVERSATION_MAX_SESSIONS: int = int(os.getenv("CONVERSATION_MAX_SESSIONS", "1000"))
+    CONVERSATION_MAX_SESSIONS_PER_USER: int = int(os.getenv("CONVERSATION_MAX_SESSIONS_PER_USER", "10"))
+    # Ollama context tokens kept per session and across all sessions in this process
+    CONVERSATION_MAX_CONTEXT_TOKENS: int = int(os.getenv("CONVERSATION_MAX_CONTEXT_TOKENS", "4096"))
+    CONVERSATION_TOTAL_CONTEXT_TOKENS: int = int(os.getenv("CONVERSATION_TOTAL_CONTEXT_TOKENS", "2000000"))
+    
+    # Batch question endpoint
+    BATCH_MAX_QUESTIONS: int = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+    # Concurrent LLM generations per batch request (capped at ADMISSION_LLM_CONCURRENCY)
+    BATCH_LLM_CONCURRENCY: int = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+    
+    # Admission control on the query path (per worker process)
+    ADMISSION_RETRIEVAL_CONCURRENCY: int = int(os.getenv("ADMISSION_RETRIEVAL_CONCURRENCY", "4"))
+    ADMISSION_LLM_CONCURRENCY: int = int(os.getenv("ADMISSION_LLM_CONCURRENCY", "2"))
+    # Requests whose expected queueing delay exceeds this are rejected up front
+    ADMISSION_QUEUE_TARGET_SECONDS: float = float(os.getenv("ADMISSION_QUEUE_TARGET_SECONDS", "10"))
+    ADMISSION_MAX_QUEUED_PER_USER: int = int(os.getenv("ADMISSION_MAX_QUEUED_PER_USER", "4"))
+    # Ollama retries allowed as a fraction of recent first attempts
+    LLM_RETRY_BUDGET_RATIO: float = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.1"))
+    
+    # Bulk uploads: limits per request and parallelism of each pipeline stage
+    BULK_MAX_FILES: int = int(os.getenv("BULK_MAX_FILES", "10000"))
+    BULK_MAX_BYTES: int = int(os.getenv("BULK_MAX_BYTES", str(2 * 1024 ** 3)))
+    BULK_EXTRACT_WORKERS: int = int(os.getenv("BULK_EXTRACT_WORKERS", "2"))
+    BULK_EMBED_WORKERS: int = int(os.getenv("BULK_EMBED_WORKERS", "1"))
+    BULK_INSERT_WORKERS: int = int(os.getenv("BULK_INSERT_WORKERS", "2"))
+    # Documents waiting between two stages before the earlier stage pauses
+    BULK_QUEUE_SIZE: int = int(os.getenv("BULK_QUEUE_SIZE", "8"))
+    
+    # Sharded retrieval (app/rag/shard_server.py). Empty SHARD_ADDRESSES scores
+    # chunks in the API process; otherwise comma-separated "host:port" or "unix:/path"
+    SHARD_ADDRESSES: str = os.getenv("SHARD_ADDRESSES", "")
+    # "owner" puts each tenant on one shard, "hash" spreads chunks by id
+    SHARD_STRATEGY: str = os.getenv("SHARD_STRATEGY", "owner")
+    # Shards slower than this are left out of the merged results
+    SHARD_DEADLINE_SECONDS: float = float(os.getenv("SHARD_DEADLINE_SECONDS", "0.5"))
+    SHARD_CONTROL_TIMEOUT_SECONDS: float = float(os.getenv("SHARD_CONTROL_TIMEOUT_SECONDS", "5"))
+    SHARD_REFRESH_SECONDS: float = float(os.getenv("SHARD_REFRESH_SECONDS", "5"))
+    SHARD_FULL_RELOAD_SECONDS: float = float(os.getenv("SHARD_FULL_RELOAD_SECONDS", "3600"))
+    # Chunk ids below the newest indexed one that are re-checked on refresh
+    SHARD_REFRESH_LOOKBACK: int = int(os.getenv("SHARD_REFRESH_LOOKBACK", "10000"))
+    # Index snapshots (app/rag/snapshot.py): written after each full reload and
+    # restored at startup when set; empty disables them
+    SHARD_SNAPSHOT_FOLDER: str = os.getenv("SHARD_SNAPSHOT_FOLDER", "")
+    SHARD_SNAPSHOT_TIMEOUT_SECONDS: float = float(os.getenv("SHARD_SNAPSHOT_TIMEOUT_SECONDS", "300"))
+    # Hot/cold tiering (app/rag/tiering.py): bytes of owner vectors a shard keeps
+    # resident; 0 keeps its whole partition in memory
+    SHARD_MEMORY_BUDGET_BYTES: int = int(os.getenv("SHARD_MEMORY_BUDGET_BYTES", "0"))
+    # Where evicted owners are written, one subfolder per shard
+    SHARD_TIER_FOLDER: str = os.getenv("SHARD_TIER_FOLDER", os.path.join(UPLOAD_FOLDER, "tiers"))
+    
+    # Server-sent events of document processing progress
+    PROGRESS_HEARTBEAT_SECONDS: float = float(os.getenv("PROGRESS_HEARTBEAT_SECONDS", "15"))
+    # Chunks embedded between two progress events
+    PROGRESS_EMBEDDING_BATCH: int = int(os.getenv("PROGRESS_EMBEDDING_BATCH", "64"))
+    # How long the last state of a done or failed document is kept for replay
+    PROGRESS_FINISHED_TTL_SECONDS: float = float(os.getenv("PROGRESS_FINISHED_TTL_SECONDS", "600"))
+    
+    # Reaper of soft-deleted documents (app/rag/reaper.py); 0 disables the
+    # loop in API workers
+    REAPER_INTERVAL_SECONDS: float = float(os.getenv("REAPER_INTERVAL_SECONDS", "10"))
+    # Chunks deleted per transaction, and the pause between two batches
+    REAPER_BATCH_SIZE: int = int(os.getenv("REAPER_BATCH_SIZE", "1000"))
+    REAPER_BATCH_PAUSE_SECONDS: float = float(os.getenv("REAPER_BATCH_PAUSE_SECONDS", "0.05"))
+    # Garbage collection of orphaned chunks and files; files younger than the
+    # grace period are never collected
+    REAPER_GC_INTERVAL_SECONDS: float = float(os.getenv("REAPER_GC_INTERVAL_SECONDS", "3600"))
+    REAPER_GC_GRACE_SECONDS: float = float(os.getenv("REAPER_GC_GRACE_SECONDS", "3600"))
+    
+    # Query log (app/db/query_log.py): answers are queued and written in one
+    # statement every QUERY_LOG_FLUSH_SECONDS, or sooner once QUERY_LOG_BATCH_SIZE
+    # are waiting; 0 writes each answer before responding
+    QUERY_LOG_FLUSH_SECONDS: float = float(os.getenv("QUERY_LOG_FLUSH_SECONDS", "0.5"))
+    QUERY_LOG_BATCH_SIZE: int = int(os.getenv("QUERY_LOG_BATCH_SIZE", "500"))
+    # Queued answers kept per worker while the database can't be written; past
+    # this the oldest are dropped (query_log_dropped_total)
+    QUERY_LOG_MAX_PENDING: int = int(os.getenv("QUERY_LOG_MAX_PENDING", "50000"))
+    # Query ids reserved per database round trip
+    QUERY_LOG_ID_BLOCK: int = int(os.getenv("QUERY_LOG_ID_BLOCK", "1000"))
+    # Monthly partitions (PostgreSQL) created ahead of the current one
+    QUERY_LOG_PARTITIONS_AHEAD: int = int(os.getenv("QUERY_LOG_PARTITIONS_AHEAD", "2"))
+    # Months entirely older than this are archived to compressed files and
+    # dropped; 0 keeps everything in the database
+    QUERY_LOG_RETENTION_DAYS: int = int(os.getenv("QUERY_LOG_RETENTION_DAYS", "365"))
+    QUERY_LOG_ARCHIVE_FOLDER: str = os.getenv("QUERY_LOG_ARCHIVE_FOLDER", os.path.join(UPLOAD_FOLDER, "archive"))
+    # Partition creation and archival; 0 disables the loop in API workers
+    QUERY_LOG_MAINTENANCE_INTERVAL_SECONDS: float = float(os.getenv("QUERY_LOG_MAINTENANCE_INTERVAL_SECONDS", "3600"))
+    
+    # Response compression (app/core/compression.py)
+    COMPRESSION_MINIMUM_BYTES: int = int(os.getenv("COMPRESSION_MINIMUM_BYTES", "1024"))
+    COMPRESSION_GZIP_LEVEL: int = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+    COMPRESSION_BROTLI_QUALITY: int = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+    
+    # Request tracing
+    TRACE_BUFFER_SIZE: int = int(os.getenv("TRACE_BUFFER_SIZE", "500"))
+    TRACE_SLOW_REQUEST_SECONDS: float = float(os.getenv("TRACE_SLOW_REQUEST_SECONDS", "5"))
+    # Optional JSON lines export; each worker appends to "<path>.<pid>"
+    TRACE_EXPORT_FILE: str = os.getenv("TRACE_EXPORT_FILE", "")
+    
+    # On-demand profiling through the admin API and the X-Profile request header;
+    # opt-in, off unless set
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "False").lower() == "true"
+    PROFILING_MAX_SECONDS: int = int(os.getenv("PROFILING_MAX_SECONDS", "60"))
+    PROFILING_MAX_REQUEST_PROFILES: int = int(os.getenv("PROFILING_MAX_REQUEST_PROFILES", "20"))
+    
+    # Comma-separated emails of users allowed to use the admin API
+    ADMIN_EMAILS: str = os.getenv("ADMIN_EMAILS", "")
     
     # Frontend URL
     FRONTEND_URL: str = os.getenv("FRONTEND_URL", f"http://{FILE_SERVER_EXTERNAL_IP}:7000")
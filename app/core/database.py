@@ -1,9 +1,19 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from typing import Dict, List, Optional, Tuple
+import itertools
+import logging
 import os
+import threading
+import time
 
 from app.core.config import settings
+from app.core.metrics import DB_POOL_CHECKED_OUT, DB_POOL_TIMEOUTS, DB_POOL_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
 
 # Ensure data directory exists
 os.makedirs(settings.UPLOAD_FOLDER, exist_ok=True)
@@ -11,28 +21,118 @@ os.makedirs(settings.UPLOAD_FOLDER, exist_ok=True)
 # Install pg8000 for Cloud SQL connectivity
 # If using Cloud SQL Auth Proxy, use psycopg2
 # pip install pg8000==1.29.0
+# The async engine uses asyncpg in both cases
+
+
+class PoolWaitStats:
+    """Time spent waiting for a pooled connection, per engine."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def observe(self, seconds: float, timed_out: bool = False) -> None:
+        DB_POOL_WAIT_SECONDS.labels(self.name).observe(seconds)
+        if timed_out:
+            DB_POOL_TIMEOUTS.labels(self.name).inc()
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "total_wait_seconds": self.total_wait,
+                "max_wait_seconds": self.max_wait,
+                "avg_wait_seconds": self.total_wait / self.checkouts if self.checkouts else 0.0
+            }
+
+pool_wait_stats: Dict[str, PoolWaitStats] = {}
+
+def _timed_pool_class(base, name: str):
+    """Subclass a queue pool so every checkout records how long it waited."""
+    stats = pool_wait_stats.setdefault(name, PoolWaitStats(name))
+
+    class TimedPool(base):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except exc.TimeoutError:
+                stats.observe(time.perf_counter() - start, timed_out=True)
+                raise
+            stats.observe(time.perf_counter() - start)
+            return connection
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+def pool_limits() -> Tuple[int, int]:
+    """Return (pool_size, max_overflow) for each engine in this process.
+
+    Unless DB_POOL_SIZE is set explicitly, the DB_MAX_CONNECTIONS budget is split
+    across WEB_CONCURRENCY worker processes and the two engines (sync + async)
+    of each process, keeping a third of each share as overflow.
+    """
+    if settings.DB_POOL_SIZE > 0:
+        return settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW
+    per_engine = max(2, settings.DB_MAX_CONNECTIONS // (max(1, settings.WEB_CONCURRENCY) * 2))
+    pool_size = max(1, per_engine * 2 // 3)
+    return pool_size, per_engine - pool_size
+
+POOL_SIZE, MAX_OVERFLOW = pool_limits()
+
+def _connect_args(url: str) -> Dict[str, object]:
+    # SQLite stand-in: connections move between threads and writers wait on the file lock
+    if url.startswith("sqlite"):
+        return {"check_same_thread": False, "timeout": 30}
+    return {}
 
 # Create database engine with appropriate connection string
-if settings.USE_CLOUD_SQL_AUTH_PROXY:
-    # For connecting through Cloud SQL Auth Proxy
-    engine = create_engine(
-        settings.DATABASE_URL,
-        pool_size=5,
-        max_overflow=2,
-        pool_timeout=30,
-        pool_recycle=1800
-    )
-else:
-    # For connecting directly to Cloud SQL
-    engine = create_engine(
-        settings.DATABASE_URL,
-        pool_size=5,
-        max_overflow=2,
-        pool_timeout=30,
-        pool_recycle=1800
-    )
+# (DATABASE_URL picks Cloud SQL Auth Proxy or the unix socket)
+engine = create_engine(
+    settings.DATABASE_URL,
+    connect_args=_connect_args(settings.DATABASE_URL),
+    poolclass=_timed_pool_class(QueuePool, "sync"),
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=1800,
+    pool_pre_ping=True
+)
+
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    connect_args=_connect_args(settings.ASYNC_DATABASE_URL),
+    poolclass=_timed_pool_class(AsyncAdaptedQueuePool, "async"),
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=1800,
+    pool_pre_ping=True
+)
+
+def _track_checked_out(pool_engine, name: str) -> None:
+    gauge = DB_POOL_CHECKED_OUT.labels(name)
+    event.listen(pool_engine, "checkout", lambda *args: gauge.inc())
+    event.listen(pool_engine, "checkin", lambda *args: gauge.dec())
+
+_track_checked_out(engine, "sync")
+_track_checked_out(async_engine.sync_engine, "async")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attributes stay readable after commit without implicit IO
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -42,4 +142,137 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+class ReadOnlySessionError(RuntimeError):
+    pass
+
+@event.listens_for(Session, "before_flush")
+def _reject_writes_on_read_sessions(session, flush_context, instances):
+    # Sessions from get_read_db may point at a replica; writes belong on the primary
+    if session.info.get("read_only"):
+        raise ReadOnlySessionError("Attempted to write through a read-only session")
+
+# Replication lag in seconds; 0 when the replica has replayed everything it received
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica:
+    def __init__(self, url: str, name: str):
+        self.url = url
+        # Pool metrics are labelled by name; the URL may carry credentials
+        self.name = name
+        self.engine = create_engine(
+            url,
+            connect_args=_connect_args(url),
+            poolclass=_timed_pool_class(QueuePool, name),
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=1800,
+            pool_pre_ping=True
+        )
+        _track_checked_out(self.engine, name)
+        self.sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.lag: Optional[float] = None
+        self.healthy = False
+        self.checked_at = 0.0
+        self.check_lock = threading.Lock()
+
+
+class ReplicaRouter:
+    """Hands out read-only sessions on a healthy replica, or on the primary.
+
+    Each replica's lag is re-measured at most every check_interval seconds by
+    whichever request gets there first; concurrent requests use the last known
+    state. Replicas that lag more than max_lag or fail the check are skipped
+    until the next check, and with no healthy replica reads go to the primary.
+    """
+
+    def __init__(self, urls: List[str], max_lag: float, check_interval: float):
+        self.replicas = [Replica(url, f"replica-{number}") for number, url in enumerate(urls)]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._round_robin = itertools.count()
+
+    def _refresh(self, replica: Replica) -> None:
+        if time.monotonic() - replica.checked_at < self.check_interval:
+            return
+        if not replica.check_lock.acquire(blocking=False):
+            return  # Another request is already checking this replica
+        try:
+            with replica.engine.connect() as connection:
+                replica.lag = float(connection.execute(REPLICA_LAG_SQL).scalar() or 0)
+            replica.healthy = replica.lag <= self.max_lag
+            if not replica.healthy:
+                logger.warning(f"Replica lag {replica.lag:.1f}s exceeds {self.max_lag}s, reading from primary")
+        except Exception as e:
+            replica.lag = None
+            replica.healthy = False
+            logger.error(f"Replica health check failed: {str(e)}")
+        finally:
+            replica.checked_at = time.monotonic()
+            replica.check_lock.release()
+
+    def read_session(self) -> Session:
+        healthy = []
+        for replica in self.replicas:
+            self._refresh(replica)
+            if replica.healthy:
+                healthy.append(replica)
+        if healthy:
+            db = healthy[next(self._round_robin) % len(healthy)].sessionmaker()
+        else:
+            db = SessionLocal()
+        db.info["read_only"] = True
+        return db
+
+    def status(self) -> List[Dict[str, object]]:
+        return [
+            {
+                "name": replica.name,
+                "healthy": replica.healthy,
+                "lag_seconds": replica.lag,
+                "checked_out": replica.engine.pool.checkedout(),
+                **pool_wait_stats[replica.name].snapshot()
+            }
+            for replica in self.replicas
+        ]
+
+replica_router = ReplicaRouter(
+    [url.strip() for url in settings.DB_REPLICA_URLS.split(",") if url.strip()],
+    max_lag=settings.DB_REPLICA_MAX_LAG_SECONDS,
+    check_interval=settings.DB_REPLICA_CHECK_INTERVAL_SECONDS
+)
+
+# Dependency for read-only routes: replica when one is healthy, primary otherwise
+def get_read_db():
+    db = replica_router.read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Dependency to get an async database session (for async routes)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def pool_status() -> Dict[str, object]:
+    """Current pool occupancy and cumulative wait statistics per engine."""
+    status = {}
+    for name, pool in (("sync", engine.pool), ("async", async_engine.pool)):
+        status[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            **pool_wait_stats[name].snapshot()
+        }
+    if replica_router.replicas:
+        status["replicas"] = replica_router.status()
+    return status
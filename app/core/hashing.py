@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from passlib.context import CryptContext
+
+from app.core.config import settings
+
+# One CryptContext per cost setting, built lazily in each pool process
+_contexts: Dict[int, CryptContext] = {}
+
+def _crypt_context(rounds: int) -> CryptContext:
+    context = _contexts.get(rounds)
+    if context is None:
+        # min_rounds makes hashes created with a lower cost "need update",
+        # deprecated="auto" does the same for hashes from retired schemes
+        context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds
+        )
+        _contexts[rounds] = context
+    return context
+
+def _hash(password: str, rounds: int) -> str:
+    return _crypt_context(rounds).hash(password)
+
+def _verify_and_update(password: str, hashed_password: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    return _crypt_context(rounds).verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded process pool so it never pins the API threads.
+
+    At most max_pending hash/verify calls are queued or running; beyond that
+    callers get a 503 right away instead of waiting behind a login burst.
+    """
+
+    def __init__(
+        self,
+        workers: int = settings.PASSWORD_HASH_WORKERS,
+        max_pending: int = settings.PASSWORD_HASH_MAX_PENDING,
+        rounds: int = settings.PASSWORD_BCRYPT_ROUNDS
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created on first use so every gunicorn worker gets its own pool after the fork
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    async def _submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Authentication service is busy, please retry shortly",
+                    headers={"Retry-After": "1"}
+                )
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password, self.rounds)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also return a fresh hash if the stored one uses outdated parameters."""
+        return await self._submit(_verify_and_update, password, hashed_password, self.rounds)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+class SlidingWindowLimiter:
+    """Allows at most `limit` attempts per key within `window_seconds`."""
+
+    def __init__(self, limit: int, window_seconds: int = 60, max_keys: int = 100000):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._attempts: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key: str) -> Optional[int]:
+        """Record an attempt. Returns None if allowed, otherwise seconds until retry."""
+        now = time.monotonic()
+        cutoff = now - self.window_seconds
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is None:
+                if len(self._attempts) >= self.max_keys:
+                    self._prune(cutoff)
+                attempts = self._attempts[key] = deque()
+            while attempts and attempts[0] <= cutoff:
+                attempts.popleft()
+            if len(attempts) >= self.limit:
+                return max(1, int(attempts[0] - cutoff) + 1)
+            attempts.append(now)
+            return None
+
+    def _prune(self, cutoff: float) -> None:
+        for key in [k for k, v in self._attempts.items() if not v or v[-1] <= cutoff]:
+            del self._attempts[key]
+
+
+password_hasher = PasswordHasher()
+ip_limiter = SlidingWindowLimiter(settings.AUTH_RATE_LIMIT_PER_IP)
+email_limiter = SlidingWindowLimiter(settings.AUTH_RATE_LIMIT_PER_EMAIL)
+
+def client_ip(request: Request) -> str:
+    # nginx appends the peer address, so the last X-Forwarded-For entry is the trustworthy one
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if forwarded_for:
+        return forwarded_for.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+def throttle(request: Request, email: Optional[str] = None) -> None:
+    """Raise 429 if this client IP or email has made too many auth attempts."""
+    retry_after = ip_limiter.hit(f"ip:{client_ip(request)}")
+    if retry_after is None and email:
+        retry_after = email_limiter.hit(f"email:{email.strip().lower()}")
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many authentication attempts, please retry later",
+            headers={"Retry-After": str(retry_after)}
+        )
@@ -0,0 +1,146 @@
+"""Prometheus metrics for the RAG pipeline.
+
+With several gunicorn workers each process only sees its own samples, so set
+PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py): every worker then writes its
+samples there and /metrics aggregates all of them, whichever worker serves it.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from app.core.tracing import span
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Query path: query_embedding, chunk_fetch, scoring, prompt_build,
+# llm_first_token, llm_total, save_query
+RAG_STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Time spent in each stage of answering a question",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+# Ingestion: save_file, extraction, chunking, embedding, chunk_insert, mark_processed
+INGESTION_STAGE_SECONDS = Histogram(
+    "ingestion_stage_seconds", "Time spent in each stage of processing a document",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter(
+    "rag_stage_errors_total", "Exceptions raised inside an instrumented stage",
+    ["pipeline", "stage"]
+)
+LLM_REQUESTS = Counter(
+    "llm_requests_total", "Requests sent to Ollama by outcome",
+    ["outcome"]
+)
+
+ADMISSION_DECISIONS = Counter(
+    "admission_decisions_total", "Admission control outcomes per query-path stage",
+    ["stage", "decision"]
+)
+ADMISSION_QUEUE_SECONDS = Histogram(
+    "admission_queue_seconds", "Time admitted requests waited for a stage slot",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+ARTIFACT_LOOKUPS = Counter(
+    "text_artifact_lookups_total", "Extracted-text artifact lookups; misses parse the original file",
+    ["result"]
+)
+
+SHARD_REQUESTS = Counter(
+    "shard_requests_total", "Retrieval shard calls by outcome",
+    ["shard", "outcome"]
+)
+SHARD_REQUEST_SECONDS = Histogram(
+    "shard_request_seconds", "Round trip of successful retrieval shard calls",
+    ["shard"], buckets=LATENCY_BUCKETS
+)
+
+# Hot/cold tiering on shards (app/rag/tiering.py); shards on the API's host share
+# its PROMETHEUS_MULTIPROC_DIR, so /metrics reports them too
+TIER_RESIDENT_BYTES = Gauge(
+    "tier_resident_bytes", "Bytes of owner vectors resident in memory",
+    ["shard"], multiprocess_mode="livesum"
+)
+TIER_PAGE_IN_SECONDS = Histogram(
+    "tier_page_in_seconds", "Time to page an evicted owner back in",
+    ["source"], buckets=LATENCY_BUCKETS
+)
+TIER_EVICTIONS = Counter(
+    "tier_evictions_total", "Owners evicted to stay within the memory budget",
+    ["shard"]
+)
+TIER_LOOKUPS = Counter(
+    "tier_lookups_total", "Owner lookups on tiered shards: hit (resident) or miss (paged in)",
+    ["result"]
+)
+
+# Batched query log writes (app/db/query_log.py)
+QUERY_LOG_FLUSHES = Counter(
+    "query_log_flushes_total", "Batched inserts of answered questions by outcome",
+    ["outcome"]
+)
+QUERY_LOG_DROPPED = Counter(
+    "query_log_dropped_total", "Queued answers dropped unwritten because the queue was full"
+)
+QUERY_LOG_PENDING = Gauge(
+    "query_log_pending", "Answered questions queued and not yet written",
+    multiprocess_mode="livesum"
+)
+
+AUTH_CACHE_LOOKUPS = Counter(
+    "auth_cache_lookups_total", "Principal cache lookups; hits are users-table queries avoided",
+    ["result"]
+)
+
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled database connection",
+    ["engine"], buckets=LATENCY_BUCKETS
+)
+DB_POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total", "Connection checkouts that gave up waiting",
+    ["engine"]
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Connections currently checked out",
+    ["engine"], multiprocess_mode="livesum"
+)
+
+@contextmanager
+def track_stage(stage: str, histogram: Histogram = RAG_STAGE_SECONDS):
+    """Time the enclosed block as one stage; exceptions are counted and re-raised.
+
+    The stage is also recorded as a span of the current request trace.
+    """
+    start = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    except Exception:
+        pipeline = "ingestion" if histogram is INGESTION_STAGE_SECONDS else "query"
+        STAGE_ERRORS.labels(pipeline, stage).inc()
+        raise
+    finally:
+        histogram.labels(stage).observe(time.perf_counter() - start)
+
+def track_ingestion_stage(stage: str):
+    return track_stage(stage, INGESTION_STAGE_SECONDS)
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Return the exposition payload and its content type."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
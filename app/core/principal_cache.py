@@ -0,0 +1,123 @@
+import hashlib
+import threading
+import time
+from typing import Dict, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.metrics import AUTH_CACHE_LOOKUPS
+
+
+class Principal:
+    """Snapshot of the authenticated user, safe to share across requests and sessions."""
+
+    __slots__ = ("id", "email", "is_active")
+
+    def __init__(self, id: int, email: str, is_active: bool = True):
+        self.id = id
+        self.email = email
+        self.is_active = is_active
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(id=user.id, email=user.email, is_active=bool(user.is_active))
+
+
+class PrincipalCache:
+    """Short-lived cache of authenticated principals keyed by token and user id.
+
+    The JWT is still verified on every request; the cache only replaces the
+    SELECT on users. Entries expire after ttl_seconds (or when the token itself
+    expires) and invalidate_user drops every cached token of a user at once.
+    Critical sections are a few dict operations, so a plain lock is safe to take
+    from both the event loop and threadpool workers.
+
+    Invalidation is per process: other gunicorn workers see a deactivation
+    (POST /admin/users/{id}/deactivate) at the latest ttl_seconds later, and
+    so does every worker for a change made directly in the database.
+    """
+
+    def __init__(self, ttl_seconds: int = settings.AUTH_CACHE_TTL_SECONDS, max_entries: int = settings.AUTH_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[Principal, float]] = {}
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        # Don't keep raw bearer tokens around in memory longer than needed
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str, user_id: int) -> Optional[Principal]:
+        key = self._key(token)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                principal, expires_at = entry
+                if expires_at > now and principal.id == user_id:
+                    self.hits += 1
+                    AUTH_CACHE_LOOKUPS.labels("hit").inc()
+                    return principal
+                self._discard(key, principal.id)
+            self.misses += 1
+            AUTH_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+
+    def set(self, token: str, principal: Principal, token_expires_at: Optional[float] = None) -> None:
+        key = self._key(token)
+        ttl = self.ttl_seconds
+        if token_expires_at is not None:
+            # Never serve a principal past its token's own expiry
+            ttl = min(ttl, token_expires_at - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._evict_expired()
+                if len(self._entries) >= self.max_entries:
+                    oldest_key = next(iter(self._entries))
+                    self._discard(oldest_key, self._entries[oldest_key][0].id)
+            self._entries[key] = (principal, time.monotonic() + ttl)
+            self._tokens_by_user.setdefault(principal.id, set()).add(key)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for key in self._tokens_by_user.pop(user_id, set()):
+                self._entries.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "db_lookups_avoided": self.hits,
+                "invalidations": self.invalidations
+            }
+
+    def _discard(self, key: str, user_id: int) -> None:
+        self._entries.pop(key, None)
+        keys = self._tokens_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tokens_by_user[user_id]
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        for key, (principal, expires_at) in list(self._entries.items()):
+            if expires_at <= now:
+                self._discard(key, principal.id)
+
+
+principal_cache = PrincipalCache()
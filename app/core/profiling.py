@@ -0,0 +1,259 @@
+"""On-demand profiling of a live worker, for admins only.
+
+- SamplingProfiler: samples every thread's stack for N seconds and returns
+  flamegraph-compatible collapsed stacks (feed them to flamegraph.pl/speedscope).
+- Per-request cProfile: an admin request carrying `X-Profile: 1` is run under
+  cProfile; the response carries X-Profile-Id to fetch the stats afterwards.
+- MemoryTracker: tracemalloc snapshots that can be diffed over time.
+
+Everything here is off unless PROFILING_ENABLED=true, and per worker process;
+with several gunicorn workers, each call only sees the worker that served it.
+"""
+import asyncio
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+from app.core.config import settings
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads at a fixed interval."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def sample(self, seconds: float, interval: float = 0.005) -> str:
+        """Sample for `seconds` and return collapsed stacks, one "a;b;c count" per line."""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A sampling session is already running in this worker")
+        try:
+            own_thread = threading.get_ident()
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks: Counter = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread:
+                        continue
+                    names = []
+                    while frame is not None:
+                        names.append(self._frame_name(frame))
+                        frame = frame.f_back
+                    names.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+                    stacks[";".join(reversed(names))] += 1
+                time.sleep(interval)
+            return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        finally:
+            self._lock.release()
+
+
+class RequestProfileStore:
+    """Keeps the stats of the most recently profiled requests."""
+
+    def __init__(self, max_profiles: int = 20):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, profile: cProfile.Profile) -> str:
+        profile_id = uuid.uuid4().hex[:16]
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(60)
+        with self._lock:
+            self._profiles[profile_id] = {
+                "id": profile_id,
+                "endpoint": endpoint,
+                "created_at": time.time(),
+                "stats": output.getvalue()
+            }
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {key: value for key, value in profile.items() if key != "stats"}
+                for profile in reversed(self._profiles.values())
+            ]
+
+
+class MemoryTracker:
+    """tracemalloc snapshots taken on demand and compared pairwise."""
+
+    def __init__(self, max_snapshots: int = 10):
+        self.max_snapshots = max_snapshots
+        self._snapshots: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, frames: int = 10) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        with self._lock:
+            self._snapshots.clear()
+
+    def snapshot(self, limit: int = 20) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running, start it first")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        snapshot_id = uuid.uuid4().hex[:16]
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            self._snapshots[snapshot_id] = {"snapshot": snapshot, "taken_at": time.time()}
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return {
+            "id": snapshot_id,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "top": [str(stat) for stat in snapshot.statistics("lineno")[:limit]]
+        }
+
+    def diff(self, from_id: Optional[str] = None, to_id: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        """Compare two snapshots; defaults to the oldest and the newest kept."""
+        with self._lock:
+            if len(self._snapshots) < 2 and not (from_id and to_id):
+                raise RuntimeError("Need at least two snapshots to diff")
+            ids = list(self._snapshots)
+            from_id = from_id or ids[0]
+            to_id = to_id or ids[-1]
+            if from_id not in self._snapshots or to_id not in self._snapshots:
+                raise KeyError("Unknown snapshot id")
+            older = self._snapshots[from_id]
+            newer = self._snapshots[to_id]
+        stats = newer["snapshot"].compare_to(older["snapshot"], "lineno")
+        return {
+            "from": from_id,
+            "to": to_id,
+            "seconds_between": newer["taken_at"] - older["taken_at"],
+            "top": [str(stat) for stat in stats[:limit]]
+        }
+
+
+sampling_profiler = SamplingProfiler()
+request_profiles = RequestProfileStore(settings.PROFILING_MAX_REQUEST_PROFILES)
+memory_tracker = MemoryTracker()
+
+# Set by ProfilingMiddleware for admin requests asking to be profiled
+_request_profile: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_profile", default=None)
+
+
+def _profiled(endpoint):
+    """Wrap an endpoint so it runs under cProfile when its request asked for it.
+
+    The profiler has to be enabled in the thread running the endpoint, which for
+    sync endpoints is a threadpool worker, hence wrapping the endpoint itself.
+    """
+    def run(call):
+        request = _request_profile.get()
+        if request is None:
+            return call()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return call()
+        finally:
+            profile.disable()
+            request["profile"] = profile
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            request = _request_profile.get()
+            if request is None:
+                return await endpoint(*args, **kwargs)
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.disable()
+                request["profile"] = profile
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        return run(lambda: endpoint(*args, **kwargs))
+    return wrapper
+
+
+class ProfilingRoute(APIRoute):
+    """APIRoute whose endpoint can be profiled per request (see ProfilingMiddleware)."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+class ProfilingMiddleware:
+    """Profiles requests that send `X-Profile: 1` with an admin bearer token."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.PROFILING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        if headers.get(b"x-profile") != b"1" or not await self._is_admin(headers.get(b"authorization", b"")):
+            await self.app(scope, receive, send)
+            return
+
+        request = {"profile": None}
+        token = _request_profile.set(request)
+
+        async def send_with_profile(message):
+            # Endpoints finish before the response starts, so the profile is ready here
+            if message["type"] == "http.response.start" and request["profile"] is not None:
+                profile_id = request_profiles.add(f"{scope['method']} {scope['path']}", request["profile"])
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _request_profile.reset(token)
+
+    @staticmethod
+    async def _is_admin(authorization: bytes) -> bool:
+        from app.core.database import AsyncSessionLocal
+        from app.core.security import is_admin, principal_from_token
+
+        scheme, _, token = authorization.decode("latin-1").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return False
+        async with AsyncSessionLocal() as db:
+            principal = await principal_from_token(token, db)
+        return principal is not None and is_admin(principal)
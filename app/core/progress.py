@@ -0,0 +1,169 @@
+"""Document processing progress, pushed to clients as server-sent events.
+
+The ingestion pipeline publishes events (saving, extracting, chunking,
+embedding, done, failed; deleted when a document goes away) and subscribers
+get them per owner. The document's last known state is kept so a client
+connecting mid-way, or reconnecting, immediately sees where processing is;
+done and failed documents are forgotten PROGRESS_FINISHED_TTL_SECONDS later.
+
+With several gunicorn workers the upload may be processed in one worker while
+the client's event stream is held by another. On PostgreSQL events therefore
+go through NOTIFY on a single channel and every worker LISTENs on a dedicated
+connection and fans them out to its own subscribers; on other databases (the
+SQLite stand-in runs a single process) events are dispatched in-process.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import text
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "document_progress"
+FINISHED_STATUSES = ("done", "failed", "deleted")
+
+
+class ProgressBroker:
+    def __init__(self, max_documents_per_owner: int = 50, queue_size: int = 100):
+        self.max_documents_per_owner = max_documents_per_owner
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._latest: Dict[int, "OrderedDict[int, Dict[str, Any]]"] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener = None
+        self._closing = False
+        self._pruned_at = 0.0
+
+    @property
+    def uses_notify(self) -> bool:
+        return settings.DATABASE_URL.startswith("postgresql")
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._closing = False
+        if self.uses_notify:
+            await self._listen()
+
+    async def stop(self) -> None:
+        self._closing = True
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+
+    async def _listen(self) -> None:
+        import asyncpg
+
+        dsn = settings.ASYNC_DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+        try:
+            self._listener = await asyncpg.connect(dsn)
+            await self._listener.add_listener(CHANNEL, self._on_notify)
+            self._listener.add_termination_listener(self._on_listener_lost)
+        except Exception as e:
+            self._listener = None
+            logger.error(f"Could not listen for progress events, retrying: {str(e)}")
+            self._loop.call_later(5, lambda: asyncio.ensure_future(self._listen()))
+
+    def _on_listener_lost(self, connection) -> None:
+        self._listener = None
+        if not self._closing:
+            logger.warning("Progress listener connection lost, reconnecting")
+            self._loop.call_later(1, lambda: asyncio.ensure_future(self._listen()))
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        self._dispatch(json.loads(payload))
+
+    async def publish(self, owner_id: int, document_id: int, status: str, **fields) -> None:
+        event = {"owner_id": owner_id, "document_id": document_id, "status": status, "ts": time.time(), **fields}
+        if not self.uses_notify:
+            self._dispatch(event)
+            return
+        try:
+            from app.core.database import async_engine
+
+            async with async_engine.connect() as connection:
+                await connection.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": CHANNEL, "payload": json.dumps(event)}
+                )
+                await connection.commit()
+        except Exception as e:
+            # Progress is best effort and must never fail the ingestion itself
+            logger.error(f"Could not publish progress event: {str(e)}")
+
+    def publish_threadsafe(self, owner_id: int, document_id: int, status: str, **fields) -> None:
+        """publish() from a threadpool worker; fire and forget."""
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.publish(owner_id, document_id, status, **fields), self._loop)
+
+    def _dispatch(self, event: Dict[str, Any]) -> None:
+        owner_id = event["owner_id"]
+        documents = self._latest.setdefault(owner_id, OrderedDict())
+        previous = documents.get(event["document_id"], {})
+        if previous.get("ts", 0) > event["ts"]:
+            # Page events are published from the threadpool and can arrive late
+            return
+        # Merge so the kept state carries every field seen so far (pages, chunks, ...)
+        state = {**documents.pop(event["document_id"], {}), **event}
+        if event["status"] != "deleted":
+            documents[event["document_id"]] = state
+        while len(documents) > self.max_documents_per_owner:
+            documents.popitem(last=False)
+        if not documents:
+            del self._latest[owner_id]
+        self._prune(time.time())
+        for queue in self._subscribers.get(owner_id, ()):
+            if queue.full():
+                # Slow consumer: drop the oldest event rather than block ingestion
+                queue.get_nowait()
+            queue.put_nowait(state)
+
+    def _prune(self, now: float) -> None:
+        """Forget finished documents past their TTL, for every owner.
+
+        Owners who never reconnect would otherwise keep them for the life of
+        the process. A sweep at most once a minute keeps _dispatch cheap.
+        """
+        if now - self._pruned_at < 60:
+            return
+        self._pruned_at = now
+        expired = now - settings.PROGRESS_FINISHED_TTL_SECONDS
+        for owner_id, documents in list(self._latest.items()):
+            for document_id, state in list(documents.items()):
+                if state["status"] in FINISHED_STATUSES and state.get("ts", 0) < expired:
+                    del documents[document_id]
+            if not documents:
+                del self._latest[owner_id]
+
+    @asynccontextmanager
+    async def subscribe(self, owner_id: int):
+        """Queue of this owner's events, starting with the last state of recent documents."""
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        for state in list(self._latest.get(owner_id, {}).values())[-self.queue_size:]:
+            queue.put_nowait(state)
+        self._subscribers.setdefault(owner_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(owner_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[owner_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "tracked_documents": sum(len(documents) for documents in self._latest.values()),
+            "cross_worker": self.uses_notify,
+            "listening": self._listener is not None
+        }
+
+
+progress_broker = ProgressBroker()
@@ -0,0 +1,56 @@
+"""JSON responses serialized with orjson, with ETags for listing endpoints.
+
+The frontend refreshes document lists and history often and they rarely
+change: json_response hashes the body into a weak ETag and answers a
+matching If-None-Match with an empty 304, so an unchanged page costs the
+query but not the transfer.
+"""
+import hashlib
+from typing import Any, Dict, Optional
+
+import orjson
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    # orjson handles datetimes and dataclasses itself; models are dumped to dicts first
+    return orjson.dumps(content, default=_default)
+
+
+def etag_for(body: bytes) -> str:
+    # Weak: the compression middleware may re-encode the same representation
+    return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    if header.strip() == "*":
+        return True
+    candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def json_response(
+    content: Any,
+    request: Optional[Request] = None,
+    headers: Optional[Dict[str, str]] = None,
+    status_code: int = 200
+) -> Response:
+    """orjson-encoded response; with `request`, conditional on its If-None-Match."""
+    body = dumps(content)
+    headers = dict(headers or {})
+    if request is not None:
+        etag = etag_for(body)
+        headers["ETag"] = etag
+        # Per-user data: caches may keep it but must revalidate
+        headers["Cache-Control"] = "private, no-cache"
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
@@ -1,20 +1,19 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.core.database import get_db
-from app.db import crud, models
+from app.core.database import get_async_db
+from app.core.principal_cache import Principal, principal_cache
+from app.db import async_crud
 
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/token")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -27,20 +26,44 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def principal_from_token(token: str, db: AsyncSession) -> Optional[Principal]:
+    """Resolve a bearer token to an active principal, or None if it isn't valid."""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = crud.get_user(db, user_id=int(user_id))
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+            return None
+        user_id = int(user_id)
+    except (JWTError, ValueError):
+        return None
+    
+    # Common path: the signature check above is all we need
+    principal = principal_cache.get(token, user_id)
+    if principal is not None:
+        return principal
+    
+    user = await async_crud.get_user(db, user_id=user_id)
+    if user is None or not user.is_active:
+        return None
+    principal = Principal.from_user(user)
+    principal_cache.set(token, principal, token_expires_at=payload.get("exp"))
+    return principal
+
+async def get_current_user(db: AsyncSession = Depends(get_async_db), token: str = Depends(oauth2_scheme)) -> Principal:
+    principal = await principal_from_token(token, db)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return principal
+
+def is_admin(principal: Principal) -> bool:
+    admin_emails = {email.strip().lower() for email in settings.ADMIN_EMAILS.split(",") if email.strip()}
+    return principal.email.lower() in admin_emails
+
+async def get_current_admin(current_user: Principal = Depends(get_current_user)) -> Principal:
+    if not is_admin(current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
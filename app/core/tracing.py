@@ -0,0 +1,259 @@
+"""Lightweight in-process request tracing.
+
+Each HTTP request gets a root span; code underneath opens child spans with
+`span(...)` or `@traced`, and every SQL statement is recorded as a child of the
+span that issued it. Finished traces go to an in-memory ring buffer (served by
+the admin API) and optionally to a JSON lines file; requests slower than
+TRACE_SLOW_REQUEST_SECONDS are also logged with their full span tree. No
+external collector is involved.
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "name", "attributes", "start", "end", "children", "wall_start")
+
+    def __init__(self, trace_id: str, name: str, attributes: Optional[Dict[str, Any]] = None, start: Optional[float] = None):
+        self.trace_id = trace_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.perf_counter() if start is None else start
+        self.wall_start = time.time() - (time.perf_counter() - self.start)
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+
+    def finish(self, end: Optional[float] = None) -> None:
+        if self.end is None:
+            self.end = time.perf_counter() if end is None else end
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def child(self, name: str, attributes: Optional[Dict[str, Any]] = None, start: Optional[float] = None) -> "Span":
+        child = Span(self.trace_id, name, attributes, start)
+        # list.append is atomic, so threads of the same request can add children safely
+        self.children.append(child)
+        return child
+
+    def to_dict(self, root_start: Optional[float] = None) -> Dict[str, Any]:
+        root_start = self.start if root_start is None else root_start
+        return {
+            "name": self.name,
+            "offset_ms": round((self.start - root_start) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "children": [child.to_dict(root_start) for child in list(self.children)]
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+@contextmanager
+def span(name: str, **attributes):
+    """Open a child span of the current one; a no-op outside a traced request."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.child(name, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.attributes["error"] = repr(e)
+        raise
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+def traced(name: Optional[str] = None):
+    """Decorator recording each call of a sync or async function as a span."""
+    def decorator(func):
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def untraced(func):
+    """Run a sync or async function outside any request trace.
+
+    For background work started by a request (ingestion jobs, document
+    processing): its spans and SQL statements would otherwise pile up under
+    that request's root span for as long as the job runs.
+    """
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            token = _current_span.set(None)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _current_span.reset(token)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_span.set(None)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return wrapper
+
+
+class TraceExporter:
+    """Keeps recent traces in memory, optionally appends them to a JSONL file."""
+
+    def __init__(
+        self,
+        buffer_size: int = settings.TRACE_BUFFER_SIZE,
+        slow_threshold: float = settings.TRACE_SLOW_REQUEST_SECONDS,
+        export_file: str = settings.TRACE_EXPORT_FILE
+    ):
+        self.slow_threshold = slow_threshold
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+        self.slow: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+        # One file per worker process so concurrent appends never interleave
+        self.export_file = f"{export_file}.{os.getpid()}" if export_file else ""
+        self._lock = threading.Lock()
+
+    def export(self, root: Span) -> None:
+        trace = {
+            "trace_id": root.trace_id,
+            "started_at": root.wall_start,
+            "duration_ms": round(root.duration * 1000, 3),
+            "root": root.to_dict()
+        }
+        is_slow = root.duration >= self.slow_threshold
+        with self._lock:
+            self.recent.append(trace)
+            if is_slow:
+                self.slow.append(trace)
+            if self.export_file:
+                try:
+                    with open(self.export_file, "a") as f:
+                        f.write(json.dumps(trace, default=str) + "\n")
+                except OSError as e:
+                    logger.error(f"Could not write trace file: {str(e)}")
+        if is_slow:
+            logger.warning(f"Slow request {root.name} took {trace['duration_ms']}ms: {json.dumps(trace, default=str)}")
+
+    def find(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for trace in reversed(self.recent):
+                if trace["trace_id"] == trace_id:
+                    return trace
+        return None
+
+    def list(self, limit: int = 50, slow_only: bool = False) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = list(self.slow if slow_only else self.recent)
+        return traces[-limit:][::-1]
+
+
+trace_exporter = TraceExporter()
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a root span per HTTP request.
+
+    The root span ends and the trace is exported when the last response byte
+    is sent. Background tasks started by the request run after that and are
+    kept out of the trace (see `untraced`).
+    """
+
+    def __init__(self, app, exclude_paths=("/metrics", "/health")):
+        self.app = app
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = uuid.uuid4().hex[:16]
+        # Query strings are left out on purpose: some routes take credentials there
+        root = Span(trace_id, f"{scope['method']} {scope['path']}")
+        token = _current_span.set(root)
+        exported = False
+
+        def finish_trace() -> None:
+            nonlocal exported
+            root.finish()
+            if not exported:
+                exported = True
+                trace_exporter.export(root)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                root.attributes["status"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace_id.encode())]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish_trace()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except Exception as e:
+            root.attributes["error"] = repr(e)
+            raise
+        finally:
+            # Responses that never completed (errors, disconnects)
+            finish_trace()
+            _current_span.reset(token)
+
+
+# Every SQL statement, on any engine, becomes a child span of whatever issued it
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_span.get() is not None:
+        conn.info.setdefault("trace_statement_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    starts = conn.info.get("trace_statement_start")
+    if parent is None or not starts:
+        return
+    start = starts.pop()
+    sql_span = parent.child("sql", {"statement": statement[:500], "executemany": executemany}, start=start)
+    sql_span.finish()
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("trace_statement_start"):
+        connection.info["trace_statement_start"].pop()
@@ -0,0 +1,213 @@
+"""Async counterparts of app.db.crud for routes running on the event loop."""
+import datetime
+from typing import Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.principal_cache import principal_cache
+from app.core.tracing import traced
+from app.db.query_log import query_log
+from . import models
+from .crud import add_chunk_projections, decode_cursor, split_page
+
+def _keyset_page(statement, model, cursor: Optional[str], limit: int):
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        statement = statement.where(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+    return statement.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+
+# User operations
+@traced()
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+@traced()
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+@traced()
+async def create_user(db: AsyncSession, email: str, hashed_password: str):
+    db_user = models.User(email=email, hashed_password=hashed_password)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+@traced()
+async def set_user_active(db: AsyncSession, user_id: int, is_active: bool):
+    db_user = await get_user(db, user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    db_user.is_active = is_active
+    await db.commit()
+    # Cached principals must not outlive a deactivation
+    principal_cache.invalidate_user(user_id)
+    return db_user
+
+@traced()
+async def update_user_password_hash(db: AsyncSession, user_id: int, hashed_password: str):
+    db_user = await get_user(db, user_id)
+    if db_user is not None:
+        db_user.hashed_password = hashed_password
+        await db.commit()
+    return db_user
+
+# Document operations
+@traced()
+async def create_document(db: AsyncSession, title: str, filename: str, file_path: str, content_type: str, owner_id: int):
+    db_document = models.Document(
+        title=title,
+        filename=filename,
+        file_path=file_path,
+        content_type=content_type,
+        owner_id=owner_id
+    )
+    db.add(db_document)
+    await db.commit()
+    await db.refresh(db_document)
+    return db_document
+
+@traced()
+async def get_documents(db: AsyncSession, owner_id: int, cursor: Optional[str] = None, limit: int = 100):
+    statement = select(models.Document).where(models.Document.owner_id == owner_id, models.Document.deleted_at.is_(None))
+    result = await db.execute(_keyset_page(statement, models.Document, cursor, limit))
+    return split_page(list(result.scalars().all()), limit)
+
+@traced()
+async def get_document(db: AsyncSession, document_id: int, owner_id: int):
+    result = await db.execute(
+        select(models.Document).where(
+            models.Document.id == document_id,
+            models.Document.owner_id == owner_id,
+            models.Document.deleted_at.is_(None)
+        )
+    )
+    return result.scalars().first()
+
+@traced()
+async def delete_document(db: AsyncSession, document_id: int, owner_id: int):
+    """Soft-delete: the document disappears at once, the reaper removes its chunks and file."""
+    db_document = await get_document(db, document_id, owner_id)
+    if db_document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    db_document.deleted_at = datetime.datetime.utcnow()
+    await db.commit()
+    return {"success": True}
+
+@traced()
+async def mark_document_processed(db: AsyncSession, document_id: int, file_sha256: Optional[str] = None):
+    db_document = await db.get(models.Document, document_id)
+    if db_document is not None:
+        db_document.processed = True
+        if file_sha256:
+            db_document.file_sha256 = file_sha256
+    # Also commits chunks flushed before in the same session
+    await db.commit()
+    return db_document
+
+# Bulk ingestion jobs
+@traced()
+async def create_ingestion_job(db: AsyncSession, owner_id: int):
+    db_job = models.IngestionJob(owner_id=owner_id)
+    db.add(db_job)
+    await db.commit()
+    await db.refresh(db_job)
+    return db_job
+
+@traced()
+async def create_job_documents(db: AsyncSession, job_id: int, owner_id: int, files: Iterable):
+    """Create the documents of a bulk upload in one transaction.
+
+    `files` are staged files with title, filename, file_path and content_type.
+    """
+    documents = [
+        models.Document(
+            title=staged.title,
+            filename=staged.filename,
+            file_path=staged.file_path,
+            content_type=staged.content_type,
+            owner_id=owner_id,
+            job_id=job_id
+        )
+        for staged in files
+    ]
+    db.add_all(documents)
+    await db.execute(
+        update(models.IngestionJob)
+        .where(models.IngestionJob.id == job_id)
+        .values(total_documents=len(documents), status="processing")
+    )
+    await db.commit()
+    return documents
+
+@traced()
+async def get_ingestion_job(db: AsyncSession, job_id: int, owner_id: int):
+    result = await db.execute(
+        select(models.IngestionJob).where(
+            models.IngestionJob.id == job_id,
+            models.IngestionJob.owner_id == owner_id
+        )
+    )
+    return result.scalars().first()
+
+@traced()
+async def record_job_progress(db: AsyncSession, job_id: int, processed: int = 0, failed: int = 0):
+    # Relative update, several pipeline workers report concurrently
+    await db.execute(
+        update(models.IngestionJob)
+        .where(models.IngestionJob.id == job_id)
+        .values(
+            processed_documents=models.IngestionJob.processed_documents + processed,
+            failed_documents=models.IngestionJob.failed_documents + failed
+        )
+    )
+    await db.commit()
+
+@traced()
+async def finish_ingestion_job(db: AsyncSession, job_id: int, status: str):
+    await db.execute(
+        update(models.IngestionJob)
+        .where(models.IngestionJob.id == job_id)
+        .values(status=status, finished_at=datetime.datetime.utcnow())
+    )
+    await db.commit()
+
+# Document chunks operations
+@traced()
+async def count_document_chunks(db: AsyncSession, document_id: int) -> int:
+    result = await db.execute(
+        select(func.count(models.DocumentChunk.id)).where(models.DocumentChunk.document_id == document_id)
+    )
+    return result.scalar()
+
+@traced()
+async def create_document_chunks(db: AsyncSession, contents: Sequence[str], embeddings: Sequence[List[float]], document_id: int, projection=None, commit: bool = True):
+    """Insert all chunks of a document in a single transaction.
+
+    Under the owner's active embedding projection the reduced vectors are stored too.
+    With commit=False the chunks are only flushed, so the caller can commit them
+    together with the document being marked processed.
+    """
+    chunks = [
+        models.DocumentChunk(content=content, embedding=embedding, document_id=document_id)
+        for content, embedding in zip(contents, embeddings)
+    ]
+    db.add_all(chunks)
+    if projection is not None:
+        await db.flush()
+        add_chunk_projections(db, chunks, projection)
+    if commit:
+        await db.commit()
+    else:
+        await db.flush()
+
+# Query operations; answers are written by the query log (app/db/query_log.py)
+@traced()
+async def get_user_queries(db: AsyncSession, user_id: int, cursor: Optional[str] = None, limit: int = 100):
+    statement = select(models.Query).where(models.Query.user_id == user_id)
+    result = await db.execute(_keyset_page(statement, models.Query, cursor, limit))
+    return split_page(query_log.with_pending(user_id, list(result.scalars().all()), cursor, limit), limit)
@@ -1,30 +1,82 @@
+from sqlalchemy import func, tuple_
 from sqlalchemy.orm import Session
 from . import models
-from passlib.context import CryptContext
 from fastapi import HTTPException
-import os
+from typing import Dict, List, Optional, Tuple
+import base64
+import datetime
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.core.principal_cache import principal_cache
+from app.core.tracing import traced
+from app.db.query_log import query_log
+
+# Keyset pagination helpers
+def encode_cursor(created_at: datetime.datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+def keyset_page(query, model, cursor: Optional[str], limit: int):
+    """Order a query newest first on (created_at, id) and position it after the cursor.
+
+    Fetches one extra row to know whether there is a next page.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+
+def split_page(rows: List, limit: int) -> Tuple[List, Optional[str]]:
+    """Return (rows of this page, cursor of the next page or None)."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
 
 # User operations
+@traced()
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
+@traced()
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def create_user(db: Session, email: str, password: str):
-    hashed_password = pwd_context.hash(password)
+@traced()
+def create_user(db: Session, email: str, hashed_password: str):
     db_user = models.User(email=email, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+@traced()
+def set_user_active(db: Session, user_id: int, is_active: bool):
+    db_user = get_user(db, user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    db_user.is_active = is_active
+    db.commit()
+    # Cached principals must not outlive a deactivation
+    principal_cache.invalidate_user(user_id)
+    return db_user
+
+@traced()
+def update_user_password_hash(db: Session, user_id: int, hashed_password: str):
+    db_user = get_user(db, user_id)
+    if db_user is not None:
+        db_user.hashed_password = hashed_password
+        db.commit()
+    return db_user
 
 # Document operations
+@traced()
 def create_document(db: Session, title: str, filename: str, file_path: str, content_type: str, owner_id: int):
     db_document = models.Document(
         title=title,
@@ -38,36 +90,63 @@ def create_document(db: Session, title: str, filename: str, file_path: str, cont
     db.refresh(db_document)
     return db_document
 
-def get_documents(db: Session, owner_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Document).filter(models.Document.owner_id == owner_id).offset(skip).limit(limit).all()
+@traced()
+def get_documents(db: Session, owner_id: int, cursor: Optional[str] = None, limit: int = 100):
+    query = db.query(models.Document).filter(models.Document.owner_id == owner_id, models.Document.deleted_at.is_(None))
+    return split_page(keyset_page(query, models.Document, cursor, limit).all(), limit)
 
+@traced()
 def get_document(db: Session, document_id: int, owner_id: int):
     return db.query(models.Document).filter(
         models.Document.id == document_id,
-        models.Document.owner_id == owner_id
+        models.Document.owner_id == owner_id,
+        models.Document.deleted_at.is_(None)
     ).first()
 
+@traced()
 def delete_document(db: Session, document_id: int, owner_id: int):
+    """Soft-delete: the document disappears at once, the reaper removes its chunks and file."""
     db_document = get_document(db, document_id, owner_id)
     if db_document is None:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete associated chunks
-    db.query(models.DocumentChunk).filter(
-        models.DocumentChunk.document_id == document_id
-    ).delete()
-    
-    # Delete document from database
-    db.delete(db_document)
-    
-    # Delete file from disk
-    if os.path.exists(db_document.file_path):
-        os.remove(db_document.file_path)
-    
+    db_document.deleted_at = datetime.datetime.utcnow()
     db.commit()
     return {"success": True}
 
+@traced()
+def create_purge_job(db: Session, owner_id: int):
+    """Soft-delete all of an owner's documents at once, tracked by a purge job."""
+    now = datetime.datetime.utcnow()
+    job = models.PurgeJob(owner_id=owner_id, created_at=now)
+    db.add(job)
+    db.query(models.Document).filter(
+        models.Document.owner_id == owner_id,
+        models.Document.deleted_at.is_(None)
+    ).update({models.Document.deleted_at: now}, synchronize_session=False)
+    # Earlier single deletions not reaped yet count towards the purge as well
+    job.total_documents = count_pending_deletions(db, owner_id, now)
+    db.commit()
+    db.refresh(job)
+    return job
+
+@traced()
+def count_pending_deletions(db: Session, owner_id: int, deleted_before: datetime.datetime) -> int:
+    return db.query(func.count(models.Document.id)).filter(
+        models.Document.owner_id == owner_id,
+        models.Document.deleted_at.isnot(None),
+        models.Document.deleted_at <= deleted_before
+    ).scalar()
+
+@traced()
+def get_purge_job(db: Session, job_id: int, owner_id: Optional[int] = None):
+    query = db.query(models.PurgeJob).filter(models.PurgeJob.id == job_id)
+    if owner_id is not None:
+        query = query.filter(models.PurgeJob.owner_id == owner_id)
+    return query.first()
+
 # Document chunks operations
+@traced()
 def create_document_chunk(db: Session, content: str, embedding, document_id: int):
     db_chunk = models.DocumentChunk(
         content=content,
@@ -79,22 +158,93 @@ def create_document_chunk(db: Session, content: str, embedding, document_id: int
     db.refresh(db_chunk)
     return db_chunk
 
+@traced()
+def count_document_chunks(db: Session, document_id: int) -> int:
+    return db.query(func.count(models.DocumentChunk.id)).filter(
+        models.DocumentChunk.document_id == document_id
+    ).scalar()
+
+@traced()
 def get_all_chunks(db: Session):
     return db.query(models.DocumentChunk).all()
 
-# Query operations
-def save_query(db: Session, question: str, answer: str, user_id: int):
-    db_query = models.Query(
-        question=question,
-        answer=answer,
-        user_id=user_id
-    )
-    db.add(db_query)
+@traced()
+def delete_chunk_projections(db: Session, document_id: int):
+    """Drop the reduced vectors of a document's chunks (before the chunks themselves)."""
+    chunk_ids = db.query(models.DocumentChunk.id).filter(models.DocumentChunk.document_id == document_id)
+    db.query(models.ChunkProjection).filter(
+        models.ChunkProjection.chunk_id.in_(chunk_ids.scalar_subquery())
+    ).delete(synchronize_session=False)
+
+def add_chunk_projections(db: Session, chunks: List[models.DocumentChunk], projection):
+    """Store the reduced vectors of freshly flushed chunks under an active projection."""
+    chunks = [chunk for chunk in chunks if chunk.embedding]
+    if projection is None or not chunks:
+        return
+    reduced = projection.apply([chunk.embedding for chunk in chunks])
+    db.add_all([
+        models.ChunkProjection(chunk_id=chunk.id, projection_id=projection.id, embedding=vector.tolist())
+        for chunk, vector in zip(chunks, reduced)
+    ])
+
+@traced()
+def replace_document_chunks(db: Session, document_id: int, contents: List[str], embeddings: List[List[float]], before_commit=None, projection=None):
+    """Swap all chunks of a document for new ones in a single transaction."""
+    delete_chunk_projections(db, document_id)
+    db.query(models.DocumentChunk).filter(models.DocumentChunk.document_id == document_id).delete()
+    chunks = [
+        models.DocumentChunk(content=content, embedding=embedding, document_id=document_id)
+        for content, embedding in zip(contents, embeddings)
+    ]
+    db.add_all(chunks)
+    db.flush()
+    add_chunk_projections(db, chunks, projection)
+    db.flush()
+    if before_commit is not None:
+        before_commit()
     db.commit()
-    db.refresh(db_query)
-    return db_query
 
-def get_user_queries(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Query).filter(
-        models.Query.user_id == user_id
-    ).order_by(models.Query.created_at.desc()).offset(skip).limit(limit).all()
\ No newline at end of file
+@traced()
+def get_owner_chunks(db: Session, owner_id: int):
+    return db.query(models.DocumentChunk).join(models.Document).filter(
+        models.Document.owner_id == owner_id,
+        models.Document.deleted_at.is_(None)
+    ).all()
+
+@traced()
+def get_chunk_contents(db: Session, chunk_ids: List[int], owner_id: int) -> Dict[int, str]:
+    """Content of the given chunks, restricted to the owner's documents."""
+    if not chunk_ids:
+        return {}
+    rows = db.query(models.DocumentChunk.id, models.DocumentChunk.content).join(models.Document).filter(
+        models.DocumentChunk.id.in_(chunk_ids),
+        models.Document.owner_id == owner_id,
+        models.Document.deleted_at.is_(None)
+    ).all()
+    return {row.id: row.content for row in rows}
+
+@traced()
+def get_owner_projected_chunks(db: Session, owner_id: int, projection_id: int):
+    """(id, content, reduced vector or None) of the owner's chunks under a projection."""
+    return db.query(
+        models.DocumentChunk.id,
+        models.DocumentChunk.content,
+        models.ChunkProjection.embedding.label("projected")
+    ).join(models.Document).outerjoin(
+        models.ChunkProjection,
+        (models.ChunkProjection.chunk_id == models.DocumentChunk.id) & (models.ChunkProjection.projection_id == projection_id)
+    ).filter(models.Document.owner_id == owner_id, models.Document.deleted_at.is_(None)).all()
+
+@traced()
+def get_chunk_embeddings(db: Session, chunk_ids: List[int]) -> Dict[int, List[float]]:
+    if not chunk_ids:
+        return {}
+    rows = db.query(models.DocumentChunk.id, models.DocumentChunk.embedding).filter(models.DocumentChunk.id.in_(chunk_ids)).all()
+    return {row.id: row.embedding for row in rows}
+
+# Query operations; answers are written by the query log (app/db/query_log.py)
+@traced()
+def get_user_queries(db: Session, user_id: int, cursor: Optional[str] = None, limit: int = 100):
+    query = db.query(models.Query).filter(models.Query.user_id == user_id)
+    rows = keyset_page(query, models.Query, cursor, limit).all()
+    return split_page(query_log.with_pending(user_id, rows, cursor, limit), limit)
\ No newline at end of file
@@ -0,0 +1,45 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.core.database import Base
+
+logger = logging.getLogger(__name__)
+
+def ensure_indexes(engine: Engine) -> None:
+    """Create indexes declared on the models that existing tables don't have yet.
+
+    Base.metadata.create_all only creates missing tables, so indexes added to
+    a model later would never reach a database created before them.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                # Several workers start at once; losing the race to create an index is fine
+                logger.warning(f"Could not create index {index.name}: {str(e)}")
+
+def ensure_columns(engine: Engine) -> None:
+    """Add columns declared on the models that existing tables don't have yet.
+
+    Only nullable columns without server defaults are expected here; existing
+    rows get NULL. Run before ensure_indexes so indexes on new columns work.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                logger.info(f"Added column {table.name}.{column.name}")
+            except Exception as e:
+                # Same race as for indexes: another worker may have added it first
+                logger.warning(f"Could not add column {table.name}.{column.name}: {str(e)}")
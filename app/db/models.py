@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Float
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, JSON, String, Text, DateTime, Float
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship
 import datetime
@@ -26,25 +26,115 @@ class Document(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     processed = Column(Boolean, default=False)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # SHA-256 of the file, the key of its extracted-text artifact
+    file_sha256 = Column(String, nullable=True)
+    # Set for documents created by a bulk upload
+    job_id = Column(Integer, ForeignKey("ingestion_jobs.id"), nullable=True, index=True)
+    # Soft delete: hidden everywhere at once, removed by the reaper (app/rag/reaper.py)
+    deleted_at = Column(DateTime, nullable=True, index=True)
     
     owner = relationship("User", back_populates="documents")
     chunks = relationship("DocumentChunk", back_populates="document")
+    
+    __table_args__ = (
+        # Keyset pagination of a user's documents, newest first
+        Index("ix_documents_owner_created_id", "owner_id", "created_at", "id"),
+    )
+
+class IngestionJob(Base):
+    """A bulk upload: its documents go through the ingestion pipeline together."""
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    # staging, processing, done, failed
+    status = Column(String, default="staging")
+    total_documents = Column(Integer, default=0)
+    processed_documents = Column(Integer, default=0)
+    failed_documents = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class PurgeJob(Base):
+    """Deletion of all of an owner's documents, carried out by the reaper.
+
+    The documents are soft-deleted with deleted_at = created_at; the job's
+    progress is how many of them the reaper has removed since.
+    """
+    __tablename__ = "purge_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    # running, done
+    status = Column(String, default="running")
+    total_documents = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
 
 class DocumentChunk(Base):
     __tablename__ = "document_chunks"
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text)
-    embedding = Column(ARRAY(Float))
-    document_id = Column(Integer, ForeignKey("documents.id"))
+    # JSON on SQLite so benchmarks and local stand-ins can run without Postgres
+    embedding = Column(ARRAY(Float).with_variant(JSON(), "sqlite"))
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
     
     document = relationship("Document", back_populates="chunks")
 
+class EmbeddingProjection(Base):
+    """A versioned dimensionality reduction fitted on one owner's chunk embeddings.
+
+    The matrices live in a .npz file; at most one projection per owner is active.
+    """
+    __tablename__ = "embedding_projections"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    # "pca" or "random" (random rotation + truncation)
+    method = Column(String)
+    input_dim = Column(Integer)
+    output_dim = Column(Integer)
+    file_path = Column(String)
+    # ready, active, retired
+    status = Column(String, default="ready")
+    fitted_rows = Column(Integer)
+    # Recall-versus-dimension measured when fitting
+    report = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    activated_at = Column(DateTime, nullable=True)
+
+class ChunkProjection(Base):
+    """A chunk's embedding reduced by one projection; the full embedding stays on the chunk."""
+    __tablename__ = "chunk_projections"
+
+    chunk_id = Column(Integer, ForeignKey("document_chunks.id", ondelete="CASCADE"), primary_key=True)
+    projection_id = Column(Integer, ForeignKey("embedding_projections.id"), primary_key=True, index=True)
+    embedding = Column(ARRAY(Float).with_variant(JSON(), "sqlite"))
+
 class Query(Base):
+    """An answered question, written in batches by the query log (app/db/query_log.py).
+
+    On PostgreSQL the table is range-partitioned by month on created_at, which
+    therefore belongs to the primary key. Ids come from id_blocks, not a sequence.
+    """
     __tablename__ = "queries"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=False)
     question = Column(Text)
     answer = Column(Text)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    user_id = Column(Integer, ForeignKey("users.id"))
\ No newline at end of file
+    created_at = Column(DateTime, primary_key=True, default=datetime.datetime.utcnow)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    
+    __table_args__ = (
+        # Keyset pagination of a user's history, newest first; one per partition
+        Index("ix_queries_user_created_id", "user_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+class IdBlock(Base):
+    """Next unallocated id of a table whose ids are handed out in blocks."""
+    __tablename__ = "id_blocks"
+
+    name = Column(String, primary_key=True)
+    next_id = Column(Integer, nullable=False)
@@ -0,0 +1,529 @@
+"""Query log: answered questions written in batches, kept in monthly partitions.
+
+    python -m app.db.query_log convert       # partition a queries table from before, once
+    python -m app.db.query_log partitions    # list partitions and their row counts
+    python -m app.db.query_log maintain      # create partitions, archive expired months
+
+Writes: `query_log.append` gives the row its id and created_at, queues it and
+returns at once. Ids come from blocks of QUERY_LOG_ID_BLOCK reserved in
+id_blocks, one round trip per block. A writer thread inserts everything queued
+in one statement every QUERY_LOG_FLUSH_SECONDS, or sooner once
+QUERY_LOG_BATCH_SIZE rows are waiting. Until then a worker merges its queued
+rows into its users' history (`with_pending`). A clean shutdown flushes the
+queue; rows still queued when a worker is killed are lost, and so are the
+oldest ones once more than QUERY_LOG_MAX_PENDING wait on an unreachable
+database.
+
+Storage: on PostgreSQL `queries` is range-partitioned by month on created_at
+(queries_pYYYYMM, plus queries_default, which stays empty while partitions
+are created QUERY_LOG_PARTITIONS_AHEAD months ahead). Each partition has its
+own (user_id, created_at, id) index, so inserts only touch the current
+month's and a history page is read from the newest partitions only. A plain
+table from before partitioning is converted by the `convert` command, run
+before the API starts (web-server-setup.sh): it becomes queries_legacy, the
+partition of everything up to the end of that month. This locks the table
+while the new key is built over every old row, far longer than a worker may
+take to boot, so API workers never convert; they only create missing
+partitions, and keep writing to the plain table until it is converted.
+
+Retention: partitions that end more than QUERY_LOG_RETENTION_DAYS ago are
+written to QUERY_LOG_ARCHIVE_FOLDER as gzipped JSON lines, one file per
+partition, then detached and dropped, without a DELETE. Other databases have
+no partitions: there the same months are archived and then deleted in batches.
+"""
+import argparse
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+from app.core.config import settings
+from app.core.database import SessionLocal, engine
+from app.core.metrics import QUERY_LOG_DROPPED, QUERY_LOG_FLUSHES, QUERY_LOG_PENDING
+from app.db import models
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary application-wide keys for the PostgreSQL advisory locks of the
+# maintenance pass and of partition creation, which it includes
+ADVISORY_LOCK_KEY = 0x514C4F47
+PARTITION_LOCK_KEY = 0x514C4F48
+LEGACY_PARTITION = "queries_legacy"
+DEFAULT_PARTITION = "queries_default"
+PARTITION_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def _month_start(moment: datetime.datetime) -> datetime.datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(start: datetime.datetime) -> datetime.datetime:
+    return (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+def _partition_name(start: datetime.datetime) -> str:
+    return f"queries_p{start:%Y%m}"
+
+
+# Partitions (PostgreSQL)
+def _relkind(connection: Connection) -> Optional[str]:
+    # 'p' partitioned, 'r' plain table, None missing
+    return connection.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('queries')")).scalar()
+
+
+def _convert_to_partitioned(connection: Connection) -> None:
+    """Turn a plain queries table into the partition of everything before next month."""
+    connection.execute(text("LOCK TABLE queries IN ACCESS EXCLUSIVE MODE"))
+    if _relkind(connection) != "r":
+        return
+    upper = _next_month(_month_start(datetime.datetime.utcnow()))
+    connection.execute(text("UPDATE queries SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL"))
+    connection.execute(text(f"ALTER TABLE queries RENAME TO {LEGACY_PARTITION}"))
+    # Free the names the new table's indexes take
+    connection.execute(text(f"ALTER INDEX IF EXISTS ix_queries_user_created_id RENAME TO ix_{LEGACY_PARTITION}_user_created_id"))
+    connection.execute(text(f"ALTER INDEX IF EXISTS ix_queries_id RENAME TO ix_{LEGACY_PARTITION}_id"))
+    # The partition key can't be NULL
+    connection.execute(text(f"ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN created_at SET NOT NULL"))
+    # A partition can't keep a primary key other than its parent's: swap the
+    # (id) key for (id, created_at), which ATTACH then adopts. Building it over
+    # the old rows is the slow part, once, for a large table
+    connection.execute(text(f"ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT queries_pkey"))
+    connection.execute(text(f"ALTER TABLE {LEGACY_PARTITION} ADD CONSTRAINT {LEGACY_PARTITION}_pkey PRIMARY KEY (id, created_at)"))
+    models.Query.__table__.create(connection)
+    connection.execute(text(
+        f"ALTER TABLE queries ATTACH PARTITION {LEGACY_PARTITION} FOR VALUES FROM (MINVALUE) TO ('{upper.isoformat()}')"
+    ))
+    logger.info(f"Converted queries to a partitioned table; old rows are in {LEGACY_PARTITION}")
+
+
+def _create_partitions(connection: Connection) -> List[str]:
+    created = []
+    start = _month_start(datetime.datetime.utcnow())
+    for _ in range(settings.QUERY_LOG_PARTITIONS_AHEAD + 1):
+        end = _next_month(start)
+        name = _partition_name(start)
+        if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+            try:
+                with connection.begin_nested():
+                    connection.execute(text(
+                        f"CREATE TABLE {name} PARTITION OF queries FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                    ))
+                created.append(name)
+            except DBAPIError as e:
+                # The month of a conversion is covered by queries_legacy
+                logger.info(f"Partition {name} not created: {str(e.orig)}")
+        start = end
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF queries DEFAULT"))
+    return created
+
+
+def convert_to_partitioned(bind: Engine = engine) -> bool:
+    """One-time migration of a plain queries table; whether there was one to convert."""
+    if bind.dialect.name != "postgresql":
+        return False
+    with bind.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+        if _relkind(connection) != "r":
+            return False
+        _convert_to_partitioned(connection)
+        _create_partitions(connection)
+    return True
+
+
+def ensure_query_partitions(bind: Engine = engine) -> List[str]:
+    """Create the coming months' partitions; PostgreSQL only."""
+    if bind.dialect.name != "postgresql":
+        return []
+    with bind.begin() as connection:
+        # Every worker runs this at startup: one at a time
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+        kind = _relkind(connection)
+        if kind == "r":
+            logger.warning("queries is not partitioned yet, run: python -m app.db.query_log convert")
+        if kind != "p":
+            return []
+        return _create_partitions(connection)
+
+
+def list_partitions(connection: Connection) -> List[Tuple[str, Optional[datetime.datetime]]]:
+    """(name, exclusive upper bound) of each partition; None for the default one."""
+    rows = connection.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'queries'::regclass
+        ORDER BY c.relname
+    """)).all()
+    partitions = []
+    for name, bound in rows:
+        match = PARTITION_BOUND.search(bound or "")
+        partitions.append((name, datetime.datetime.fromisoformat(match.group(1)) if match else None))
+    return partitions
+
+
+# Archival
+def _write_archive(connection: Connection, statement, name: str) -> Tuple[str, int]:
+    """Stream the rows of `statement` into <archive folder>/<name>.jsonl.gz; (path, rows)."""
+    os.makedirs(settings.QUERY_LOG_ARCHIVE_FOLDER, exist_ok=True)
+    path = os.path.join(settings.QUERY_LOG_ARCHIVE_FOLDER, f"{name}.jsonl.gz")
+    tmp_path = f"{path}.tmp"
+    rows = 0
+    try:
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            result = connection.execute(statement.execution_options(stream_results=True, yield_per=1000))
+            for row in result.mappings():
+                f.write(json.dumps({
+                    "id": row["id"],
+                    "user_id": row["user_id"],
+                    "question": row["question"],
+                    "answer": row["answer"],
+                    "created_at": row["created_at"].isoformat() if row["created_at"] else None
+                }) + "\n")
+                rows += 1
+        # On disk before the rows are dropped
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path, rows
+
+
+def _archive_partitions(connection: Connection, cutoff: datetime.datetime) -> List[Dict[str, object]]:
+    archived = []
+    for name, upper in list_partitions(connection):
+        if upper is None or upper > cutoff:
+            continue
+        path, rows = _write_archive(
+            connection,
+            text(f"SELECT id, user_id, question, answer, created_at FROM {name} ORDER BY created_at, id"),
+            name
+        )
+        # A brief exclusive lock on queries; nothing is deleted row by row
+        connection.execute(text(f"ALTER TABLE queries DETACH PARTITION {name}"))
+        connection.execute(text(f"DROP TABLE {name}"))
+        connection.commit()
+        archived.append({"partition": name, "rows": rows, "file": path})
+    return archived
+
+
+def _archive_months(connection: Connection, cutoff: datetime.datetime) -> List[Dict[str, object]]:
+    """Without partitions: archive whole months before the cutoff, then delete them."""
+    archived = []
+    oldest = connection.execute(select(func.min(models.Query.created_at))).scalar()
+    connection.commit()
+    if oldest is None:
+        return archived
+    start = _month_start(oldest)
+    while _next_month(start) <= cutoff:
+        end = _next_month(start)
+        in_month = (models.Query.created_at >= start) & (models.Query.created_at < end)
+        name = _partition_name(start)
+        path, rows = _write_archive(
+            connection,
+            select(models.Query.id, models.Query.user_id, models.Query.question, models.Query.answer, models.Query.created_at)
+            .where(in_month).order_by(models.Query.created_at, models.Query.id),
+            name
+        )
+        connection.commit()
+        while True:
+            ids = connection.execute(select(models.Query.id).where(in_month).limit(settings.REAPER_BATCH_SIZE)).scalars().all()
+            if not ids:
+                break
+            connection.execute(delete(models.Query).where(in_month, models.Query.id.in_(ids)))
+            connection.commit()
+        archived.append({"partition": name, "rows": rows, "file": path})
+        start = end
+    return archived
+
+
+def archive_expired(bind: Engine = engine) -> List[Dict[str, object]]:
+    """Archive and drop the months that ended before the retention period."""
+    if settings.QUERY_LOG_RETENTION_DAYS <= 0:
+        return []
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=settings.QUERY_LOG_RETENTION_DAYS)
+    with bind.connect() as connection:
+        if bind.dialect.name == "postgresql" and _relkind(connection) == "p":
+            return _archive_partitions(connection, cutoff)
+        return _archive_months(connection, cutoff)
+
+
+# Writes
+class IdBlocks:
+    """Ids of one table, reserved from id_blocks a block at a time.
+
+    Blocks are shared by every worker through the row lock on id_blocks; ids
+    are unique but only roughly ordered across workers.
+    """
+
+    def __init__(self, name: str, model, block_size: int):
+        self.name = name
+        self.model = model
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> Tuple[int, int]:
+        while True:
+            with engine.begin() as connection:
+                updated = connection.execute(
+                    update(models.IdBlock)
+                    .where(models.IdBlock.name == self.name)
+                    .values(next_id=models.IdBlock.next_id + self.block_size)
+                ).rowcount
+                if updated:
+                    end = connection.execute(select(models.IdBlock.next_id).where(models.IdBlock.name == self.name)).scalar()
+                    return end - self.block_size, end
+            # First use: continue after the rows written before id blocks existed
+            try:
+                with engine.begin() as connection:
+                    start = connection.execute(select(func.coalesce(func.max(self.model.id), 0) + 1)).scalar()
+                    connection.execute(insert(models.IdBlock).values(name=self.name, next_id=start))
+            except IntegrityError:
+                # Another worker got there first
+                pass
+
+    def next(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve()
+            value = self._next
+            self._next += 1
+            return value
+
+
+class QueryLog:
+    def __init__(self):
+        self.ids = IdBlocks("queries", models.Query, settings.QUERY_LOG_ID_BLOCK)
+        # Oldest first; rows leave only once written
+        self._pending: List[models.Query] = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._task = None
+        self.written = 0
+        self.failed_flushes = 0
+        # Rows dropped from the front of a full queue, ever, and as of the last
+        # successful flush (to log once per outage)
+        self.dropped = 0
+        self._dropped_at_last_flush = 0
+        self.last_maintenance: Dict[str, object] = {}
+
+    def append(self, question: str, answer: str, user_id: int) -> models.Query:
+        """Queue an answered question; the returned row already has its id."""
+        query = models.Query(
+            id=self.ids.next(),
+            question=question,
+            answer=answer,
+            user_id=user_id,
+            created_at=datetime.datetime.utcnow()
+        )
+        if settings.QUERY_LOG_FLUSH_SECONDS <= 0:
+            self._insert([query])
+            return query
+        with self._condition:
+            self._pending.append(query)
+            QUERY_LOG_PENDING.inc()
+            overflow = len(self._pending) - settings.QUERY_LOG_MAX_PENDING
+            if overflow > 0:
+                self._drop_oldest(overflow)
+            if len(self._pending) >= settings.QUERY_LOG_BATCH_SIZE:
+                self._condition.notify()
+            if self._thread is None:
+                self._start_writer()
+        return query
+
+    def _drop_oldest(self, count: int) -> None:
+        # Under self._condition
+        if self.dropped == self._dropped_at_last_flush:
+            logger.error(
+                f"Query log queue full ({settings.QUERY_LOG_MAX_PENDING} rows), dropping the oldest "
+                f"unwritten answers until the database can be written again"
+            )
+        del self._pending[:count]
+        self.dropped += count
+        QUERY_LOG_PENDING.dec(count)
+        QUERY_LOG_DROPPED.inc(count)
+
+    def _start_writer(self) -> None:
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._stopping or len(self._pending) >= settings.QUERY_LOG_BATCH_SIZE,
+                    timeout=settings.QUERY_LOG_FLUSH_SECONDS
+                )
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def _insert(self, batch: List[models.Query]) -> None:
+        with SessionLocal() as db:
+            db.execute(insert(models.Query), [
+                {
+                    "id": query.id,
+                    "question": query.question,
+                    "answer": query.answer,
+                    "created_at": query.created_at,
+                    "user_id": query.user_id
+                }
+                for query in batch
+            ])
+            db.commit()
+
+    def flush(self) -> int:
+        """Write everything queued; on failure it stays queued for the next flush."""
+        with self._flush_lock:
+            with self._condition:
+                # Bounded, for the backlog after the database was unreachable
+                batch = self._pending[:settings.QUERY_LOG_BATCH_SIZE * 4]
+                dropped_before = self.dropped
+            if not batch:
+                return 0
+            try:
+                self._insert(batch)
+            except Exception as e:
+                self.failed_flushes += 1
+                QUERY_LOG_FLUSHES.labels("error").inc()
+                logger.error(f"Writing {len(batch)} queries failed, will retry: {str(e)}")
+                return 0
+            with self._condition:
+                # Appends go to the end and only drops remove rows meanwhile,
+                # from the front: what is left of the batch is still the prefix
+                remaining = max(0, len(batch) - (self.dropped - dropped_before))
+                del self._pending[:remaining]
+                if self.dropped != self._dropped_at_last_flush:
+                    logger.warning(f"Query log writable again; {self.dropped - self._dropped_at_last_flush} answers were dropped")
+                    self._dropped_at_last_flush = self.dropped
+            QUERY_LOG_PENDING.dec(remaining)
+            QUERY_LOG_FLUSHES.labels("ok").inc()
+            self.written += len(batch)
+            return len(batch)
+
+    def with_pending(self, user_id: int, rows: list, cursor: Optional[str], limit: int) -> list:
+        """Merge the user's queued rows into the first history page read from the database.
+
+        `rows` is the page with its extra row (keyset_page); queued rows are
+        the newest, so later pages never need them.
+        """
+        if cursor:
+            return rows
+        with self._condition:
+            pending = [query for query in self._pending if query.user_id == user_id]
+        if not pending:
+            return rows
+        # Written but not yet dequeued: in both
+        written = {row.id for row in rows}
+        merged = [query for query in pending if query.id not in written] + list(rows)
+        merged.sort(key=lambda query: (query.created_at, query.id), reverse=True)
+        return merged[:limit + 1]
+
+    def maintain(self) -> Dict[str, object]:
+        """Create the coming partitions and archive expired months."""
+        with engine.connect() as connection:
+            if engine.dialect.name == "postgresql":
+                locked = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}).scalar()
+                connection.commit()
+                if not locked:
+                    return {"skipped": "another worker is maintaining the query log"}
+            try:
+                result: Dict[str, object] = {
+                    "created": ensure_query_partitions(),
+                    "archived": archive_expired()
+                }
+            finally:
+                if engine.dialect.name == "postgresql":
+                    connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+                    connection.commit()
+        self.last_maintenance = {"at": datetime.datetime.utcnow().isoformat(), **result}
+        return result
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.QUERY_LOG_MAINTENANCE_INTERVAL_SECONDS)
+            try:
+                await asyncio.to_thread(self.maintain)
+            except Exception as e:
+                logger.error(f"Query log maintenance failed: {str(e)}")
+
+    async def start(self) -> None:
+        if settings.QUERY_LOG_MAINTENANCE_INTERVAL_SECONDS > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        with self._condition:
+            thread = self._thread
+            self._stopping = True
+            self._condition.notify()
+        if thread is not None:
+            # The writer flushes once more on its way out
+            await asyncio.to_thread(thread.join, 30)
+            self._thread = None
+        await asyncio.to_thread(self.flush)
+
+    def stats(self) -> Dict[str, object]:
+        with self._condition:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "written": self.written,
+            "failed_flushes": self.failed_flushes,
+            "dropped": self.dropped,
+            "last_maintenance": self.last_maintenance
+        }
+
+
+query_log = QueryLog()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["convert", "partitions", "maintain"])
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.command == "convert":
+        # Nothing to do on a partitioned, missing (created partitioned) or non-PostgreSQL table
+        print(json.dumps({"converted": convert_to_partitioned()}), flush=True)
+        return 0
+    if args.command == "maintain":
+        print(json.dumps(query_log.maintain(), indent=2), flush=True)
+        return 0
+    if engine.dialect.name != "postgresql":
+        print("queries is not partitioned on this database", file=sys.stderr)
+        return 1
+    with engine.connect() as connection:
+        partitions = [
+            {
+                "partition": name,
+                "until": upper.isoformat() if upper else None,
+                "rows": connection.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+            }
+            for name, upper in list_partitions(connection)
+        ]
+    print(json.dumps(partitions, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""HTTP client of the frontend: one pooled session, calls off the UI thread.
+
+Event handlers must not block: an answer can take as long as the LLM takes to
+generate it. `ApiClient.submit` runs a call on a small thread pool and hands
+the result (or the error) to a callback; it returns a `Call` that can be
+cancelled. Calls submitted under the same key replace each other, so only
+the latest list refresh or question is ever shown.
+
+All calls share one `requests.Session`, whose connections are kept alive and
+reused instead of opening a new one per request.
+
+Document and history listings are cached with their ETag. A refresh sends
+If-None-Match and gets a 304 without a body when nothing changed, and the
+cached list can be shown at once while the refresh runs.
+
+Uploads stream the file from disk in multipart form (`MultipartFile`)
+instead of reading it into memory first.
+"""
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_POOL_SIZE = int(os.environ.get("API_POOL_SIZE", "8"))
+API_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("API_CONNECT_TIMEOUT_SECONDS", "5"))
+# Answers are generated while the request waits
+API_READ_TIMEOUT_SECONDS = float(os.environ.get("API_READ_TIMEOUT_SECONDS", "300"))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+
+class ApiError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"{status_code} - {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class Call:
+    """Handle of a submitted call. Once cancelled, its callbacks never run.
+
+    A request already on the wire still completes on its worker thread;
+    only its result is dropped.
+    """
+
+    def __init__(self):
+        self.future = None
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+
+class MultipartFile:
+    """A multipart/form-data body read from disk as it is sent.
+
+    Has a length, so requests sends a Content-Length instead of chunking.
+    """
+
+    def __init__(self, fields: Dict[str, str], name: str, path: str, filename: str,
+                 content_type: str = "application/octet-stream",
+                 progress: Optional[Callable[[int, int], None]] = None):
+        self.boundary = uuid.uuid4().hex
+        self.path = path
+        self.progress = progress
+        # Escaped as browsers do, so a name can't end the quoted value early
+        filename = filename.replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+        head = b"".join(
+            self._part_header(f'name="{key}"') + str(value).encode() + b"\r\n"
+            for key, value in fields.items()
+        )
+        self._head = head + self._part_header(
+            f'name="{name}"; filename="{filename}"', f"Content-Type: {content_type}\r\n"
+        )
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self.file_size = os.path.getsize(path)
+
+    def _part_header(self, disposition: str, extra: str = "") -> bytes:
+        return f"--{self.boundary}\r\nContent-Disposition: form-data; {disposition}\r\n{extra}\r\n".encode()
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return len(self._head) + self.file_size + len(self._tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._head
+        sent = 0
+        with open(self.path, "rb") as f:
+            for block in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+                sent += len(block)
+                yield block
+                if self.progress:
+                    self.progress(sent, self.file_size)
+        yield self._tail
+
+
+class ApiClient:
+    def __init__(self, base_url: str, pool_size: int = API_POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="api")
+        # Latest call per key
+        self._calls: Dict[str, Call] = {}
+        # (path, params) -> (etag, data)
+        self._cache: Dict[Tuple[str, Tuple], Tuple[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    # Authentication
+    def set_token(self, token: str) -> None:
+        """Switch user: drops the cache and cancels everything in flight."""
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        else:
+            self.session.headers.pop("Authorization", None)
+        with self._lock:
+            self._cache.clear()
+            calls = list(self._calls.values())
+            self._calls.clear()
+        for call in calls:
+            call.cancel()
+
+    # Dispatch
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        on_done: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        key: Optional[str] = None
+    ) -> Call:
+        """Run `fn(*args)` on a worker thread, then `on_done(result)` or `on_error(exception)`."""
+        call = Call()
+        if key is not None:
+            with self._lock:
+                previous = self._calls.get(key)
+                self._calls[key] = call
+            if previous is not None:
+                previous.cancel()
+
+        def run() -> None:
+            try:
+                if call.cancelled:
+                    return
+                result = fn(*args)
+            except Exception as e:
+                if not call.cancelled and on_error:
+                    on_error(e)
+                return
+            finally:
+                if key is not None:
+                    with self._lock:
+                        if self._calls.get(key) is call:
+                            del self._calls[key]
+            if not call.cancelled and on_done:
+                on_done(result)
+
+        call.future = self._executor.submit(run)
+        return call
+
+    def cancel(self, key: str) -> None:
+        with self._lock:
+            call = self._calls.pop(key, None)
+        if call is not None:
+            call.cancel()
+
+    # Requests
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", (API_CONNECT_TIMEOUT_SECONDS, API_READ_TIMEOUT_SECONDS))
+        response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        if response.status_code >= 400:
+            try:
+                detail = response.json().get("detail", response.text)
+            except ValueError:
+                detail = response.text
+            raise ApiError(response.status_code, str(detail))
+        return response
+
+    def cached(self, path: str, params: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        entry = self._cache.get((path, tuple(sorted((params or {}).items()))))
+        return entry[1] if entry else None
+
+    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Tuple[Any, bool, Optional[str]]:
+        """(data, whether it changed since the cached copy, next page cursor)."""
+        cache_key = (path, tuple(sorted((params or {}).items())))
+        entry = self._cache.get(cache_key)
+        # After an upload or a delete the server's ETag differs: nothing to invalidate
+        headers = {"If-None-Match": entry[0]} if entry else {}
+        authorization = self.session.headers.get("Authorization")
+        response = self.request("GET", path, params=params, headers=headers)
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if response.status_code == 304 and entry:
+            return entry[1], False, next_cursor
+        data = response.json()
+        with self._lock:
+            # Not if the user logged out meanwhile
+            if response.headers.get("ETag") and self.session.headers.get("Authorization") == authorization:
+                self._cache[cache_key] = (response.headers["ETag"], data)
+        return data, True, next_cursor
+
+    # Endpoints
+    def login(self, email: str, password: str) -> str:
+        response = self.request("POST", "/auth/token", data={"username": email, "password": password})
+        return response.json().get("access_token")
+
+    def register(self, email: str, password: str) -> Dict[str, Any]:
+        return self.request("POST", "/auth/register", params={"email": email, "password": password}).json()
+
+    def cached_documents(self) -> Optional[List[Dict[str, Any]]]:
+        return self.cached("/documents/")
+
+    def list_documents(self) -> Tuple[List[Dict[str, Any]], bool]:
+        """The first page of documents (the newest 100) and whether it changed."""
+        documents, changed, _ = self.get_json("/documents/")
+        return documents, changed
+
+    def upload_document(self, path: str, filename: str, title: str,
+                        progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+        body = MultipartFile({"title": title}, "file", path, filename, progress=progress)
+        return self.request("POST", "/documents/", data=body, headers={"Content-Type": body.content_type}).json()
+
+    def delete_document(self, document_id: int) -> Dict[str, Any]:
+        return self.request("DELETE", f"/documents/{document_id}").json()
+
+    def ask(self, question: str) -> Dict[str, Any]:
+        return self.request("POST", "/queries/", params={"question": question}).json()
+
+    def cached_history(self) -> Optional[List[Dict[str, Any]]]:
+        return self.cached("/queries/history")
+
+    def query_history(self) -> Tuple[List[Dict[str, Any]], bool]:
+        """The newest page of questions and whether it changed."""
+        history, changed, _ = self.get_json("/queries/history")
+        return history, changed
+
+    def close(self) -> None:
+        self.set_token("")
+        self._executor.shutdown(wait=False)
+        self.session.close()
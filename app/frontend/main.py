@@ -1,8 +1,11 @@
 import flet as ft
-import requests
+import json
 import os
+import threading
 import traceback
 
+from app.frontend.api_client import ApiClient, ApiError
+
 # API configuration
 API_BASE_URL = os.environ.get("API_BASE_URL", "http://10.128.0.9:8000/api/v1")  # Default to web-server internal IP
 
@@ -14,6 +17,9 @@ def main(page: ft.Page):
     
     # Define variables in function scope
     TOKEN = ""
+    # One pooled session per browser session; calls run off the UI thread
+    api = ApiClient(API_BASE_URL)
+    page.on_close = lambda _: api.close()
     current_view = "login"  # Instead of tabs, track the current view
     
     # Login form components
@@ -33,9 +39,14 @@ def main(page: ft.Page):
         max_lines=4,
         width=600
     )
+    ask_button = ft.ElevatedButton("Ask", on_click=lambda e: handle_ask_question(e))
+    cancel_button = ft.OutlinedButton("Cancel", visible=False, on_click=lambda e: handle_cancel_question(e))
     
     # Results containers
     documents_list = ft.Column(spacing=10)
+    # Status line of each listed document, updated from the progress event stream
+    document_status_texts = {}
+    events_stop = threading.Event()
     query_result = ft.Text("", selectable=True)
     query_history = ft.Column(spacing=10)
     
@@ -152,7 +163,7 @@ def main(page: ft.Page):
                 ft.Container(
                     content=ft.Column([
                         query_input,
-                        ft.ElevatedButton("Ask", on_click=handle_ask_question),
+                        ft.Row([ask_button, cancel_button]),
                         ft.Container(height=10),
                         ft.Text("Answer:", size=16, weight=ft.FontWeight.BOLD),
                         query_result
@@ -171,229 +182,316 @@ def main(page: ft.Page):
     
     # Authentication handlers
     def handle_login(e):
-        nonlocal TOKEN
+        def logged_in(token):
+            nonlocal TOKEN
+            TOKEN = token
+            api.set_token(token)
+            nav_bar.visible = True
+            start_document_events()
+            switch_view("documents")
         
-        try:
-            response = requests.post(
-                f"{API_BASE_URL}/auth/token",
-                data={
-                    "username": email_input.value,
-                    "password": password_input.value
-                }
-            )
-            
-            if response.status_code == 200:
-                TOKEN = response.json().get("access_token")
-                nav_bar.visible = True
-                switch_view("documents")
-            else:
+        def failed(ex):
+            if isinstance(ex, ApiError):
                 login_error_text.value = "Invalid email or password"
-                page.update()
-        except Exception as ex:
-            login_error_text.value = f"Error: {str(ex)}"
+            else:
+                login_error_text.value = handle_request_error(ex, "Login")
             page.update()
+        
+        api.submit(api.login, email_input.value, password_input.value, on_done=logged_in, on_error=failed, key="auth")
     
     def handle_register(e):
-        try:
-            response = requests.post(
-                f"{API_BASE_URL}/auth/register",
-                params={
-                    "email": email_input.value,
-                    "password": password_input.value
-                }
-            )
-            
-            if response.status_code == 201:
-                login_error_text.value = "Registration successful. Please login."
-                login_error_text.color = "green"
-            else:
-                login_error_text.value = f"Registration failed: {response.status_code}"
-                login_error_text.color = "red"
-            
+        def registered(_):
+            login_error_text.value = "Registration successful. Please login."
+            login_error_text.color = "green"
             page.update()
-        except Exception as ex:
-            login_error_text.value = f"Error: {str(ex)}"
+        
+        def failed(ex):
+            if isinstance(ex, ApiError):
+                login_error_text.value = f"Registration failed: {ex.status_code}"
+            else:
+                login_error_text.value = handle_request_error(ex, "Registration")
+            login_error_text.color = "red"
             page.update()
+        
+        api.submit(api.register, email_input.value, password_input.value, on_done=registered, on_error=failed, key="auth")
     
     def handle_logout():
         nonlocal TOKEN
         TOKEN = ""
+        # Cancels whatever is in flight and forgets the cached lists
+        api.set_token("")
+        events_stop.set()
+        documents_list.controls.clear()
+        document_status_texts.clear()
+        query_history.controls.clear()
+        query_result.value = ""
+        set_asking(False)
         switch_view("login")
     
+    # Processing progress pushed by the server instead of polling the document list
+    def format_status(event):
+        status = event.get("status")
+        if status == "done":
+            return "Processed"
+        if status == "failed":
+            return f"Failed: {event.get('error', 'unknown error')}"
+        if status == "extracting" and event.get("total_pages"):
+            return f"Extracting text... page {event.get('pages', 0)}/{event['total_pages']}"
+        if status == "chunking":
+            return f"Split into {event.get('chunks', 0)} chunks..."
+        if status == "embedding":
+            return f"Embedding... {event.get('chunks_embedded', 0)}/{event.get('chunks', 0)} chunks"
+        return "Processing..."
+    
+    def handle_document_event(event):
+        document_id = event.get("document_id")
+        status_text = document_status_texts.get(document_id)
+        deleted = event.get("status") == "deleted"
+        if status_text is None and deleted:
+            return
+        if status_text is None or deleted:
+            # Uploaded or deleted elsewhere (another tab): the list itself changed
+            if current_view == "documents":
+                fetch_documents()
+            return
+        status_text.value = f"Status: {format_status(event)}"
+        page.update()
+    
+    def listen_for_document_events(token, stop):
+        """Background thread reading the server-sent event stream until logout."""
+        while not stop.is_set():
+            try:
+                # On the shared session; the stream holds one pooled connection
+                with api.session.get(
+                    f"{API_BASE_URL}/documents/events",
+                    headers={"Authorization": f"Bearer {token}", "Accept": "text/event-stream"},
+                    stream=True,
+                    timeout=(5, 60)  # the server sends a keep-alive every 15s
+                ) as response:
+                    if response.status_code == 401:
+                        return
+                    response.raise_for_status()
+                    data_lines = []
+                    for line in response.iter_lines(decode_unicode=True):
+                        if stop.is_set():
+                            return
+                        if line.startswith("data:"):
+                            data_lines.append(line[5:].strip())
+                        elif not line and data_lines:
+                            handle_document_event(json.loads("\n".join(data_lines)))
+                            data_lines = []
+            except Exception as ex:
+                print(f"Document events error: {str(ex)}")
+            # Connection dropped: reconnect, the server replays documents in progress
+            stop.wait(3)
+    
+    def start_document_events():
+        nonlocal events_stop
+        events_stop.set()
+        events_stop = threading.Event()
+        threading.Thread(
+            target=listen_for_document_events,
+            args=(TOKEN, events_stop),
+            daemon=True
+        ).start()
+    
     # Document management handlers
+    def show_message(message):
+        page.snack_bar = ft.SnackBar(ft.Text(message))
+        page.snack_bar.open = True
+        page.update()
+    
     def handle_upload(e):
         if not title_input.value or "No file selected" in picked_files.value:
-            page.snack_bar = ft.SnackBar(ft.Text("Please select a file and enter a title"))
-            page.snack_bar.open = True
-            page.update()
+            show_message("Please select a file and enter a title")
             return
         
-        try:
-            upload_file = file_picker.result.files[0]
-            
-            with open(upload_file.path, "rb") as file_data:
-                files = {"file": (upload_file.name, file_data, "application/octet-stream")}
-                response = requests.post(
-                    f"{API_BASE_URL}/documents/",
-                    headers={"Authorization": f"Bearer {TOKEN}"},
-                    files=files,
-                    data={"title": title_input.value}
+        upload_file = file_picker.result.files[0]
+        last_percent = -1
+        
+        def progress(sent, total):
+            nonlocal last_percent
+            percent = sent * 100 // total if total else 100
+            if percent != last_percent:
+                last_percent = percent
+                picked_files.value = f"Uploading {upload_file.name}... {percent}%"
+                page.update()
+        
+        def uploaded(_):
+            title_input.value = ""
+            picked_files.value = "No file selected"
+            show_message("Document uploaded successfully")
+            fetch_documents()
+        
+        def failed(ex):
+            picked_files.value = f"Selected file: {upload_file.name}"
+            if isinstance(ex, ApiError):
+                show_message(f"Upload failed: {ex.status_code}")
+            else:
+                show_message(handle_request_error(ex, "Upload"))
+                print(f"Upload error details: {''.join(traceback.format_exception(type(ex), ex, ex.__traceback__))}")
+        
+        # The file is streamed from disk, not read into memory
+        api.submit(
+            api.upload_document, upload_file.path, upload_file.name, title_input.value, progress,
+            on_done=uploaded, on_error=failed, key=f"upload:{upload_file.path}"
+        )
+    
+    def render_documents(documents):
+        documents_list.controls.clear()
+        document_status_texts.clear()
+        
+        if not documents:
+            documents_list.controls.append(
+                ft.Text("No documents found. Upload some documents to get started.")
+            )
+        else:
+            for doc in documents:
+                status = "Processed" if doc.get("processed", False) else "Processing..."
+                status_text = ft.Text(f"Status: {status}")
+                document_status_texts[doc["id"]] = status_text
+                doc_item = ft.Container(
+                    content=ft.Column([
+                        ft.Row([
+                            ft.Text(doc["title"], weight=ft.FontWeight.BOLD),
+                            status_text
+                        ]),
+                        ft.Row([
+                            ft.OutlinedButton(
+                                "Delete",
+                                on_click=lambda e, doc_id=doc["id"]: delete_document(doc_id)
+                            )
+                        ], alignment=ft.MainAxisAlignment.END)
+                    ]),
+                    padding=10,
+                    border=ft.border.all(1, ft.colors.GREY_400),
+                    border_radius=5,
+                    margin=ft.margin.only(bottom=10)
                 )
-                
-                if response.status_code == 200:
-                    page.snack_bar = ft.SnackBar(ft.Text("Document uploaded successfully"))
-                    page.snack_bar.open = True
-                    title_input.value = ""
-                    picked_files.value = "No file selected"
-                    fetch_documents()
-                else:
-                    page.snack_bar = ft.SnackBar(ft.Text(f"Upload failed: {response.status_code}"))
-                    page.snack_bar.open = True
-        except Exception as ex:
-            page.snack_bar = ft.SnackBar(ft.Text(f"Error: {str(ex)}"))
-            page.snack_bar.open = True
-            print(f"Upload error details: {traceback.format_exc()}")
+                documents_list.controls.append(doc_item)
         
         page.update()
     
     def fetch_documents():
-        try:
-            response = requests.get(
-                f"{API_BASE_URL}/documents/",
-                headers={"Authorization": f"Bearer {TOKEN}"}
-            )
-            
-            if response.status_code == 200:
-                documents = response.json()
-                documents_list.controls.clear()
-                
-                if not documents:
-                    documents_list.controls.append(
-                        ft.Text("No documents found. Upload some documents to get started.")
-                    )
-                else:
-                    for doc in documents:
-                        status = "Processed" if doc.get("processed", False) else "Processing..."
-                        doc_item = ft.Container(
-                            content=ft.Column([
-                                ft.Row([
-                                    ft.Text(doc["title"], weight=ft.FontWeight.BOLD),
-                                    ft.Text(f"Status: {status}")
-                                ]),
-                                ft.Row([
-                                    ft.OutlinedButton(
-                                        "Delete",
-                                        on_click=lambda e, doc_id=doc["id"]: delete_document(doc_id)
-                                    )
-                                ], alignment=ft.MainAxisAlignment.END)
-                            ]),
-                            padding=10,
-                            border=ft.border.all(1, ft.colors.GREY_400),
-                            border_radius=5,
-                            margin=ft.margin.only(bottom=10)
-                        )
-                        documents_list.controls.append(doc_item)
-                
-                page.update()
-        except Exception as ex:
+        # Show the cached list at once; the refresh only redraws it when it changed
+        cached = api.cached_documents()
+        if cached is not None and not documents_list.controls:
+            render_documents(cached)
+        
+        def fetched(result):
+            documents, changed = result
+            if changed or not documents_list.controls:
+                render_documents(documents)
+        
+        def failed(ex):
             documents_list.controls.clear()
             documents_list.controls.append(
-                ft.Text(f"Error loading documents: {str(ex)}", color="red")
+                ft.Text(f"Error loading documents: {handle_request_error(ex, 'Document fetch')}", color="red")
             )
             page.update()
-            print(f"Document fetch error: {traceback.format_exc()}")
+            print(f"Document fetch error: {''.join(traceback.format_exception(type(ex), ex, ex.__traceback__))}")
+        
+        # A newer refresh replaces one still in flight
+        api.submit(api.list_documents, on_done=fetched, on_error=failed, key="documents")
     
     def delete_document(document_id):
-        try:
-            response = requests.delete(
-                f"{API_BASE_URL}/documents/{document_id}",
-                headers={"Authorization": f"Bearer {TOKEN}"}
-            )
-            
-            if response.status_code == 200:
-                page.snack_bar = ft.SnackBar(ft.Text("Document deleted successfully"))
-                page.snack_bar.open = True
-                fetch_documents()
+        def deleted(_):
+            show_message("Document deleted successfully")
+            fetch_documents()
+        
+        def failed(ex):
+            if isinstance(ex, ApiError):
+                show_message(f"Delete failed: {ex.status_code}")
             else:
-                page.snack_bar = ft.SnackBar(ft.Text(f"Delete failed: {response.status_code}"))
-                page.snack_bar.open = True
-            page.update()
-        except Exception as ex:
-            page.snack_bar = ft.SnackBar(ft.Text(f"Error: {str(ex)}"))
-            page.snack_bar.open = True
-            page.update()
+                show_message(handle_request_error(ex, "Delete"))
+        
+        api.submit(api.delete_document, document_id, on_done=deleted, on_error=failed, key=f"delete:{document_id}")
     
     # Query handlers
+    def set_asking(asking):
+        ask_button.disabled = asking
+        cancel_button.visible = asking
+    
     def handle_ask_question(e):
         if not query_input.value:
-            page.snack_bar = ft.SnackBar(ft.Text("Please enter a question"))
-            page.snack_bar.open = True
-            page.update()
+            show_message("Please enter a question")
             return
         
         query_result.value = "Processing your question..."
+        set_asking(True)
         page.update()
         
-        try:
-            response = requests.post(
-                f"{API_BASE_URL}/queries/",
-                headers={"Authorization": f"Bearer {TOKEN}"},
-                params={"question": query_input.value}
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                query_result.value = result["answer"]
-                query_input.value = ""  # Clear the input
-                fetch_query_history()  # Refresh history
-            else:
-                query_result.value = f"Error: {response.status_code} - {response.text}"
-            
+        def answered(result):
+            query_result.value = result["answer"]
+            query_input.value = ""  # Clear the input
+            set_asking(False)
+            fetch_query_history()  # Refresh history
             page.update()
-        except Exception as ex:
-            query_result.value = f"Error: {str(ex)}"
+        
+        def failed(ex):
+            if isinstance(ex, ApiError):
+                query_result.value = f"Error: {ex.status_code} - {ex.detail}"
+            else:
+                query_result.value = handle_request_error(ex, "Query")
+            set_asking(False)
             page.update()
+        
+        # The page stays responsive while the answer is generated
+        api.submit(api.ask, query_input.value, on_done=answered, on_error=failed, key="ask")
     
-    def fetch_query_history():
-        try:
-            response = requests.get(
-                f"{API_BASE_URL}/queries/history",
-                headers={"Authorization": f"Bearer {TOKEN}"}
+    def handle_cancel_question(e):
+        # The answer is dropped when it arrives; the server still saves it to the history
+        api.cancel("ask")
+        query_result.value = "Cancelled."
+        set_asking(False)
+        page.update()
+    
+    def render_history(queries):
+        query_history.controls.clear()
+        
+        if not queries:
+            query_history.controls.append(
+                ft.Text("No queries found. Ask some questions to get started.")
             )
-            
-            if response.status_code == 200:
-                queries = response.json()
-                query_history.controls.clear()
-                
-                if not queries:
-                    query_history.controls.append(
-                        ft.Text("No queries found. Ask some questions to get started.")
-                    )
-                else:
-                    for query in queries:
-                        query_item = ft.Container(
-                            content=ft.Column([
-                                ft.Text("Question:", weight=ft.FontWeight.BOLD),
-                                ft.Text(query["question"]),
-                                ft.Text("Answer:", weight=ft.FontWeight.BOLD),
-                                ft.Text(query["answer"], selectable=True),
-                                ft.Text(f"Created: {query['created_at']}", 
-                                       size=12, italic=True)
-                            ]),
-                            padding=10,
-                            border=ft.border.all(1, ft.colors.GREY_400),
-                            border_radius=5,
-                            margin=ft.margin.only(bottom=10)
-                        )
-                        query_history.controls.append(query_item)
-                
-                page.update()
-        except Exception as ex:
+        else:
+            for query in queries:
+                query_item = ft.Container(
+                    content=ft.Column([
+                        ft.Text("Question:", weight=ft.FontWeight.BOLD),
+                        ft.Text(query["question"]),
+                        ft.Text("Answer:", weight=ft.FontWeight.BOLD),
+                        ft.Text(query["answer"], selectable=True),
+                        ft.Text(f"Created: {query['created_at']}", 
+                               size=12, italic=True)
+                    ]),
+                    padding=10,
+                    border=ft.border.all(1, ft.colors.GREY_400),
+                    border_radius=5,
+                    margin=ft.margin.only(bottom=10)
+                )
+                query_history.controls.append(query_item)
+        
+        page.update()
+    
+    def fetch_query_history():
+        cached = api.cached_history()
+        if cached is not None and not query_history.controls:
+            render_history(cached)
+        
+        def fetched(result):
+            queries, changed = result
+            if changed or not query_history.controls:
+                render_history(queries)
+        
+        def failed(ex):
             query_history.controls.clear()
             query_history.controls.append(
-                ft.Text(f"Error loading history: {str(ex)}", color="red")
+                ft.Text(f"Error loading history: {handle_request_error(ex, 'History')}", color="red")
             )
             page.update()
+        
+        api.submit(api.query_history, on_done=fetched, on_error=failed, key="history")
+    
     def handle_request_error(e, error_type="Request"):
         """Handle request errors in GCP environment with proper logging"""
         error_details = str(e)
@@ -1,16 +1,34 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import uvicorn
 import os
 
+from app.core.admission import admission
+from app.core.compression import CompressionMiddleware
 from app.core.config import settings
-from app.core.database import Base, engine
-from app.api import auth, documents, queries
+from app.core.database import Base, engine, pool_status
+from app.core.hashing import password_hasher
+from app.core.metrics import render_metrics
+from app.core.principal_cache import principal_cache
+from app.core.profiling import ProfilingMiddleware
+from app.core.progress import progress_broker
+from app.core.tracing import TracingMiddleware
+from app.api import admin, auth, documents, queries
+from app.db.migrations import ensure_columns, ensure_indexes
+from app.db.query_log import ensure_query_partitions, query_log
+from app.rag.reaper import reaper
 
 # Create tables
 Base.metadata.create_all(bind=engine)
+ensure_columns(engine)
+# Coming months of the partitioned query log; converting a table from before
+# partitioning is a separate step (python -m app.db.query_log convert)
+ensure_query_partitions(engine)
+ensure_indexes(engine)
 
-app = FastAPI(title=settings.PROJECT_NAME)
+# orjson instead of the standard library encoder for every JSON response
+app = FastAPI(title=settings.PROJECT_NAME, default_response_class=ORJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -19,12 +37,55 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Trace-Id", "X-Profile-Id", "ETag"],
+)
+
+# Per-request span trees, see app/core/tracing.py
+app.add_middleware(TracingMiddleware)
+# cProfile for admin requests sending X-Profile: 1, see app/core/profiling.py
+app.add_middleware(ProfilingMiddleware)
+# gzip/br for large bodies; event streams and NDJSON are left alone
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MINIMUM_BYTES,
+    gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+    brotli_quality=settings.COMPRESSION_BROTLI_QUALITY
 )
 
 # Include routers
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["Authentication"])
 app.include_router(documents.router, prefix=f"{settings.API_V1_STR}/documents", tags=["Documents"])
 app.include_router(queries.router, prefix=f"{settings.API_V1_STR}/queries", tags=["Queries"])
+app.include_router(admin.router, prefix=f"{settings.API_V1_STR}/admin", tags=["Admin"])
+
+@app.on_event("startup")
+async def start_progress_broker():
+    await progress_broker.start()
+
+@app.on_event("shutdown")
+async def stop_progress_broker():
+    await progress_broker.stop()
+
+@app.on_event("startup")
+async def start_reaper():
+    await reaper.start()
+
+@app.on_event("shutdown")
+async def stop_reaper():
+    await reaper.stop()
+
+@app.on_event("startup")
+async def start_query_log():
+    await query_log.start()
+
+@app.on_event("shutdown")
+async def stop_query_log():
+    # Writes out the answers still queued
+    await query_log.stop()
+
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    password_hasher.shutdown()
 
 @app.get("/")
 def read_root():
@@ -32,7 +93,21 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "auth_cache": principal_cache.stats(),
+        "db_pools": pool_status(),
+        "admission": admission.stats(),
+        "progress": progress_broker.stats(),
+        "reaper": reaper.stats(),
+        "query_log": query_log.stats()
+    }
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint, aggregated across gunicorn workers."""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
 
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
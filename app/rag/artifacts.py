@@ -0,0 +1,142 @@
+"""Store of extracted document text, so nothing downstream has to re-parse files.
+
+Extraction (PyPDF2 above all) is the slowest ingestion step. Its output is
+kept as one gzip-compressed JSON artifact per (file content, extractor):
+
+    ARTIFACT_FOLDER/<sha256[:2]>/<sha256>.<extractor id>.json.gz
+
+holding the text and the offset where each page starts in it. The key is the
+SHA-256 of the file bytes, so re-uploads of the same file reuse the artifact,
+and the extractor id carries the library version and a revision number
+(document_processor.EXTRACTORS), so improving an extractor simply misses the
+old artifacts instead of serving stale text. Re-chunking or re-embedding
+(app/rag/reprocess.py) reads artifacts and only parses files that lack one.
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Callable, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import ARTIFACT_LOOKUPS
+from app.rag.document_processor import EXTRACTORS, extract_pages, extractor_for
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+class TextArtifact:
+    __slots__ = ("file_sha256", "extractor", "text", "page_offsets")
+
+    def __init__(self, file_sha256: str, extractor: str, text: str, page_offsets: List[int]):
+        self.file_sha256 = file_sha256
+        self.extractor = extractor
+        self.text = text
+        self.page_offsets = page_offsets
+
+    @classmethod
+    def from_pages(cls, file_sha256: str, extractor: str, pages: List[str]) -> "TextArtifact":
+        offsets, position = [], 0
+        for page in pages:
+            offsets.append(position)
+            position += len(page)
+        return cls(file_sha256, extractor, "".join(pages), offsets)
+
+    @property
+    def pages(self) -> List[str]:
+        bounds = self.page_offsets + [len(self.text)]
+        return [self.text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+    def page_at(self, offset: int) -> int:
+        """1-based page number containing a character offset."""
+        page = 0
+        for number, start in enumerate(self.page_offsets):
+            if start > offset:
+                break
+            page = number
+        return page + 1
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    def __init__(self, root: str = settings.ARTIFACT_FOLDER):
+        self.root = root
+
+    def path(self, sha256: str, extractor: str) -> str:
+        return os.path.join(self.root, sha256[:2], f"{sha256}.{extractor}.json.gz")
+
+    def get(self, sha256: str, extractor: str) -> Optional[TextArtifact]:
+        path = self.path(sha256, extractor)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            # Truncated or corrupt: treat as missing, it gets rewritten
+            logger.warning(f"Ignoring unreadable text artifact {path}: {str(e)}")
+            return None
+        if data.get("format") != FORMAT_VERSION:
+            return None
+        return TextArtifact(data["file_sha256"], data["extractor"], data["text"], data["page_offsets"])
+
+    def put(self, artifact: TextArtifact) -> str:
+        path = self.path(artifact.file_sha256, artifact.extractor)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = {
+            "format": FORMAT_VERSION,
+            "file_sha256": artifact.file_sha256,
+            "extractor": artifact.extractor,
+            "created_at": datetime.datetime.utcnow().isoformat(),
+            "page_offsets": artifact.page_offsets,
+            "text": artifact.text
+        }
+        # Written to a temporary file and renamed, so readers never see half an artifact
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as f:
+                f.write(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def load_or_extract(
+        self,
+        file_path: str,
+        content_type: str,
+        on_page: Optional[Callable[[int, int], None]] = None,
+        sha256: Optional[str] = None
+    ) -> TextArtifact:
+        """Return the file's artifact, extracting and storing it on a miss."""
+        extractor = EXTRACTORS[extractor_for(file_path, content_type)]
+        sha256 = sha256 or file_sha256(file_path)
+        artifact = self.get(sha256, extractor)
+        if artifact is not None:
+            ARTIFACT_LOOKUPS.labels("hit").inc()
+            return artifact
+        ARTIFACT_LOOKUPS.labels("miss").inc()
+        artifact = TextArtifact.from_pages(sha256, extractor, extract_pages(file_path, content_type, on_page))
+        try:
+            self.put(artifact)
+        except OSError as e:
+            # The artifact is an optimization; ingestion goes on without it
+            logger.error(f"Could not store text artifact for {file_path}: {str(e)}")
+        return artifact
+
+
+artifact_store = ArtifactStore()
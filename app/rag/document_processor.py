@@ -1,12 +1,17 @@
 import os
 import re
-from typing import List, Optional
+from typing import Callable, List, Optional
 from fastapi import UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 import PyPDF2
+import docx
 from docx import Document as DocxDocument
 import markdown
 from pathlib import Path
 from app.core.config import settings
+from app.core.metrics import track_ingestion_stage
+from app.core.progress import progress_broker
 
 # Function to create chunks of text
 def create_chunks(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
@@ -44,15 +49,21 @@ def create_chunks(text: str, chunk_size: int = 1000, overlap: int = 200) -> List
     
     return chunks
 
-# Function to extract text from PDF
-def extract_text_from_pdf(file_path: str) -> str:
-    text = ""
+# Function to extract text from PDF, one string per page
+def extract_pages_from_pdf(file_path: str, on_page: Optional[Callable[[int, int], None]] = None) -> List[str]:
+    pages = []
     with open(file_path, 'rb') as file:
         pdf_reader = PyPDF2.PdfReader(file)
-        for page_num in range(len(pdf_reader.pages)):
+        total_pages = len(pdf_reader.pages)
+        for page_num in range(total_pages):
             page = pdf_reader.pages[page_num]
-            text += page.extract_text() + "\n"
-    return text
+            pages.append(page.extract_text() + "\n")
+            if on_page is not None:
+                on_page(page_num + 1, total_pages)
+    return pages
+
+def extract_text_from_pdf(file_path: str, on_page: Optional[Callable[[int, int], None]] = None) -> str:
+    return "".join(extract_pages_from_pdf(file_path, on_page))
 
 # Function to extract text from DOCX
 def extract_text_from_docx(file_path: str) -> str:
@@ -79,57 +90,98 @@ def extract_text_from_txt(file_path: str) -> str:
     with open(file_path, 'r', encoding='utf-8') as file:
         return file.read()
 
+# Extractor ids include the library version and a revision to bump whenever an
+# extractor's output changes; stored text artifacts are keyed by them
+EXTRACTORS = {
+    "pdf": f"pdf-pypdf2-{PyPDF2.__version__}-r1",
+    "docx": f"docx-python-docx-{docx.__version__}-r1",
+    "markdown": f"markdown-{markdown.__version__}-r1",
+    "txt": "txt-r1",
+}
+
+def extractor_for(file_path: str, content_type: str) -> str:
+    content_type = content_type or ""
+    if "pdf" in content_type or file_path.endswith(".pdf"):
+        return "pdf"
+    elif "word" in content_type or file_path.endswith(".docx"):
+        return "docx"
+    elif "markdown" in content_type or file_path.endswith(".md"):
+        return "markdown"
+    elif "text/plain" in content_type or file_path.endswith(".txt"):
+        return "txt"
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {content_type}")
+
+def extract_pages(file_path: str, content_type: str, on_page: Optional[Callable[[int, int], None]] = None) -> List[str]:
+    """Extract a file's text as pages; formats without pages come back as one page."""
+    kind = extractor_for(file_path, content_type)
+    if kind == "pdf":
+        return extract_pages_from_pdf(file_path, on_page)
+    elif kind == "docx":
+        return [extract_text_from_docx(file_path)]
+    elif kind == "markdown":
+        return [extract_text_from_markdown(file_path)]
+    return [extract_text_from_txt(file_path)]
+
+# Function to pick the extractor for a file
+def extract_text(file_path: str, content_type: str, on_page: Optional[Callable[[int, int], None]] = None) -> str:
+    """Extract the text of a file; on_page(done, total) reports progress for paged formats."""
+    return "".join(extract_pages(file_path, content_type, on_page))
+
+def _save_file(file_path: str, content: bytes) -> None:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as buffer:
+        buffer.write(content)
+
 # Main function to process uploaded document
-async def process_document(file: UploadFile, document_id: int, db_session) -> List[str]:
-    """Process the uploaded document and return chunks of text."""
-    
-    # Ensure upload directory exists
-    os.makedirs(settings.UPLOAD_FOLDER, exist_ok=True)
-    
+async def process_document(file: UploadFile, document_id: int, db_session: AsyncSession) -> List[str]:
+    """Process the uploaded document and return chunks of text.
+
+    File IO and text extraction run in the threadpool so the event loop stays free.
+    """
     # Define file path - using a structured approach for GCP instance
     # Store files in a directory structure by user ID and document ID
     from app.db import models
-    document = db_session.query(models.Document).filter(models.Document.id == document_id).first()
+    from app.rag.artifacts import artifact_store
+    document = await db_session.get(models.Document, document_id)
     owner_id = document.owner_id
     
-    # Create user-specific directory
+    # User-specific directory, file path with document ID
     user_dir = os.path.join(settings.UPLOAD_FOLDER, f"user_{owner_id}")
-    os.makedirs(user_dir, exist_ok=True)
-    
-    # Define file path with document ID
     file_path = os.path.join(user_dir, f"{document_id}_{file.filename}")
     
     # Save uploaded file
+    await progress_broker.publish(owner_id, document_id, "saving")
     try:
-        with open(file_path, "wb") as buffer:
+        with track_ingestion_stage("save_file"):
             content = await file.read()
-            buffer.write(content)
+            await run_in_threadpool(_save_file, file_path, content)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
     
     # Update document with file path
-    from app.db import crud, models
     document.file_path = file_path
-    db_session.commit()
+    await db_session.commit()
+    
+    def report_page(page: int, total_pages: int) -> None:
+        # Runs in the threadpool; every 10th page is plenty for a progress bar
+        if page % 10 == 0 or page == total_pages:
+            progress_broker.publish_threadsafe(owner_id, document_id, "extracting", pages=page, total_pages=total_pages)
     
     # Process document based on content type
     try:
-        content_type = file.content_type
-        
-        if "pdf" in content_type or file_path.endswith(".pdf"):
-            text = extract_text_from_pdf(file_path)
-        elif "word" in content_type or file_path.endswith(".docx"):
-            text = extract_text_from_docx(file_path)
-        elif "markdown" in content_type or file_path.endswith(".md"):
-            text = extract_text_from_markdown(file_path)
-        elif "text/plain" in content_type or file_path.endswith(".txt"):
-            text = extract_text_from_txt(file_path)
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported file type: {content_type}")
+        await progress_broker.publish(owner_id, document_id, "extracting")
+        with track_ingestion_stage("extraction"):
+            # Reuses the stored text when the same file was extracted before
+            artifact = await run_in_threadpool(artifact_store.load_or_extract, file_path, file.content_type, report_page)
+        document.file_sha256 = artifact.file_sha256
+        await db_session.commit()
         
         # Create text chunks
-        chunks = create_chunks(text)
+        with track_ingestion_stage("chunking"):
+            chunks = create_chunks(artifact.text)
+        await progress_broker.publish(owner_id, document_id, "chunking", chunks=len(chunks))
         
         return chunks
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
@@ -1,14 +1,28 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import threading
 import numpy as np
 from sentence_transformers import SentenceTransformer
+from app.core.tracing import traced
 
-# Initialize model
-model = SentenceTransformer('all-MiniLM-L6-v2')  # Lightweight model for embeddings
+MODEL_NAME = 'all-MiniLM-L6-v2'  # Lightweight model for embeddings
 
-def generate_embeddings(texts: List[str]) -> List[List[float]]:
+# Loaded on first use, so importing this module (e.g. for the search functions) stays cheap
+_model: Optional[SentenceTransformer] = None
+_model_lock = threading.Lock()
+
+def get_model() -> SentenceTransformer:
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+@traced()
+def generate_embeddings(texts: List[str], batch_size: int = 32) -> List[List[float]]:
     """Generate embeddings for a list of text chunks."""
     try:
-        embeddings = model.encode(texts)
+        embeddings = get_model().encode(texts, batch_size=batch_size)
         return embeddings.tolist()
     except Exception as e:
         print(f"Error generating embeddings: {str(e)}")
@@ -31,6 +45,7 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     
     return dot_product / (norm_a * norm_b)
 
+@traced()
 def find_relevant_chunks(
     query_embedding: List[float],
     all_chunks: List[Dict[str, Any]],
@@ -53,4 +68,41 @@ def find_relevant_chunks(
     similarities.sort(key=lambda x: x[1], reverse=True)
     
     # Return top K chunks above threshold
-    return [chunk for chunk, score in similarities[:top_k] if score >= threshold]
\ No newline at end of file
+    return [chunk for chunk, score in similarities[:top_k] if score >= threshold]
+
+@traced()
+def find_relevant_chunks_batch(
+    query_embeddings: List[List[float]],
+    all_chunks: List[Dict[str, Any]],
+    top_k: int = 5,
+    threshold: float = 0.25
+) -> List[List[Dict[str, Any]]]:
+    """Find the most relevant chunks for many queries at once.
+
+    Scores every query against every chunk with a single matrix-matrix product
+    and keeps the top K per query, same semantics as find_relevant_chunks.
+    """
+    results: List[List[Dict[str, Any]]] = [[] for _ in query_embeddings]
+    candidates = [chunk for chunk in all_chunks if chunk.get("embedding")]
+    rows = [i for i, embedding in enumerate(query_embeddings) if embedding]
+    if not candidates or not rows:
+        return results
+    
+    chunk_matrix = np.asarray([chunk["embedding"] for chunk in candidates], dtype=np.float32)
+    query_matrix = np.asarray([query_embeddings[i] for i in rows], dtype=np.float32)
+    
+    # Normalize rows so the dot product is the cosine similarity (zero vectors score 0)
+    chunk_norms = np.linalg.norm(chunk_matrix, axis=1, keepdims=True)
+    chunk_matrix = np.divide(chunk_matrix, chunk_norms, out=np.zeros_like(chunk_matrix), where=chunk_norms > 0)
+    query_norms = np.linalg.norm(query_matrix, axis=1, keepdims=True)
+    query_matrix = np.divide(query_matrix, query_norms, out=np.zeros_like(query_matrix), where=query_norms > 0)
+    
+    scores = query_matrix @ chunk_matrix.T  # (queries, chunks)
+    
+    # Per-row top K without sorting the whole row
+    k = min(top_k, len(candidates))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    for row, query_index in enumerate(rows):
+        best = top[row][np.argsort(-scores[row, top[row]])]
+        results[query_index] = [candidates[j] for j in best if scores[row, j] >= threshold]
+    return results
@@ -0,0 +1,347 @@
+"""In-memory vector index of document chunks, used by the retrieval shards.
+
+Vectors are kept as unit-norm float32 rows so a dot product is the cosine
+similarity. Rows live in immutable segments sorted by owner: the rows of one
+owner are a contiguous slice, so a tenant-scoped search multiplies only that
+slice without copying it. New chunks are appended as small segments and
+merged from time to time; deleted documents are tombstoned until the next merge.
+
+Owners with an active embedding projection (app/rag/projection.py) have their
+rows in the reduced space: each segment carries the projection version of its
+rows (0 for full-dimension rows) and a search only scans segments of the
+version its query vectors were projected with.
+"""
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import and_, case, select
+from sqlalchemy.orm import aliased
+
+from app.db import models
+
+PARTITION_STRATEGIES = ("owner", "hash")
+
+
+class Segment:
+    __slots__ = ("ids", "owner_ids", "document_ids", "vectors", "alive", "owner_ranges", "projection_id")
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        owner_ids: np.ndarray,
+        document_ids: np.ndarray,
+        vectors: np.ndarray,
+        alive: Optional[np.ndarray] = None,
+        projection_id: int = 0
+    ):
+        self.projection_id = projection_id
+        order = np.argsort(owner_ids, kind="stable")
+        self.ids = ids[order]
+        self.owner_ids = owner_ids[order]
+        self.document_ids = document_ids[order]
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.alive = np.ones(len(ids), dtype=bool) if alive is None else alive[order]
+        owners, starts = np.unique(self.owner_ids, return_index=True)
+        ends = np.append(starts[1:], len(self.owner_ids))
+        self.owner_ranges: Dict[int, Tuple[int, int]] = {
+            int(owner): (int(start), int(end)) for owner, start, end in zip(owners, starts, ends)
+        }
+
+    @classmethod
+    def presorted(
+        cls,
+        ids: np.ndarray,
+        owner_ids: np.ndarray,
+        document_ids: np.ndarray,
+        vectors: np.ndarray,
+        alive: np.ndarray,
+        owner_ranges: Dict[int, Tuple[int, int]],
+        projection_id: int = 0
+    ) -> "Segment":
+        """A segment over arrays already sorted by owner, used as-is (e.g. memory-mapped)."""
+        segment = cls.__new__(cls)
+        segment.ids = ids
+        segment.owner_ids = owner_ids
+        segment.document_ids = document_ids
+        segment.vectors = vectors
+        segment.alive = alive
+        segment.owner_ranges = owner_ranges
+        segment.projection_id = projection_id
+        return segment
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.ids.nbytes + self.owner_ids.nbytes + self.document_ids.nbytes + self.alive.nbytes
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+class VectorIndex:
+    def __init__(self, max_segments: int = 8):
+        self.max_segments = max_segments
+        # Vector dimension per projection version (0: full embeddings)
+        self.dims: Dict[int, int] = {}
+        self._segments: List[Segment] = []
+        self._lock = threading.Lock()
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.dims.get(0)
+
+    def add(
+        self,
+        ids: Sequence[int],
+        owner_ids: Sequence[int],
+        document_ids: Sequence[int],
+        vectors,
+        projection_ids: Optional[Sequence[int]] = None
+    ) -> int:
+        """Append rows; rows whose vector has the wrong dimension are skipped."""
+        if projection_ids is None:
+            return self._add_segment(ids, owner_ids, document_ids, vectors, 0)
+        groups: Dict[int, List[int]] = {}
+        for row, projection_id in enumerate(projection_ids):
+            groups.setdefault(int(projection_id or 0), []).append(row)
+        return sum(
+            self._add_segment(
+                [ids[row] for row in rows],
+                [owner_ids[row] for row in rows],
+                [document_ids[row] for row in rows],
+                [vectors[row] for row in rows],
+                projection_id
+            )
+            for projection_id, rows in groups.items()
+        )
+
+    def _add_segment(self, ids, owner_ids, document_ids, vectors, projection_id: int) -> int:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(ids) == 0 or vectors.ndim != 2:
+            return 0
+        dim = self.dims.setdefault(projection_id, vectors.shape[1])
+        if vectors.shape[1] != dim:
+            return 0
+        segment = Segment(
+            np.asarray(ids, dtype=np.int64),
+            np.asarray(owner_ids, dtype=np.int64),
+            np.asarray(document_ids, dtype=np.int64),
+            normalize(vectors),
+            projection_id=projection_id
+        )
+        with self._lock:
+            self._segments.append(segment)
+            needs_merge = len(self._segments) > self.max_segments
+        if needs_merge:
+            self.compact()
+        return len(segment)
+
+    def _tombstone(self, column: str, values) -> int:
+        values = np.asarray(values, dtype=np.int64)
+        removed = 0
+        with self._lock:
+            for segment in self._segments:
+                mask = np.isin(getattr(segment, column), values) & segment.alive
+                segment.alive[mask] = False
+                removed += int(mask.sum())
+        return removed
+
+    def remove_documents(self, document_ids: Sequence[int]) -> int:
+        """Tombstone every row of these documents; returns the rows removed."""
+        return self._tombstone("document_ids", document_ids)
+
+    def remove_chunks(self, chunk_ids: Sequence[int]) -> int:
+        return self._tombstone("ids", chunk_ids)
+
+    def remove_owners(self, owner_ids: Sequence[int]) -> int:
+        return self._tombstone("owner_ids", owner_ids)
+
+    def compact(self) -> None:
+        """Merge the segments of each projection version into one, dropping tombstoned rows."""
+        with self._lock:
+            segments = list(self._segments)
+        versions = {s.projection_id for s in segments}
+        if len(segments) <= len(versions) and all(segment.alive.all() for segment in segments):
+            return
+        merged = []
+        for projection_id in sorted(versions):
+            group = [s for s in segments if s.projection_id == projection_id]
+            merged.append(Segment(
+                np.concatenate([s.ids[s.alive] for s in group]),
+                np.concatenate([s.owner_ids[s.alive] for s in group]),
+                np.concatenate([s.document_ids[s.alive] for s in group]),
+                np.concatenate([s.vectors[s.alive] for s in group]),
+                projection_id=projection_id
+            ))
+        with self._lock:
+            # Segments added while merging are kept after the merged ones
+            added = self._segments[len(segments):]
+            # Tombstones set while merging are reapplied below
+            # By chunk id: a re-chunked document's new rows must stay alive
+            removed = np.concatenate([s.ids[~s.alive] for s in segments]) if segments else np.empty(0)
+            self._segments = merged + added
+        if len(removed):
+            self.remove_chunks(removed)
+
+    def segments(self) -> List[Segment]:
+        with self._lock:
+            return list(self._segments)
+
+    @classmethod
+    def from_segments(cls, segments: List[Segment], max_segments: int = 8) -> "VectorIndex":
+        index = cls(max_segments)
+        index._segments = list(segments)
+        for segment in segments:
+            index.dims.setdefault(segment.projection_id, segment.vectors.shape[1])
+        return index
+
+    def replace(self, other: "VectorIndex") -> None:
+        """Swap in the contents of a freshly built index."""
+        with self._lock, other._lock:
+            self._segments = list(other._segments)
+            self.dims = dict(other.dims)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        owner_id: Optional[int] = None,
+        top_k: int = 5,
+        threshold: float = -1.0,
+        projection_id: int = 0
+    ) -> List[List[Tuple[int, float]]]:
+        """Top-k (chunk id, score) per query, best first, optionally for one owner only.
+
+        Queries must already be in the space of `projection_id`.
+        """
+        queries = normalize(np.atleast_2d(queries))
+        with self._lock:
+            segments = list(self._segments)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+        for segment in segments:
+            if segment.projection_id != projection_id or segment.vectors.shape[1] != queries.shape[1]:
+                continue
+            if owner_id is None:
+                start, end = 0, len(segment)
+            elif owner_id in segment.owner_ranges:
+                start, end = segment.owner_ranges[owner_id]
+            else:
+                continue
+            scores = queries @ segment.vectors[start:end].T
+            scores[:, ~segment.alive[start:end]] = -np.inf
+            k = min(top_k, end - start)
+            if k == 0:
+                continue
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_ids = np.concatenate([best_ids, segment.ids[start:end][top]], axis=1)
+        order = np.argsort(-best_scores, axis=1)[:, :top_k]
+        results = []
+        for row in range(len(queries)):
+            results.append([
+                (int(best_ids[row, j]), float(best_scores[row, j]))
+                for j in order[row]
+                if best_scores[row, j] >= threshold and np.isfinite(best_scores[row, j])
+            ])
+        return results
+
+    def alive_ids(self) -> np.ndarray:
+        segments = self.segments()
+        return np.concatenate([s.ids[s.alive] for s in segments]) if segments else np.empty(0, dtype=np.int64)
+
+    def ids_above(self, min_id: int) -> List[int]:
+        with self._lock:
+            segments = list(self._segments)
+        return [int(i) for segment in segments for i in segment.ids[segment.ids > min_id]]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            segments = list(self._segments)
+        return {
+            "rows": sum(len(segment) for segment in segments),
+            "alive": sum(int(segment.alive.sum()) for segment in segments),
+            "segments": len(segments),
+            "bytes": sum(segment.nbytes for segment in segments),
+            "dim": self.dim or 0,
+            "projected_dims": {str(version): dim for version, dim in self.dims.items() if version},
+            "max_id": max((int(segment.ids.max()) for segment in segments if len(segment)), default=0)
+        }
+
+
+def partition_clause(shard: int, shards: int, strategy: str):
+    """SQL condition selecting the chunks that belong to one shard.
+
+    "owner" keeps each tenant on a single shard (queries hit one shard),
+    "hash" spreads chunks by id (every query fans out, load is even).
+    """
+    if strategy == "owner":
+        return models.Document.owner_id % shards == shard
+    if strategy == "hash":
+        return models.DocumentChunk.id % shards == shard
+    raise ValueError(f"Unknown partition strategy: {strategy}")
+
+
+def shard_for_owner(owner_id: int, shards: int) -> int:
+    return owner_id % shards
+
+
+def iter_chunk_blocks(connection, where=None, batch_size: int = 10_000, projections=None) -> Iterator[Tuple[list, list, list, list, list]]:
+    """Stream (ids, owner_ids, document_ids, vectors, projection_ids) blocks of chunks in id order.
+
+    A chunk whose owner has an active projection comes as its reduced vector
+    (projected here from the full one if it has no stored reduced row yet,
+    using the `projections` registry); other chunks come as full embeddings
+    with projection id 0.
+    """
+    active = aliased(models.EmbeddingProjection)
+    statement = (
+        select(
+            models.DocumentChunk.id,
+            models.Document.owner_id,
+            models.DocumentChunk.document_id,
+            active.id.label("projection_id"),
+            models.ChunkProjection.embedding.label("projected"),
+            # The full vector is only needed when there is no reduced one
+            case((models.ChunkProjection.embedding.is_(None), models.DocumentChunk.embedding)).label("embedding")
+        )
+        .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+        .outerjoin(active, and_(active.owner_id == models.Document.owner_id, active.status == "active"))
+        .outerjoin(models.ChunkProjection, and_(
+            models.ChunkProjection.chunk_id == models.DocumentChunk.id,
+            models.ChunkProjection.projection_id == active.id
+        ))
+        # Soft-deleted documents are out of retrieval before the reaper gets to them
+        .where(models.Document.deleted_at.is_(None))
+        .order_by(models.DocumentChunk.id)
+    )
+    if where is not None:
+        statement = statement.where(where)
+    result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+    for rows in result.partitions(batch_size):
+        block = ([], [], [], [], [])
+        pending: Dict[int, List[int]] = {}
+        for row in rows:
+            if row.projected:
+                vector, projection_id = row.projected, row.projection_id
+            elif row.embedding:
+                vector, projection_id = row.embedding, row.projection_id or 0
+                if projection_id:
+                    if projections is None:
+                        continue
+                    pending.setdefault(projection_id, []).append(len(block[0]))
+            else:
+                continue
+            for column, value in zip(block, (row.id, row.owner_id, row.document_id, vector, projection_id)):
+                column.append(value)
+        for projection_id, positions in pending.items():
+            reduced = projections.get(projection_id).apply([block[3][position] for position in positions])
+            for position, vector in zip(positions, reduced):
+                block[3][position] = vector
+        if block[0]:
+            yield block
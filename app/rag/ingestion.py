@@ -0,0 +1,249 @@
+"""Bulk ingestion: staging many files or archives, then a pipelined
+extract -> chunk -> embed -> insert flow for all documents of a job.
+
+Each stage has its own bounded pool of workers and the stages are connected by
+bounded queues, so extraction of the next files overlaps with embedding and
+inserting the previous ones, and a slow stage makes the earlier ones wait
+instead of piling chunks up in memory.
+"""
+import asyncio
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import tarfile
+import zipfile
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import track_ingestion_stage
+from app.core.progress import progress_broker
+from app.core.tracing import untraced
+from app.db import async_crud
+from app.rag import embeddings
+from app.rag.artifacts import artifact_store
+from app.rag.document_processor import create_chunks
+from app.rag.projection import projection_registry
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".md": "text/markdown",
+    ".txt": "text/plain",
+}
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class StagedFile(NamedTuple):
+    title: str
+    filename: str
+    file_path: str
+    content_type: str
+
+
+def _safe_name(name: str) -> str:
+    # Archive members can carry paths ("../../etc/passwd"): keep the base name only
+    base = os.path.basename(name.replace("\\", "/"))
+    return re.sub(r"[^A-Za-z0-9._-]", "_", base)[:200] or "file"
+
+
+class Stager:
+    """Streams uploaded files and archive members into a job's directory.
+
+    Runs in the threadpool: archives are read member by member and copied in
+    fixed-size blocks, so nothing is ever held in memory whole. Unsupported
+    files are skipped and reported rather than failing the whole upload.
+    """
+
+    def __init__(self, directory: str, max_files: int = settings.BULK_MAX_FILES, max_bytes: int = settings.BULK_MAX_BYTES):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.staged: List[StagedFile] = []
+        self.skipped: List[Dict[str, str]] = []
+
+    def add_upload(self, filename: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> None:
+        if (filename or "").lower().endswith(ARCHIVE_SUFFIXES):
+            self.add_archive(filename, fileobj)
+        else:
+            self.add_stream(filename, fileobj, content_type)
+
+    def add_archive(self, filename: str, fileobj: BinaryIO) -> None:
+        try:
+            if filename.lower().endswith(".zip"):
+                with zipfile.ZipFile(fileobj) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir():
+                            continue
+                        with archive.open(info) as member:
+                            self.add_stream(info.filename, member)
+            else:
+                # Streaming mode: members are read in order, never seeking back
+                with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+                    for member in archive:
+                        if not member.isfile():
+                            continue
+                        self.add_stream(member.name, archive.extractfile(member))
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+            self.skipped.append({"filename": filename, "reason": f"Unreadable archive: {str(e)}"})
+
+    def add_stream(self, name: str, stream: BinaryIO, content_type: Optional[str] = None) -> None:
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in SUPPORTED_EXTENSIONS:
+            self.skipped.append({"filename": name, "reason": "Unsupported file type"})
+            return
+        if len(self.staged) >= self.max_files:
+            raise HTTPException(status_code=413, detail=f"Too many files, at most {self.max_files} per upload")
+
+        safe_name = _safe_name(name)
+        file_path = os.path.join(self.directory, f"{len(self.staged)}_{safe_name}")
+        os.makedirs(self.directory, exist_ok=True)
+        with open(file_path, "wb") as target:
+            while True:
+                block = stream.read(COPY_BUFFER_SIZE)
+                if not block:
+                    break
+                self.total_bytes += len(block)
+                # Checked while copying: archive headers can lie about sizes
+                if self.total_bytes > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Upload too large, at most {self.max_bytes} bytes")
+                target.write(block)
+
+        if not content_type or content_type == "application/octet-stream":
+            content_type = SUPPORTED_EXTENSIONS[extension]
+        title = os.path.splitext(os.path.basename(name.replace("\\", "/")))[0] or safe_name
+        self.staged.append(StagedFile(title, os.path.basename(name), file_path, content_type))
+
+    def discard(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _extract_chunks(file_path: str, content_type: str) -> Tuple[str, List[str]]:
+    """(file hash, chunks) of a staged file, through the text artifact store."""
+    with track_ingestion_stage("extraction"):
+        artifact = artifact_store.load_or_extract(file_path, content_type or mimetypes.guess_type(file_path)[0] or "")
+    with track_ingestion_stage("chunking"):
+        return artifact.file_sha256, create_chunks(artifact.text)
+
+
+@untraced
+async def run_ingestion_job(job_id: int, owner_id: int, documents: Sequence[Tuple[int, str, str]]) -> None:
+    """Process (document_id, file_path, content_type) triples through the pipeline."""
+    pending: asyncio.Queue = asyncio.Queue()
+    for document in documents:
+        pending.put_nowait(document)
+    to_embed: asyncio.Queue = asyncio.Queue(settings.BULK_QUEUE_SIZE)
+    to_insert: asyncio.Queue = asyncio.Queue(settings.BULK_QUEUE_SIZE)
+    failures = 0
+
+    async def fail(document_id: int, error: Exception) -> None:
+        nonlocal failures
+        failures += 1
+        message = error.detail if isinstance(error, HTTPException) else str(error)
+        logger.error(f"Job {job_id}: document {document_id} failed: {message}")
+        try:
+            await progress_broker.publish(owner_id, document_id, "failed", error=message, job_id=job_id)
+            async with AsyncSessionLocal() as db:
+                await async_crud.record_job_progress(db, job_id, failed=1)
+        except Exception as e:
+            # Raising here would kill the calling worker, and the stages around it
+            # would block on their bounded queues
+            logger.error(f"Job {job_id}: could not record the failure of document {document_id}: {str(e)}")
+
+    async def extract_worker() -> None:
+        while True:
+            try:
+                document_id, file_path, content_type = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await progress_broker.publish(owner_id, document_id, "extracting", job_id=job_id)
+            try:
+                file_hash, chunks = await run_in_threadpool(_extract_chunks, file_path, content_type)
+            except Exception as e:
+                await fail(document_id, e)
+                continue
+            await to_embed.put((document_id, file_hash, chunks))
+
+    async def embed_worker() -> None:
+        while True:
+            item = await to_embed.get()
+            if item is None:
+                return
+            document_id, file_hash, chunks = item
+            await progress_broker.publish(owner_id, document_id, "embedding", chunks=len(chunks), job_id=job_id)
+            try:
+                with track_ingestion_stage("embedding"):
+                    vectors = await run_in_threadpool(embeddings.generate_embeddings, chunks)
+            except Exception as e:
+                await fail(document_id, e)
+                continue
+            await to_insert.put((document_id, file_hash, chunks, vectors))
+
+    async def insert_worker() -> None:
+        projection = await run_in_threadpool(projection_registry.active_for, owner_id)
+        async with AsyncSessionLocal() as db:
+            while True:
+                item = await to_insert.get()
+                if item is None:
+                    return
+                document_id, file_hash, chunks, vectors = item
+                try:
+                    # Chunks and the processed flag in one transaction: a document
+                    # is never retrievable without counting as processed
+                    with track_ingestion_stage("chunk_insert"):
+                        await async_crud.create_document_chunks(db, chunks, vectors, document_id, projection, commit=False)
+                    with track_ingestion_stage("mark_processed"):
+                        await async_crud.mark_document_processed(db, document_id, file_hash)
+                except Exception as e:
+                    await db.rollback()
+                    await fail(document_id, e)
+                    continue
+                try:
+                    await async_crud.record_job_progress(db, job_id, processed=1)
+                except Exception as e:
+                    # The document is stored; only the job's counter is behind
+                    await db.rollback()
+                    logger.error(f"Job {job_id}: could not record document {document_id} as processed: {str(e)}")
+                await progress_broker.publish(owner_id, document_id, "done", chunks=len(chunks), job_id=job_id)
+
+    async def close_after(stage: List[asyncio.Task], queue: asyncio.Queue, workers: int) -> None:
+        # A None per worker of the next stage tells it its input is exhausted
+        await asyncio.gather(*stage)
+        for _ in range(workers):
+            await queue.put(None)
+
+    extractors = [asyncio.create_task(extract_worker()) for _ in range(settings.BULK_EXTRACT_WORKERS)]
+    embedders = [asyncio.create_task(embed_worker()) for _ in range(settings.BULK_EMBED_WORKERS)]
+    inserters = [asyncio.create_task(insert_worker()) for _ in range(settings.BULK_INSERT_WORKERS)]
+    tasks = extractors + embedders + inserters + [
+        asyncio.create_task(close_after(extractors, to_embed, len(embedders))),
+        asyncio.create_task(close_after(embedders, to_insert, len(inserters)))
+    ]
+    status = "done"
+    try:
+        # All stages supervised together: a worker dying in any of them aborts
+        # the job at once instead of leaving the others blocked on a full queue
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+    except Exception:
+        status = "failed"
+        logger.exception(f"Ingestion job {job_id} aborted")
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+        if status == "done" and failures == len(documents) and documents:
+            status = "failed"
+        async with AsyncSessionLocal() as db:
+            await async_crud.finish_ingestion_job(db, job_id, status)
@@ -1,8 +1,12 @@
 import requests
 import json
 import logging
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Tuple
+from app.core.admission import llm_retry_budget
 from app.core.config import settings
+from app.core.metrics import LLM_REQUESTS, RAG_STAGE_SECONDS, track_stage
+from app.core.tracing import traced
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -11,19 +15,46 @@ logger = logging.getLogger(__name__)
 def query_ollama(
     prompt: str,
     model: str = settings.OLLAMA_MODEL,
-    context: Optional[str] = None,
+    context: Optional[List[int]] = None,
     max_tokens: int = 1024,
     temperature: float = 0.7,
     retry_count: int = 3
 ) -> str:
     """Query the Ollama API with a prompt and optional context."""
+    response, _ = query_ollama_with_context(
+        prompt=prompt,
+        model=model,
+        context=context,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        retry_count=retry_count
+    )
+    return response
+
+@traced()
+def query_ollama_with_context(
+    prompt: str,
+    model: str = settings.OLLAMA_MODEL,
+    context: Optional[List[int]] = None,
+    max_tokens: int = 1024,
+    temperature: float = 0.7,
+    retry_count: int = 3
+) -> Tuple[str, Optional[List[int]]]:
+    """Query the Ollama API and return the response together with the new context.
+
+    The returned context is Ollama's encoding of the conversation so far; passing it
+    back on the next call lets Ollama skip the prefill of everything already seen.
+    On failure the context is None so callers start over with a fresh prompt.
+    The answer is streamed from Ollama so time to first token can be measured.
+    """
     url = f"{settings.OLLAMA_BASE_URL}/api/generate"
     
     # Prepare the request data
     data = {
         "model": model,
         "prompt": prompt,
-        "stream": False,
+        "stream": True,
+        "keep_alive": settings.OLLAMA_KEEP_ALIVE,
         "options": {
             "temperature": temperature,
             "num_predict": max_tokens
@@ -34,40 +65,72 @@ def query_ollama(
     if context:
         data["context"] = context
     
-    # Implement retry logic for GCP environment
+    # Implement retry logic for GCP environment; retries are capped by a shared
+    # budget so an overloaded Ollama isn't hit with several times the traffic
+    llm_retry_budget.record_attempt()
+    # Always one attempt, so every outcome is an answer or an error message
+    retry_count = max(1, retry_count)
     attempts = 0
     while attempts < retry_count:
         try:
             # Make the request to Ollama
             logger.info(f"Sending request to Ollama at {url}")
-            response = requests.post(url, json=data, timeout=60)  # Added timeout
-            response.raise_for_status()  # Raise exception for HTTP errors
-            
-            result = response.json()
-            return result.get("response", "")
+            started = time.perf_counter()
+            # The timeout applies to each read, so long answers are fine as long as tokens keep coming
+            with requests.post(url, json=data, timeout=60, stream=True) as response:
+                response.raise_for_status()  # Raise exception for HTTP errors
+                answer, new_context = _read_stream(response, started)
+            RAG_STAGE_SECONDS.labels("llm_total").observe(time.perf_counter() - started)
+            LLM_REQUESTS.labels("success").inc()
+            return answer, new_context
         except requests.exceptions.ConnectionError as ce:
+            LLM_REQUESTS.labels("connection_error").inc()
             attempts += 1
             logger.error(f"Connection error to Ollama (attempt {attempts}/{retry_count}): {str(ce)}")
-            if attempts >= retry_count:
-                return f"Error: Could not connect to the language model. Please try again later."
+            if attempts >= retry_count or not llm_retry_budget.try_retry():
+                return f"Error: Could not connect to the language model. Please try again later.", None
         except requests.exceptions.Timeout as te:
+            LLM_REQUESTS.labels("timeout").inc()
             attempts += 1
             logger.error(f"Timeout error to Ollama (attempt {attempts}/{retry_count}): {str(te)}")
-            if attempts >= retry_count:
-                return f"Error: The language model took too long to respond. Please try again later."
+            if attempts >= retry_count or not llm_retry_budget.try_retry():
+                return f"Error: The language model took too long to respond. Please try again later.", None
         except Exception as e:
+            LLM_REQUESTS.labels("error").inc()
             attempts += 1
             logger.error(f"Error querying Ollama (attempt {attempts}/{retry_count}): {str(e)}")
-            if attempts >= retry_count:
-                return f"Error: Could not get a response from the language model. Please try again later."
+            if attempts >= retry_count or not llm_retry_budget.try_retry():
+                return f"Error: Could not get a response from the language model. Please try again later.", None
+
+def _read_stream(response: requests.Response, started: float) -> Tuple[str, Optional[List[int]]]:
+    """Collect a streamed /api/generate response into (answer, context)."""
+    parts = []
+    first_token = True
+    for line in response.iter_lines():
+        if not line:
+            continue
+        message = json.loads(line)
+        if "error" in message:
+            raise RuntimeError(message["error"])
+        if first_token and message.get("response"):
+            RAG_STAGE_SECONDS.labels("llm_first_token").observe(time.perf_counter() - started)
+            first_token = False
+        parts.append(message.get("response", ""))
+        if message.get("done"):
+            new_context = message.get("context")
+            return "".join(parts), new_context
+    # Cut off mid-answer (Ollama restarted, proxy timeout, ...): a partial answer
+    # must not be stored as if it were complete
+    raise RuntimeError(f"Ollama stream ended before the answer was done ({len(parts)} parts received)")
 
 def generate_rag_response(query: str, relevant_chunks: List[Dict[str, Any]]) -> str:
     """Generate a response using RAG (Retrieval Augmented Generation)."""
-    # Extract and format the context from relevant chunks
-    context_text = "\n\n".join([chunk.get("content", "") for chunk in relevant_chunks])
-    
-    # Create the prompt with context
-    prompt = f"""Given the following context, please answer the question. 
+    with track_stage("prompt_build"):
+        # Extract and format the context from relevant chunks
+        context_text = "\n\n".join([chunk.get("content", "") for chunk in relevant_chunks])
+        
+        # Create the prompt with context
+        prompt = f"""Given the following context, please answer the question. 
     If the context doesn't contain enough information to answer the question completely, 
     just say what you know based on the context and don't make up information.
 
@@ -81,4 +144,47 @@ def generate_rag_response(query: str, relevant_chunks: List[Dict[str, Any]]) ->
     # Query the LLM
     response = query_ollama(prompt=prompt)
     
-    return response
\ No newline at end of file
+    return response
+
+def generate_conversation_response(
+    query: str,
+    relevant_chunks: List[Dict[str, Any]],
+    context: Optional[List[int]] = None
+) -> Tuple[str, Optional[List[int]]]:
+    """Generate a RAG response for a conversation turn, reusing Ollama's context.
+
+    On the first turn this builds the same prompt as generate_rag_response. On
+    follow-up turns the earlier instructions and passages are already encoded in
+    the context, so only passages not sent before and the new question are added.
+    """
+    with track_stage("prompt_build"):
+        context_text = "\n\n".join([chunk.get("content", "") for chunk in relevant_chunks])
+        
+        if not context:
+            prompt = f"""Given the following context, please answer the question. 
+    If the context doesn't contain enough information to answer the question completely, 
+    just say what you know based on the context and don't make up information.
+
+    Context:
+    {context_text}
+
+    Question: {query}
+
+    Answer:"""
+        elif context_text:
+            prompt = f"""
+
+    Additional context:
+    {context_text}
+
+    Follow-up question: {query}
+
+    Answer:"""
+        else:
+            prompt = f"""
+
+    Follow-up question: {query}
+
+    Answer:"""
+    
+    return query_ollama_with_context(prompt=prompt, context=context)
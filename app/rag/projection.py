@@ -0,0 +1,369 @@
+"""Corpus-fitted dimensionality reduction of chunk embeddings.
+
+    # how much recall each dimension keeps on this tenant's corpus
+    python -m app.rag.projection report --owner-id 7
+
+    # fit a 128-dim PCA, and activate it only if recall@10 stays above 0.95
+    python -m app.rag.projection fit --owner-id 7 --dims 128 --activate --min-recall 0.95
+
+    python -m app.rag.projection activate --version 12
+    python -m app.rag.projection deactivate --owner-id 7
+
+A projection maps the model's 384-dim unit vectors to fewer dimensions fitted
+on one owner's chunks: PCA (mean + top principal axes) or a random rotation
+truncated to the first axes. Each fit is a numbered version whose matrices are
+stored in PROJECTION_FOLDER/owner_<id>/v<version>.npz; at most one version per
+owner is active. The full embeddings stay on document_chunks, so a projection
+can always be re-fitted or dropped; the reduced vectors of the active version
+live in chunk_projections and are what retrieval scores against. Queries are
+projected with the same version, at ingestion new chunks are projected too.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import delete, func, insert, select
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.db import models
+from app.rag.index import normalize
+
+logger = logging.getLogger(__name__)
+
+METHODS = ("pca", "random")
+REPORT_DIMS = (32, 48, 64, 96, 128, 192, 256)
+
+
+class Projection:
+    __slots__ = ("id", "owner_id", "method", "mean", "components")
+
+    def __init__(self, id: int, owner_id: int, method: str, mean: np.ndarray, components: np.ndarray):
+        self.id = id
+        self.owner_id = owner_id
+        self.method = method
+        self.mean = mean.astype(np.float32)
+        # input_dim x output_dim
+        self.components = components.astype(np.float32)
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def output_dim(self) -> int:
+        return self.components.shape[1]
+
+    def apply(self, vectors) -> np.ndarray:
+        """Reduce embeddings; the results are unit-norm, so dot products stay cosines."""
+        vectors = normalize(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        return normalize((vectors - self.mean) @ self.components)
+
+
+def fit(vectors: np.ndarray, dims: int, method: str = "pca", seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """(mean, components) reducing `vectors` to `dims` dimensions."""
+    vectors = normalize(vectors)
+    dims = min(dims, vectors.shape[1])
+    mean = vectors.mean(axis=0)
+    if method == "pca":
+        # Rows of vt are the principal axes, strongest first
+        _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        return mean, vt[:dims].T
+    if method == "random":
+        rotation, _ = np.linalg.qr(np.random.default_rng(seed).standard_normal((vectors.shape[1], vectors.shape[1])))
+        return mean, rotation[:, :dims]
+    raise ValueError(f"Unknown projection method: {method}")
+
+
+def _top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall_report(
+    vectors: np.ndarray,
+    method: str = "pca",
+    dims: Sequence[int] = REPORT_DIMS,
+    k: int = 10,
+    queries: int = 200,
+    seed: int = 0
+) -> Dict[str, object]:
+    """Recall@k of reduced search against full-dimension search, per dimension.
+
+    Held-out chunks of the corpus stand in for questions: they are removed from
+    the corpus the projection is fitted and searched on.
+    """
+    vectors = normalize(vectors)
+    order = np.random.default_rng(seed).permutation(len(vectors))
+    held_out = min(queries, len(vectors) // 5)
+    query_vectors, corpus = vectors[order[:held_out]], vectors[order[held_out:]]
+    k = min(k, len(corpus))
+    report: Dict[str, object] = {"method": method, "k": k, "queries": held_out, "rows": len(corpus), "recall": {}}
+    if held_out == 0 or k == 0:
+        return report
+    truth = _top_k(corpus, query_vectors, k)
+    for dim in sorted({d for d in dims if d < vectors.shape[1]} | {vectors.shape[1]}):
+        mean, components = fit(corpus, dim, method, seed)
+        projection = Projection(0, 0, method, mean, components)
+        found = _top_k(projection.apply(corpus), projection.apply(query_vectors), k)
+        hits = sum(len(set(a.tolist()) & set(b.tolist())) for a, b in zip(found, truth))
+        report["recall"][str(dim)] = round(hits / (held_out * k), 4)
+    if method == "pca":
+        singular = np.linalg.svd(corpus - corpus.mean(axis=0), compute_uv=False) ** 2
+        explained = np.cumsum(singular) / singular.sum()
+        report["explained_variance"] = {
+            dim: round(float(explained[int(dim) - 1]), 4) for dim in report["recall"] if int(dim) <= len(explained)
+        }
+    return report
+
+
+def sample_embeddings(db, owner_id: int, limit: int) -> np.ndarray:
+    rows = db.execute(
+        select(models.DocumentChunk.embedding)
+        .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+        .where(models.Document.owner_id == owner_id, models.Document.deleted_at.is_(None))
+        .order_by(func.random())
+        .limit(limit)
+    ).scalars().all()
+    rows = [row for row in rows if row]
+    return np.asarray(rows, dtype=np.float32) if rows else np.empty((0, 0), dtype=np.float32)
+
+
+class ProjectionRegistry:
+    """Per-process cache of projection matrices and of each owner's active version.
+
+    Versions never change once written, so their matrices are cached for good;
+    which version is active is re-read after PROJECTION_CACHE_SECONDS.
+    """
+
+    def __init__(self, ttl: float = settings.PROJECTION_CACHE_SECONDS):
+        self.ttl = ttl
+        self._projections: Dict[int, Projection] = {}
+        self._active: Dict[int, Tuple[float, Optional[int]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, projection_id: int, db=None) -> Projection:
+        projection = self._projections.get(projection_id)
+        if projection is not None:
+            return projection
+        if db is None:
+            with SessionLocal() as session:
+                return self.get(projection_id, session)
+        row = db.get(models.EmbeddingProjection, projection_id)
+        if row is None:
+            raise KeyError(f"Projection {projection_id} does not exist")
+        with np.load(row.file_path) as matrices:
+            projection = Projection(row.id, row.owner_id, row.method, matrices["mean"], matrices["components"])
+        with self._lock:
+            self._projections[projection_id] = projection
+        return projection
+
+    def active_for(self, owner_id: int) -> Optional[Projection]:
+        cached = self._active.get(owner_id)
+        if cached is None or time.monotonic() - cached[0] > self.ttl:
+            with SessionLocal() as db:
+                projection_id = db.execute(
+                    select(models.EmbeddingProjection.id).where(
+                        models.EmbeddingProjection.owner_id == owner_id,
+                        models.EmbeddingProjection.status == "active"
+                    )
+                ).scalar()
+            cached = (time.monotonic(), projection_id)
+            with self._lock:
+                self._active[owner_id] = cached
+        if cached[1] is None:
+            return None
+        try:
+            return self.get(cached[1])
+        except (KeyError, OSError) as e:
+            # A missing matrix file must not take retrieval down: search full vectors
+            logger.error(f"Projection {cached[1]} of owner {owner_id} unavailable: {str(e)}")
+            return None
+
+    def invalidate(self, owner_id: Optional[int] = None) -> None:
+        with self._lock:
+            if owner_id is None:
+                self._active.clear()
+            else:
+                self._active.pop(owner_id, None)
+
+
+projection_registry = ProjectionRegistry()
+
+
+def create_projection(owner_id: int, dims: int, method: str = "pca", sample: int = 50_000, seed: int = 0) -> models.EmbeddingProjection:
+    """Fit a new version on the owner's chunks, with its recall report; it is not activated."""
+    with SessionLocal() as db:
+        vectors = sample_embeddings(db, owner_id, sample)
+        if len(vectors) < 2:
+            raise ValueError(f"Owner {owner_id} has too few embedded chunks to fit a projection")
+        mean, components = fit(vectors, dims, method, seed)
+        report = recall_report(vectors, method, sorted(set(REPORT_DIMS) | {components.shape[1]}), seed=seed)
+        row = models.EmbeddingProjection(
+            owner_id=owner_id,
+            method=method,
+            input_dim=components.shape[0],
+            output_dim=components.shape[1],
+            status="ready",
+            fitted_rows=len(vectors),
+            report=report
+        )
+        db.add(row)
+        db.flush()
+        directory = os.path.join(settings.PROJECTION_FOLDER, f"owner_{owner_id}")
+        os.makedirs(directory, exist_ok=True)
+        row.file_path = os.path.join(directory, f"v{row.id}.npz")
+        np.savez(row.file_path, mean=mean.astype(np.float32), components=components.astype(np.float32))
+        db.commit()
+        db.refresh(row)
+        return row
+
+
+def activate_projection(projection_id: int, batch_size: int = 5_000) -> Dict[str, int]:
+    """Project every chunk of the owner with this version, then make it the active one."""
+    with SessionLocal() as db:
+        row = db.get(models.EmbeddingProjection, projection_id)
+        if row is None:
+            raise ValueError(f"Projection {projection_id} does not exist")
+        projection = projection_registry.get(projection_id, db)
+        # Reduced rows are inert until activation, so they're committed batch by batch;
+        # chunks inserted meanwhile are projected on the fly until the next fit
+        written, last_id = 0, 0
+        while True:
+            rows = db.execute(
+                select(models.DocumentChunk.id, models.DocumentChunk.embedding)
+                .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+                .where(
+                    models.Document.owner_id == row.owner_id,
+                    models.Document.deleted_at.is_(None),
+                    models.DocumentChunk.id > last_id
+                )
+                .order_by(models.DocumentChunk.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            rows = [r for r in rows if r.embedding]
+            db.execute(delete(models.ChunkProjection).where(
+                models.ChunkProjection.projection_id == projection_id,
+                models.ChunkProjection.chunk_id.in_([r.id for r in rows])
+            ))
+            if rows:
+                reduced = projection.apply([r.embedding for r in rows])
+                db.execute(insert(models.ChunkProjection), [
+                    {"chunk_id": r.id, "projection_id": projection_id, "embedding": vector.tolist()}
+                    for r, vector in zip(rows, reduced)
+                ])
+            db.commit()
+            written += len(rows)
+
+        previous = db.execute(
+            select(models.EmbeddingProjection).where(
+                models.EmbeddingProjection.owner_id == row.owner_id,
+                models.EmbeddingProjection.status == "active",
+                models.EmbeddingProjection.id != projection_id
+            )
+        ).scalars().all()
+        for old in previous:
+            old.status = "retired"
+        row.status = "active"
+        row.activated_at = datetime.datetime.utcnow()
+        db.commit()
+        removed = _drop_retired_rows(db, row.owner_id)
+    _after_switch(row.owner_id)
+    return {"projected": written, "retired_rows_removed": removed}
+
+
+def deactivate_projection(owner_id: int) -> int:
+    """Go back to full-dimension retrieval for an owner."""
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(models.EmbeddingProjection).where(
+                models.EmbeddingProjection.owner_id == owner_id,
+                models.EmbeddingProjection.status == "active"
+            )
+        ).scalars().all()
+        for row in rows:
+            row.status = "retired"
+        db.commit()
+        _drop_retired_rows(db, owner_id)
+    _after_switch(owner_id)
+    return len(rows)
+
+
+def _drop_retired_rows(db, owner_id: int) -> int:
+    retired = select(models.EmbeddingProjection.id).where(
+        models.EmbeddingProjection.owner_id == owner_id,
+        models.EmbeddingProjection.status == "retired"
+    )
+    result = db.execute(delete(models.ChunkProjection).where(models.ChunkProjection.projection_id.in_(retired)))
+    db.commit()
+    return result.rowcount or 0
+
+
+def _after_switch(owner_id: int) -> None:
+    projection_registry.invalidate(owner_id)
+    # Shards hold the owner's vectors in the old space; they rebuild on their next tick.
+    # API workers pick up the switch within PROJECTION_CACHE_SECONDS.
+    from app.rag.sharding import shard_client
+    if shard_client.enabled:
+        shard_client.broadcast("reload")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = commands.add_parser("report", help="recall@10 versus dimension, nothing is stored")
+    fit_parser = commands.add_parser("fit", help="fit and store a new projection version")
+    for sub in (report_parser, fit_parser):
+        sub.add_argument("--owner-id", type=int, required=True)
+        sub.add_argument("--method", choices=METHODS, default="pca")
+        sub.add_argument("--sample", type=int, default=50_000, help="chunks to fit and evaluate on")
+        sub.add_argument("--seed", type=int, default=0)
+    fit_parser.add_argument("--dims", type=int, default=128)
+    fit_parser.add_argument("--activate", action="store_true")
+    fit_parser.add_argument("--min-recall", type=float, default=0.0, help="only activate at or above this recall@10")
+
+    activate_parser = commands.add_parser("activate")
+    activate_parser.add_argument("--version", type=int, required=True)
+    deactivate_parser = commands.add_parser("deactivate")
+    deactivate_parser.add_argument("--owner-id", type=int, required=True)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.command == "report":
+        with SessionLocal() as db:
+            vectors = sample_embeddings(db, args.owner_id, args.sample)
+        print(json.dumps(recall_report(vectors, args.method, seed=args.seed), indent=2))
+        return 0
+    if args.command == "fit":
+        row = create_projection(args.owner_id, args.dims, args.method, args.sample, args.seed)
+        recall = row.report["recall"].get(str(row.output_dim), 0.0)
+        result = {"version": row.id, "output_dim": row.output_dim, "recall": recall, "report": row.report}
+        if args.activate:
+            if recall >= args.min_recall:
+                result["activated"] = activate_projection(row.id)
+            else:
+                logger.warning(f"Version {row.id} not activated: recall {recall} < {args.min_recall}")
+        print(json.dumps(result, indent=2))
+        return 0
+    if args.command == "activate":
+        print(json.dumps(activate_projection(args.version), indent=2))
+        return 0
+    print(json.dumps({"retired": deactivate_projection(args.owner_id)}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""Background removal of soft-deleted documents, and storage garbage collection.
+
+    # one pass by hand, e.g. after a large purge
+    python -m app.rag.reaper --once
+    python -m app.rag.reaper --once --gc
+
+Deleting a document only sets its deleted_at, which hides it from listings
+and retrieval at once. The reaper then removes its chunks (and their reduced
+vectors) in batches of REAPER_BATCH_SIZE, each in its own short transaction,
+and finally its file and row. Purge jobs finish when the reaper has removed
+all of their documents.
+
+Every REAPER_GC_INTERVAL_SECONDS it also collects what earlier versions or
+crashes left behind: chunks of documents that no longer exist, reduced
+vectors of chunks that no longer exist, and upload files no document
+refers to (older than REAPER_GC_GRACE_SECONDS, so uploads in flight are safe).
+
+Each API worker runs the loop; on PostgreSQL an advisory lock lets only one
+of them work at a time.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict
+
+from sqlalchemy import delete, func, select, text
+
+from app.core.config import settings
+from app.core.database import SessionLocal, engine
+from app.db import models
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary application-wide key for pg_try_advisory_lock
+ADVISORY_LOCK_KEY = 0x52454150
+
+
+def _chunk_batch(db, condition) -> list:
+    # SKIP LOCKED (ignored on SQLite) so a concurrent pass never waits on the same rows
+    return db.execute(
+        select(models.DocumentChunk.id).where(condition).limit(settings.REAPER_BATCH_SIZE).with_for_update(skip_locked=True)
+    ).scalars().all()
+
+
+def _delete_chunks(db, chunk_ids: list) -> None:
+    db.execute(delete(models.ChunkProjection).where(models.ChunkProjection.chunk_id.in_(chunk_ids)))
+    db.execute(delete(models.DocumentChunk).where(models.DocumentChunk.id.in_(chunk_ids)))
+    db.commit()
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        # Left to garbage collection
+        logger.warning(f"Could not remove {path}: {str(e)}")
+
+
+def reap_documents(max_seconds: float = 30.0) -> Dict[str, int]:
+    """Remove soft-deleted documents, oldest first, for at most `max_seconds`."""
+    stats = {"documents": 0, "chunks": 0}
+    deadline = time.monotonic() + max_seconds
+    with SessionLocal() as db:
+        while time.monotonic() < deadline:
+            documents = db.execute(
+                select(models.Document)
+                .where(models.Document.deleted_at.isnot(None))
+                .order_by(models.Document.deleted_at, models.Document.id)
+                .limit(10)
+            ).scalars().all()
+            if not documents:
+                break
+            for document in documents:
+                while time.monotonic() < deadline:
+                    chunk_ids = _chunk_batch(db, models.DocumentChunk.document_id == document.id)
+                    if not chunk_ids:
+                        break
+                    _delete_chunks(db, chunk_ids)
+                    stats["chunks"] += len(chunk_ids)
+                    # Leave room for the request path between batches
+                    time.sleep(settings.REAPER_BATCH_PAUSE_SECONDS)
+                else:
+                    # Out of time: this document is finished on the next pass
+                    break
+                db.execute(delete(models.Document).where(models.Document.id == document.id))
+                db.commit()
+                if document.file_path:
+                    _remove_file(document.file_path)
+                stats["documents"] += 1
+            finish_purge_jobs(db)
+    return stats
+
+
+def finish_purge_jobs(db) -> int:
+    finished = 0
+    for job in db.execute(select(models.PurgeJob).where(models.PurgeJob.status == "running")).scalars().all():
+        remaining = db.execute(
+            select(func.count(models.Document.id)).where(
+                models.Document.owner_id == job.owner_id,
+                models.Document.deleted_at.isnot(None),
+                models.Document.deleted_at <= job.created_at
+            )
+        ).scalar()
+        if remaining == 0:
+            job.status = "done"
+            job.finished_at = datetime.datetime.utcnow()
+            finished += 1
+    db.commit()
+    return finished
+
+
+def collect_garbage() -> Dict[str, int]:
+    """Remove orphaned chunks, reduced vectors and upload files."""
+    stats = {"orphan_chunks": 0, "orphan_projections": 0, "orphan_files": 0}
+    with SessionLocal() as db:
+        orphan = ~select(models.Document.id).where(models.Document.id == models.DocumentChunk.document_id).exists()
+        while True:
+            chunk_ids = _chunk_batch(db, orphan)
+            if not chunk_ids:
+                break
+            _delete_chunks(db, chunk_ids)
+            stats["orphan_chunks"] += len(chunk_ids)
+            time.sleep(settings.REAPER_BATCH_PAUSE_SECONDS)
+
+        orphan_projection = ~select(models.DocumentChunk.id).where(models.DocumentChunk.id == models.ChunkProjection.chunk_id).exists()
+        while True:
+            chunk_ids = db.execute(
+                select(models.ChunkProjection.chunk_id).where(orphan_projection).limit(settings.REAPER_BATCH_SIZE)
+            ).scalars().all()
+            if not chunk_ids:
+                break
+            db.execute(delete(models.ChunkProjection).where(models.ChunkProjection.chunk_id.in_(chunk_ids)))
+            db.commit()
+            stats["orphan_projections"] += len(chunk_ids)
+
+        # Files of soft-deleted documents still count: the reaper removes them itself
+        referenced = {
+            os.path.abspath(path)
+            for path in db.execute(select(models.Document.file_path).where(models.Document.file_path.isnot(None))).scalars()
+        }
+
+    cutoff = time.time() - settings.REAPER_GC_GRACE_SECONDS
+    # Uploads live in user_<id>/ folders; artifacts, projections and tiers are elsewhere
+    for entry in os.scandir(settings.UPLOAD_FOLDER):
+        if not (entry.is_dir() and entry.name.startswith("user_")):
+            continue
+        for root, _, files in os.walk(entry.path):
+            for name in files:
+                path = os.path.abspath(os.path.join(root, name))
+                try:
+                    if path in referenced or os.path.getmtime(path) > cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                _remove_file(path)
+                stats["orphan_files"] += 1
+    return stats
+
+
+class Reaper:
+    def __init__(self):
+        self._task = None
+        self.last_gc = 0.0
+        self.last_run: Dict[str, object] = {}
+
+    def run_once(self, gc: bool = False) -> Dict[str, object]:
+        with engine.connect() as connection:
+            if engine.dialect.name == "postgresql":
+                locked = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}).scalar()
+                # The lock belongs to the session; don't sit idle in a transaction meanwhile
+                connection.commit()
+                if not locked:
+                    return {"skipped": "another worker is reaping"}
+            try:
+                result: Dict[str, object] = {"reaped": reap_documents()}
+                if gc or time.time() - self.last_gc >= settings.REAPER_GC_INTERVAL_SECONDS:
+                    result["gc"] = collect_garbage()
+                    self.last_gc = time.time()
+            finally:
+                if engine.dialect.name == "postgresql":
+                    connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+                    connection.commit()
+        self.last_run = {"at": datetime.datetime.utcnow().isoformat(), **result}
+        return result
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"Reaper pass failed: {str(e)}")
+            await asyncio.sleep(settings.REAPER_INTERVAL_SECONDS)
+
+    async def start(self) -> None:
+        if settings.REAPER_INTERVAL_SECONDS > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, object]:
+        return {"running": self._task is not None, "last_run": self.last_run}
+
+
+reaper = Reaper()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="one pass, then exit (default: run forever)")
+    parser.add_argument("--gc", action="store_true", help="include garbage collection in the pass")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    while True:
+        result = reaper.run_once(gc=args.gc)
+        print(json.dumps(result), flush=True)
+        if args.once:
+            return 0
+        time.sleep(settings.REAPER_INTERVAL_SECONDS or 10)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Re-chunk and re-embed documents from their stored text artifacts.
+
+    # new chunking parameters for one tenant
+    python -m app.rag.reprocess --owner-id 7 --chunk-size 800 --overlap 150
+
+    # everything, e.g. after switching the embedding model
+    python -m app.rag.reprocess --all
+
+Text comes from the artifact store (app/rag/artifacts.py); an original file is
+only parsed when its artifact is missing, and the artifact is stored then.
+Each document's chunks are swapped in one transaction, so questions see either
+the old or the new chunks, never a mix.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+from app.core.database import SessionLocal
+from app.db import crud, models
+from app.rag import embeddings
+from app.rag.artifacts import artifact_store
+from app.rag.document_processor import EXTRACTORS, create_chunks, extractor_for
+from app.rag.projection import projection_registry
+from app.rag.sharding import shard_client
+
+logger = logging.getLogger(__name__)
+
+
+def reprocess_documents(
+    owner_id: Optional[int] = None,
+    document_ids: Optional[List[int]] = None,
+    chunk_size: int = 1000,
+    overlap: int = 200,
+    batch_size: int = 100
+) -> Dict[str, float]:
+    stats = {"documents": 0, "chunks": 0, "artifact_hits": 0, "extracted": 0, "skipped": 0, "seconds": 0.0}
+    started = time.perf_counter()
+    last_id = 0
+    with SessionLocal() as db:
+        while True:
+            query = db.query(models.Document).filter(
+                models.Document.processed == True,
+                models.Document.deleted_at.is_(None),
+                models.Document.id > last_id
+            )
+            if owner_id is not None:
+                query = query.filter(models.Document.owner_id == owner_id)
+            if document_ids:
+                query = query.filter(models.Document.id.in_(document_ids))
+            documents = query.order_by(models.Document.id).limit(batch_size).all()
+            if not documents:
+                break
+            for document in documents:
+                last_id = document.id
+                try:
+                    extractor = EXTRACTORS[extractor_for(document.file_path or "", document.content_type)]
+                    artifact = artifact_store.get(document.file_sha256, extractor) if document.file_sha256 else None
+                    if artifact is not None:
+                        stats["artifact_hits"] += 1
+                    elif document.file_path and os.path.exists(document.file_path):
+                        artifact = artifact_store.load_or_extract(document.file_path, document.content_type)
+                        document.file_sha256 = artifact.file_sha256
+                        stats["extracted"] += 1
+                    else:
+                        logger.warning(f"Document {document.id}: no artifact and no file, skipped")
+                        stats["skipped"] += 1
+                        continue
+                    chunks = create_chunks(artifact.text, chunk_size, overlap)
+                    vectors = embeddings.generate_embeddings(chunks)
+                    # Shards must drop the old rows before the new ones become visible
+                    notify_shards = (
+                        (lambda document_id=document.id: shard_client.broadcast("remove_documents", document_ids=[document_id]))
+                        if shard_client.enabled else None
+                    )
+                    crud.replace_document_chunks(
+                        db, document.id, chunks, vectors, before_commit=notify_shards,
+                        projection=projection_registry.active_for(document.owner_id)
+                    )
+                    stats["documents"] += 1
+                    stats["chunks"] += len(chunks)
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"Document {document.id}: reprocessing failed: {str(e)}")
+                    stats["skipped"] += 1
+            # Don't keep every processed document in the identity map
+            db.expunge_all()
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    scope = parser.add_mutually_exclusive_group(required=True)
+    scope.add_argument("--owner-id", type=int)
+    scope.add_argument("--document-id", type=int, action="append", dest="document_ids")
+    scope.add_argument("--all", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=200)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    stats = reprocess_documents(args.owner_id, args.document_ids, args.chunk_size, args.overlap)
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
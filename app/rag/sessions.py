@@ -0,0 +1,132 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from app.core.config import settings
+
+
+class ConversationSession:
+    """State kept for one multi-turn conversation."""
+
+    def __init__(self, session_id: str, user_id: int):
+        self.id = session_id
+        self.user_id = user_id
+        self.context: Optional[List[int]] = None  # Ollama context returned by the last turn
+        self.sent_chunk_ids: Set[int] = set()  # Chunks already encoded in the context
+        self.turns = 0
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+    @property
+    def context_tokens(self) -> int:
+        return len(self.context) if self.context else 0
+
+
+class SessionStore:
+    """In-memory, LRU-evicted store of conversation sessions.
+
+    Sessions live in the process that created them, so with several gunicorn
+    workers a follow-up that lands on another worker gets a 404 and the client
+    starts a new session. Limits:
+      - sessions idle longer than ttl_seconds are dropped
+      - at most max_sessions in total and max_sessions_per_user per user
+      - a session whose context grows past max_context_tokens loses its context
+        (the next turn pays a full prefill again)
+      - the sum of context tokens across sessions stays under total_context_tokens,
+        evicting the least recently used sessions first
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = settings.CONVERSATION_SESSION_TTL_SECONDS,
+        max_sessions: int = settings.CONVERSATION_MAX_SESSIONS,
+        max_sessions_per_user: int = settings.CONVERSATION_MAX_SESSIONS_PER_USER,
+        max_context_tokens: int = settings.CONVERSATION_MAX_CONTEXT_TOKENS,
+        total_context_tokens: int = settings.CONVERSATION_TOTAL_CONTEXT_TOKENS
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_sessions_per_user = max_sessions_per_user
+        self.max_context_tokens = max_context_tokens
+        self.total_context_tokens = total_context_tokens
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def create(self, user_id: int) -> ConversationSession:
+        session = ConversationSession(uuid.uuid4().hex, user_id)
+        with self._lock:
+            self._expire()
+            user_sessions = [s for s in self._sessions.values() if s.user_id == user_id]
+            # Drop the user's oldest sessions first so one user can't evict everyone else
+            while len(user_sessions) >= self.max_sessions_per_user:
+                self._remove(user_sessions.pop(0).id)
+            while len(self._sessions) >= self.max_sessions:
+                self._remove(next(iter(self._sessions)))
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id: str, user_id: int) -> Optional[ConversationSession]:
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None or session.user_id != user_id:
+                return None
+            session.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def update(
+        self,
+        session: ConversationSession,
+        context: Optional[List[int]],
+        chunk_ids: List[int]
+    ) -> None:
+        """Record the context returned by a turn and the chunks it sent."""
+        with self._lock:
+            if session.id not in self._sessions:
+                return  # Evicted while the turn was running
+            self._tokens -= session.context_tokens
+            if context and len(context) <= self.max_context_tokens:
+                session.context = context
+                session.sent_chunk_ids.update(chunk_ids)
+            else:
+                # Failed turn or context too large: restart from a full prompt next time
+                session.context = None
+                session.sent_chunk_ids.clear()
+            session.turns += 1
+            session.last_used = time.time()
+            self._tokens += session.context_tokens
+            while self._tokens > self.total_context_tokens and self._sessions:
+                self._remove(next(iter(self._sessions)))
+
+    def delete(self, session_id: str, user_id: int) -> bool:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.user_id != user_id:
+                return False
+            self._remove(session_id)
+            return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"sessions": len(self._sessions), "context_tokens": self._tokens}
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        # Sessions are kept in LRU order, so expired ones are at the front
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_used >= cutoff:
+                break
+            self._remove(oldest.id)
+
+    def _remove(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._tokens -= session.context_tokens
+
+
+session_store = SessionStore()
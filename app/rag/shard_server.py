@@ -0,0 +1,434 @@
+"""Retrieval shard: top-k search over one partition of document_chunks.
+
+    # one shard of four, partitioned by owner
+    python -m app.rag.shard_server --shard 0 --shards 4 --port 7600
+
+    # all four shards on this box (ports 7600-7603), e.g. for local testing;
+    # then run the API with SHARD_ADDRESSES=127.0.0.1:7600,127.0.0.1:7601,...
+    python -m app.rag.shard_server --shards 4 --spawn --port 7600
+
+The shard loads its partition from the database at startup, picks up new
+chunks every SHARD_REFRESH_SECONDS and rebuilds from scratch every
+SHARD_FULL_RELOAD_SECONDS (a rebuild briefly needs twice the memory). Deleted
+documents and purged owners are pushed by the API (remove_documents,
+remove_owner) and hidden immediately; those pushed while a rebuild is reading
+are applied again once it is swapped in.
+Switching an owner's embedding projection asks for a rebuild (reload), done on
+the next maintenance tick.
+
+With SHARD_SNAPSHOT_FOLDER set (or --snapshot), the shard starts from a
+snapshot of its index (app/rag/snapshot.py) instead of reading every
+embedding, and writes a fresh one after each full reload.
+
+With SHARD_MEMORY_BUDGET_BYTES set, the shard loads nothing up front: owners
+are paged in on their first question and the least recently queried are
+evicted to disk (app/rag/tiering.py). Snapshots don't apply then; evicted
+owners' files play that part, and a full reload keeps those that still match
+the database.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+from sqlalchemy import func, or_, select
+
+from app.core.config import settings
+from app.core.database import engine
+from app.db import models
+from app.rag.index import PARTITION_STRATEGIES, VectorIndex, iter_chunk_blocks, partition_clause
+from app.rag.projection import projection_registry
+from app.rag.snapshot import SnapshotError, read_snapshot, write_snapshot
+from app.rag.tiering import TieredIndex
+from app.rag.sharding import encode_frame, read_frame
+
+logger = logging.getLogger(__name__)
+
+
+class ShardServer:
+    def __init__(self, shard: int, shards: int, strategy: str = "owner"):
+        self.shard = shard
+        self.shards = shards
+        self.strategy = strategy
+        self.index: Union[VectorIndex, TieredIndex] = VectorIndex()
+        if settings.SHARD_MEMORY_BUDGET_BYTES > 0:
+            self.index = TieredIndex(
+                settings.SHARD_MEMORY_BUDGET_BYTES,
+                os.path.join(settings.SHARD_TIER_FOLDER, f"shard-{shard}-of-{shards}-{strategy}"),
+                self.load_owner,
+                label=str(shard)
+            )
+        self.watermark = 0
+        # Ids near the watermark already indexed: chunk ids are allocated before
+        # their transaction commits, so a lower id can become visible later
+        self._recent_ids: Set[int] = set()
+        self.loaded_at = 0.0
+        # Documents and owners removed while a load reads the partition; the
+        # new index doesn't have those tombstones, so they are reapplied
+        self._removed_during_load: Optional[Tuple[Set[int], Set[int]]] = None
+        self._removals_lock = threading.Lock()
+
+    @property
+    def partition(self):
+        return partition_clause(self.shard, self.shards, self.strategy)
+
+    @property
+    def tiered(self) -> bool:
+        return isinstance(self.index, TieredIndex)
+
+    @property
+    def snapshot_path(self) -> str:
+        if not settings.SHARD_SNAPSHOT_FOLDER or self.tiered:
+            return ""
+        return os.path.join(settings.SHARD_SNAPSHOT_FOLDER, f"shard-{self.shard}-of-{self.shards}-{self.strategy}.snap")
+
+    def remove_documents(self, document_ids: Sequence[int]) -> int:
+        with self._removals_lock:
+            if self._removed_during_load is not None:
+                self._removed_during_load[0].update(int(document_id) for document_id in document_ids)
+        return self.index.remove_documents(document_ids)
+
+    def remove_owners(self, owner_ids: Sequence[int]) -> int:
+        with self._removals_lock:
+            if self._removed_during_load is not None:
+                self._removed_during_load[1].update(int(owner_id) for owner_id in owner_ids)
+        return self.index.remove_owners(owner_ids)
+
+    def _begin_load(self) -> None:
+        with self._removals_lock:
+            self._removed_during_load = (set(), set())
+
+    def _abort_load(self) -> None:
+        with self._removals_lock:
+            self._removed_during_load = None
+
+    def _swap_in(self, index: VectorIndex) -> None:
+        with self._removals_lock:
+            # Removals from here on reach the new contents directly
+            self.index.replace(index)
+            documents, owners = self._removed_during_load or (set(), set())
+            self._removed_during_load = None
+        if documents or owners:
+            self._reapply_removals(documents, owners)
+        self.watermark = index.stats()["max_id"]
+        self._recent_ids = set(index.ids_above(self.watermark - settings.SHARD_REFRESH_LOOKBACK))
+        self.loaded_at = time.time()
+
+    def _reapply_removals(self, document_ids: Set[int], owner_ids: Set[int]) -> int:
+        """Tombstone rows of these documents and owners that the database no longer has.
+
+        By chunk id, as in VectorIndex.compact: a re-chunked document's new
+        rows and documents uploaded after a purge stay alive.
+        """
+        document_ids, owner_ids = sorted(document_ids), sorted(owner_ids)
+        with engine.connect() as connection:
+            live = np.fromiter(connection.execute(
+                select(models.DocumentChunk.id)
+                .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+                .where(
+                    self.partition,
+                    models.Document.deleted_at.is_(None),
+                    or_(models.Document.id.in_(document_ids), models.Document.owner_id.in_(owner_ids))
+                )
+            ).scalars(), dtype=np.int64)
+        stale = [
+            segment.ids[
+                (np.isin(segment.document_ids, document_ids) | np.isin(segment.owner_ids, owner_ids))
+                & ~np.isin(segment.ids, live)
+            ]
+            for segment in self.index.segments()
+        ]
+        return self.index.remove_chunks(np.concatenate(stale)) if stale else 0
+
+    def load_owner(self, owner_id: int) -> VectorIndex:
+        """One owner's rows of the partition, for a tiered page-in."""
+        index = VectorIndex()
+        with engine.connect() as connection:
+            where = self.partition & (models.Document.owner_id == owner_id)
+            for block in iter_chunk_blocks(connection, where, projections=projection_registry):
+                index.add(*block)
+        index.compact()
+        return index
+
+    def load(self) -> None:
+        """Build the partition from scratch and swap it in."""
+        if self.tiered:
+            # No vectors are read up front: owners and tier files that still
+            # match the database are kept, the rest are paged in again
+            started = time.perf_counter()
+            with engine.connect() as connection:
+                partition_ids = (
+                    select(models.DocumentChunk.id)
+                    .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+                    .where(self.partition)
+                )
+                self.watermark = connection.execute(
+                    select(func.max(models.DocumentChunk.id))
+                    .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+                    .where(self.partition)
+                ).scalar() or 0
+                self._recent_ids = set(connection.execute(
+                    partition_ids.where(models.DocumentChunk.id > self.watermark - settings.SHARD_REFRESH_LOOKBACK)
+                ).scalars())
+                rows = connection.execute(
+                    select(models.DocumentChunk.id, models.Document.owner_id)
+                    .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+                    .where(self.partition, models.Document.deleted_at.is_(None))
+                ).all()
+                active = dict(connection.execute(
+                    select(models.EmbeddingProjection.owner_id, models.EmbeddingProjection.id)
+                    .where(models.EmbeddingProjection.status == "active")
+                ).all())
+            ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            owners = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+            order = np.lexsort((ids, owners))
+            ids, owners = ids[order], owners[order]
+            starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]]) if len(owners) else np.empty(0, dtype=np.int64)
+            chunk_ids = {int(owners[start]): chunks for start, chunks in zip(starts, np.split(ids, starts[1:]))}
+            stats = self.index.revalidate(chunk_ids, active)
+            self.loaded_at = time.time()
+            logger.info(f"Shard {self.shard}/{self.shards} revalidated tiered owners in {time.perf_counter() - started:.1f}s: {stats}")
+            return
+        started = time.perf_counter()
+        self._begin_load()
+        try:
+            index = VectorIndex()
+            with engine.connect() as connection:
+                for block in iter_chunk_blocks(connection, self.partition, projections=projection_registry):
+                    index.add(*block)
+            index.compact()
+        except BaseException:
+            self._abort_load()
+            raise
+        self._swap_in(index)
+        logger.info(f"Shard {self.shard}/{self.shards} loaded {index.stats()['rows']} chunks in {time.perf_counter() - started:.1f}s")
+
+    def snapshot(self, path: str = "") -> Dict[str, Any]:
+        if self.tiered:
+            raise ValueError("A tiered shard keeps its evicted owners on disk instead of snapshots")
+        path = path or self.snapshot_path
+        if not path:
+            raise ValueError("No snapshot path given and SHARD_SNAPSHOT_FOLDER is not set")
+        started = time.perf_counter()
+        header = write_snapshot(self.index, path, {
+            "shard": self.shard,
+            "shards": self.shards,
+            "strategy": self.strategy,
+            "watermark": self.watermark
+        })
+        logger.info(f"Shard {self.shard}/{self.shards} wrote {header['rows']} rows to {path} in {time.perf_counter() - started:.1f}s")
+        return {"path": path, "rows": header["rows"], "bytes": header["data_bytes"], "sha256": header["sha256"]}
+
+    def restore(self, path: str, verify: bool = True) -> Dict[str, int]:
+        """Start from a snapshot, then replay what changed in the database since.
+
+        The database keeps no change log, so the replay diffs chunk ids: rows
+        gone from the partition (deleted or re-chunked documents) are
+        tombstoned, rows missing from the snapshot are read and added, and
+        owners whose active projection changed are re-read entirely.
+        """
+        started = time.perf_counter()
+        index, header = read_snapshot(path, verify)
+        if (header.get("shard"), header.get("shards"), header.get("strategy")) != (self.shard, self.shards, self.strategy):
+            raise SnapshotError(
+                f"{path} holds shard {header.get('shard')}/{header.get('shards')} ({header.get('strategy')}), "
+                f"not {self.shard}/{self.shards} ({self.strategy})"
+            )
+        with engine.connect() as connection:
+            chunk_ids = np.fromiter(connection.execute(
+                select(models.DocumentChunk.id)
+                .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+                .where(self.partition, models.Document.deleted_at.is_(None))
+            ).scalars(), dtype=np.int64)
+            active = dict(connection.execute(
+                select(models.EmbeddingProjection.owner_id, models.EmbeddingProjection.id)
+                .where(models.EmbeddingProjection.status == "active")
+            ).all())
+            stale = int(index.remove_chunks(np.setdiff1d(index.alive_ids(), chunk_ids)))
+            changed = sorted({
+                owner for segment in index.segments() for owner in segment.owner_ranges
+                if active.get(owner, 0) != segment.projection_id
+            })
+            if changed:
+                stale += index.remove_owners(changed)
+            missing = np.setdiff1d(chunk_ids, index.alive_ids()).tolist()
+            added = 0
+            for start in range(0, len(missing), 1000):
+                where = self.partition & models.DocumentChunk.id.in_(missing[start:start + 1000])
+                for block in iter_chunk_blocks(connection, where, projections=projection_registry):
+                    added += index.add(*block)
+        self._swap_in(index)
+        stats = {"snapshot_rows": header["rows"], "removed": stale, "added": added, "owners_reprojected": len(changed)}
+        logger.info(f"Shard {self.shard}/{self.shards} restored from {path} in {time.perf_counter() - started:.1f}s: {stats}")
+        return stats
+
+    def start(self, snapshot_path: str = "") -> None:
+        """Initial load: from a snapshot when there is a usable one, else from the database."""
+        snapshot_path = snapshot_path or self.snapshot_path
+        if snapshot_path and self.tiered:
+            logger.warning(f"Shard {self.shard}: tiered, ignoring snapshot {snapshot_path}")
+        elif snapshot_path and os.path.exists(snapshot_path):
+            try:
+                self.restore(snapshot_path)
+                return
+            except (SnapshotError, OSError, ValueError) as e:
+                logger.warning(f"Shard {self.shard}: snapshot {snapshot_path} unusable, loading from the database: {str(e)}")
+        self.full_reload()
+
+    def full_reload(self) -> None:
+        self.load()
+        if self.snapshot_path:
+            try:
+                self.snapshot()
+            except OSError as e:
+                logger.error(f"Shard {self.shard}: writing snapshot failed: {str(e)}")
+
+    def refresh(self) -> int:
+        """Index chunks committed since the last load or refresh."""
+        low = max(0, self.watermark - settings.SHARD_REFRESH_LOOKBACK)
+        added = 0
+        with engine.connect() as connection:
+            ids = connection.execute(
+                select(models.DocumentChunk.id)
+                .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+                .where(self.partition, models.DocumentChunk.id > low)
+            ).scalars().all()
+            new_ids = [chunk_id for chunk_id in ids if chunk_id not in self._recent_ids]
+            for start in range(0, len(new_ids), 1000):
+                where = self.partition & models.DocumentChunk.id.in_(new_ids[start:start + 1000])
+                for block in iter_chunk_blocks(connection, where, projections=projection_registry):
+                    added += self.index.add(*block)
+        if ids:
+            self.watermark = max(self.watermark, max(ids))
+        floor = self.watermark - settings.SHARD_REFRESH_LOOKBACK
+        self._recent_ids = {chunk_id for chunk_id in self._recent_ids.union(ids) if chunk_id > floor}
+        return added
+
+    def handle(self, header: Dict[str, Any], payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+        method = header.get("method")
+        if method == "search":
+            queries = np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+            results = self.index.search(
+                queries, header.get("owner_id"), header.get("top_k", 5), header.get("threshold", -1.0),
+                header.get("projection_id") or 0
+            )
+            return {"results": results}, b""
+        if method == "snapshot":
+            # Never a caller-chosen path: anyone reaching the port could write files anywhere
+            return self.snapshot(), b""
+        if method == "reload":
+            # Picked up by _maintain; rebuilding here would outlast the caller's timeout
+            self.loaded_at = 0.0
+            return {"scheduled": True}, b""
+        if method == "remove_documents":
+            return {"removed": self.remove_documents(header["document_ids"])}, b""
+        if method == "remove_owner":
+            return {"removed": self.remove_owners([header["owner_id"]])}, b""
+        if method == "stats":
+            return {
+                "shard": self.shard,
+                "shards": self.shards,
+                "strategy": self.strategy,
+                "watermark": self.watermark,
+                "loaded_at": self.loaded_at,
+                **self.index.stats()
+            }, b""
+        if method == "ping":
+            return {"ok": True}, b""
+        return {"error": f"Unknown method: {method}"}, b""
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    header, payload = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    return
+                try:
+                    # Searches release the GIL in numpy; keep the loop free for other clients
+                    response, response_payload = await asyncio.to_thread(self.handle, header, payload)
+                except Exception as e:
+                    logger.exception("Shard request failed")
+                    response, response_payload = {"error": str(e)}, b""
+                writer.write(encode_frame(response, response_payload))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _maintain(self) -> None:
+        while True:
+            await asyncio.sleep(settings.SHARD_REFRESH_SECONDS)
+            try:
+                if time.time() - self.loaded_at >= settings.SHARD_FULL_RELOAD_SECONDS:
+                    await asyncio.to_thread(self.full_reload)
+                else:
+                    await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"Shard {self.shard} refresh failed: {str(e)}")
+
+    async def serve(self, host: str, port: int, unix_path: str = "", snapshot_path: str = "") -> None:
+        await asyncio.to_thread(self.start, snapshot_path)
+        if unix_path:
+            server = await asyncio.start_unix_server(self._serve_connection, path=unix_path)
+        else:
+            server = await asyncio.start_server(self._serve_connection, host, port)
+        logger.info(f"Shard {self.shard}/{self.shards} listening on {unix_path or f'{host}:{port}'}")
+        maintenance = asyncio.create_task(self._maintain())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            maintenance.cancel()
+
+
+def spawn(args) -> int:
+    """Run every shard of this box as a child process until interrupted."""
+    processes: List[subprocess.Popen] = []
+    for shard in range(args.shards):
+        command = [
+            sys.executable, "-m", "app.rag.shard_server",
+            "--shard", str(shard), "--shards", str(args.shards),
+            "--strategy", args.strategy, "--host", args.host, "--port", str(args.port + shard)
+        ]
+        processes.append(subprocess.Popen(command))
+    addresses = ",".join(f"{args.host}:{args.port + shard}" for shard in range(args.shards))
+    print(f"SHARD_ADDRESSES={addresses}", flush=True)
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shard", type=int, default=0)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--strategy", choices=PARTITION_STRATEGIES, default=settings.SHARD_STRATEGY)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7600)
+    parser.add_argument("--unix-socket", default="", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--spawn", action="store_true", help="start all --shards shards on consecutive ports")
+    parser.add_argument("--snapshot", default="", help="start from this snapshot file (default: SHARD_SNAPSHOT_FOLDER)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s shard-{args.shard} %(levelname)s %(message)s")
+    if args.spawn:
+        return spawn(args)
+    if args.unix_socket and os.path.exists(args.unix_socket):
+        os.remove(args.unix_socket)
+    asyncio.run(ShardServer(args.shard, args.shards, args.strategy).serve(args.host, args.port, args.unix_socket, args.snapshot))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""Scatter-gather retrieval over shard processes (see app/rag/shard_server.py).
+
+Wire format, both directions: 4-byte big-endian header length, a JSON
+header, then `payload_bytes` raw bytes (float32 query vectors for a search).
+Connections are kept open and reused; a connection that timed out or failed
+is closed rather than returned to its pool.
+
+The client fans a search out to the shards that can hold the owner's chunks
+in parallel and waits at most SHARD_DEADLINE_SECONDS: shards that haven't
+answered by then are left out of the merge and reported as missing.
+"""
+import json
+import logging
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import SHARD_REQUEST_SECONDS, SHARD_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+HEADER_LENGTH = struct.Struct(">I")
+
+
+def encode_frame(header: Dict[str, Any], payload: bytes = b"") -> bytes:
+    header = {**header, "payload_bytes": len(payload)}
+    body = json.dumps(header).encode()
+    return HEADER_LENGTH.pack(len(body)) + body + payload
+
+
+async def read_frame(reader) -> Tuple[Dict[str, Any], bytes]:
+    """Read one frame from an asyncio StreamReader."""
+    (length,) = HEADER_LENGTH.unpack(await reader.readexactly(HEADER_LENGTH.size))
+    header = json.loads(await reader.readexactly(length))
+    payload = await reader.readexactly(header.get("payload_bytes", 0)) if header.get("payload_bytes") else b""
+    return header, payload
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        part = sock.recv(size - len(buffer))
+        if not part:
+            raise ConnectionError("Shard closed the connection")
+        buffer.extend(part)
+    return bytes(buffer)
+
+
+def read_frame_sync(sock: socket.socket) -> Tuple[Dict[str, Any], bytes]:
+    (length,) = HEADER_LENGTH.unpack(_recv_exactly(sock, HEADER_LENGTH.size))
+    header = json.loads(_recv_exactly(sock, length))
+    payload = _recv_exactly(sock, header["payload_bytes"]) if header.get("payload_bytes") else b""
+    return header, payload
+
+
+class ShardConnection:
+    """Pool of blocking connections to one shard ("host:port" or "unix:/path")."""
+
+    def __init__(self, address: str):
+        self.address = address
+        self._idle: List[socket.socket] = []
+        self._lock = threading.Lock()
+
+    def _connect(self, timeout: float) -> socket.socket:
+        if self.address.startswith("unix:"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(self.address[len("unix:"):])
+        else:
+            host, port = self.address.rsplit(":", 1)
+            sock = socket.create_connection((host, int(port)), timeout=timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def call(self, header: Dict[str, Any], payload: bytes = b"", timeout: float = 1.0) -> Tuple[Dict[str, Any], bytes]:
+        with self._lock:
+            sock = self._idle.pop() if self._idle else None
+        if sock is None:
+            sock = self._connect(timeout)
+        try:
+            sock.settimeout(timeout)
+            sock.sendall(encode_frame(header, payload))
+            response, response_payload = read_frame_sync(sock)
+        except Exception:
+            sock.close()
+            raise
+        with self._lock:
+            self._idle.append(sock)
+        if "error" in response:
+            raise RuntimeError(f"Shard {self.address}: {response['error']}")
+        return response, response_payload
+
+
+class ShardClient:
+    def __init__(self, addresses: List[str], strategy: str = "owner", deadline: float = 0.5):
+        self.shards = [ShardConnection(address) for address in addresses]
+        self.strategy = strategy
+        self.deadline = deadline
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "ShardClient":
+        addresses = [address.strip() for address in settings.SHARD_ADDRESSES.split(",") if address.strip()]
+        return cls(addresses, settings.SHARD_STRATEGY, settings.SHARD_DEADLINE_SECONDS)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.shards)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=4 * len(self.shards), thread_name_prefix="shard-client")
+        return self._executor
+
+    def shards_for(self, owner_id: Optional[int]) -> List[int]:
+        if self.strategy == "owner" and owner_id is not None:
+            return [owner_id % len(self.shards)]
+        return list(range(len(self.shards)))
+
+    def _call_shard(self, shard: int, header: Dict[str, Any], payload: bytes, timeout: float):
+        started = time.perf_counter()
+        try:
+            result = self.shards[shard].call(header, payload, timeout)
+        except socket.timeout:
+            SHARD_REQUESTS.labels(str(shard), "timeout").inc()
+            raise
+        except Exception:
+            SHARD_REQUESTS.labels(str(shard), "error").inc()
+            raise
+        SHARD_REQUESTS.labels(str(shard), "success").inc()
+        SHARD_REQUEST_SECONDS.labels(str(shard)).observe(time.perf_counter() - started)
+        return result
+
+    def search(
+        self,
+        queries: List[List[float]],
+        owner_id: Optional[int],
+        top_k: int = 5,
+        threshold: float = 0.25,
+        projection_id: int = 0
+    ) -> Tuple[List[List[Tuple[int, float]]], List[int]]:
+        """Merged top-k (chunk id, score) per query, plus the shards that didn't answer in time.
+
+        Queries projected with an owner's embedding projection pass its version.
+        """
+        matrix = np.asarray(queries, dtype=np.float32)
+        header = {
+            "method": "search",
+            "owner_id": owner_id,
+            "top_k": top_k,
+            "threshold": threshold,
+            "projection_id": projection_id,
+            "shape": list(matrix.shape)
+        }
+        payload = matrix.tobytes()
+        deadline = time.monotonic() + self.deadline
+        futures = {
+            self.executor.submit(self._call_shard, shard, header, payload, self.deadline): shard
+            for shard in self.shards_for(owner_id)
+        }
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        missing = [futures[future] for future in not_done]
+        for future in not_done:
+            # The socket timeout ends the call soon; its connection is discarded then
+            future.cancel()
+
+        merged: List[List[Tuple[int, float]]] = [[] for _ in range(len(matrix))]
+        for future in done:
+            try:
+                response, _ = future.result()
+            except Exception as e:
+                missing.append(futures[future])
+                logger.warning(f"Shard {futures[future]} failed: {str(e)}")
+                continue
+            for row, hits in enumerate(response["results"]):
+                merged[row].extend((int(chunk_id), float(score)) for chunk_id, score in hits)
+        if missing:
+            logger.warning(f"Search answered without shards {sorted(missing)}")
+        return [sorted(hits, key=lambda hit: hit[1], reverse=True)[:top_k] for hits in merged], sorted(missing)
+
+    def broadcast(self, method: str, timeout: Optional[float] = None, **params) -> Dict[int, Any]:
+        """Send a control call to every shard; failures are logged, not raised."""
+        header = {"method": method, **params}
+        timeout = timeout or settings.SHARD_CONTROL_TIMEOUT_SECONDS
+        futures = {
+            self.executor.submit(self.shards[shard].call, header, b"", timeout): shard
+            for shard in range(len(self.shards))
+        }
+        results = {}
+        for future, shard in futures.items():
+            try:
+                results[shard] = future.result()[0]
+            except Exception as e:
+                logger.warning(f"Shard {shard} did not handle {method}: {str(e)}")
+                results[shard] = {"error": str(e)}
+        return results
+
+
+shard_client = ShardClient.from_settings()
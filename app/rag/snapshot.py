@@ -0,0 +1,227 @@
+"""Snapshots of a shard's vector index in one versioned, checksummed file.
+
+    # written by a running shard (all shards: POST /admin/shards/snapshot)
+    python -m app.rag.snapshot export --shard 0 --shards 4 --out shard-0-of-4.snap
+    python -m app.rag.snapshot inspect shard-0-of-4.snap --verify
+
+    # start a shard from it (on another host too)
+    python -m app.rag.shard_server --shard 0 --shards 4 --snapshot shard-0-of-4.snap
+
+Layout, integers little-endian:
+
+    magic "RAGSNAP\\0" | format version (u32) | header length (u32) | JSON header
+    | zero padding to 64 bytes | data
+
+The header names the shard and, per segment, its projection version and the
+offset, dtype and shape of each of its arrays in the data section: chunk ids,
+owner ids, document ids, the alive mask (tombstones), the owner partitions
+(owners with the start and end of their rows) and the float32 vectors. Every
+array starts on a 64-byte boundary, so loading maps the file and wraps the
+arrays in place instead of parsing anything; pages are read on first use.
+The header carries the SHA-256 of the data section.
+
+A snapshot is a starting point, not the truth: after loading, the shard diffs
+its chunk ids against the database and replays what changed since
+(ShardServer.restore).
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from app.rag.index import Segment, VectorIndex
+
+MAGIC = b"RAGSNAP\x00"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+PREFIX = struct.Struct("<8sII")
+SEGMENT_ARRAYS = ("ids", "owner_ids", "document_ids", "alive", "owners", "starts", "ends", "vectors")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _segment_arrays(segment: Segment) -> Dict[str, np.ndarray]:
+    owners = sorted(segment.owner_ranges)
+    return {
+        "ids": segment.ids,
+        "owner_ids": segment.owner_ids,
+        "document_ids": segment.document_ids,
+        # Copied: tombstones keep being set while the snapshot is written
+        "alive": segment.alive.copy(),
+        "owners": np.asarray(owners, dtype=np.int64),
+        "starts": np.asarray([segment.owner_ranges[owner][0] for owner in owners], dtype=np.int64),
+        "ends": np.asarray([segment.owner_ranges[owner][1] for owner in owners], dtype=np.int64),
+        "vectors": segment.vectors
+    }
+
+
+def write_snapshot(index: VectorIndex, path: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+    """Write the index to `path` atomically; returns the header."""
+    layout: List[Dict[str, Any]] = []
+    blocks: List[Tuple[int, np.ndarray]] = []
+    offset = 0
+    for segment in index.segments():
+        arrays = {}
+        for name, array in _segment_arrays(segment).items():
+            array = np.ascontiguousarray(array)
+            offset = _aligned(offset)
+            arrays[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+            blocks.append((offset, array))
+            offset += array.nbytes
+        layout.append({"rows": len(segment), "projection_id": segment.projection_id, "arrays": arrays})
+    data_bytes = offset
+
+    def data() -> Iterator[memoryview]:
+        position = 0
+        for start, array in blocks:
+            if start > position:
+                yield memoryview(bytes(start - position))
+            yield memoryview(array).cast("B")
+            position = start + array.nbytes
+
+    digest = hashlib.sha256()
+    for part in data():
+        digest.update(part)
+    header = {
+        **meta,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "rows": sum(segment["rows"] for segment in layout),
+        "segments": layout,
+        "data_bytes": data_bytes,
+        "sha256": digest.hexdigest()
+    }
+    header_bytes = json.dumps(header).encode()
+    prefix = PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_bytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(prefix)
+            f.write(header_bytes)
+            f.write(bytes(_aligned(f.tell()) - f.tell()))
+            for part in data():
+                f.write(part)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return header
+
+
+def read_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """(header, offset of the data section)."""
+    with open(path, "rb") as f:
+        prefix = f.read(PREFIX.size)
+        if len(prefix) < PREFIX.size:
+            raise SnapshotError(f"{path} is not a snapshot")
+        magic, version, header_length = PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a snapshot")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"{path} has format version {version}, expected {FORMAT_VERSION}")
+        header = json.loads(f.read(header_length))
+    data_offset = _aligned(PREFIX.size + header_length)
+    if os.path.getsize(path) != data_offset + header["data_bytes"]:
+        raise SnapshotError(f"{path} is truncated")
+    return header, data_offset
+
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+    header, data_offset = read_header(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(data_offset)
+        for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            digest.update(block)
+    if digest.hexdigest() != header["sha256"]:
+        raise SnapshotError(f"{path} failed its checksum")
+    return header
+
+
+def read_snapshot(path: str, verify: bool = True) -> Tuple[VectorIndex, Dict[str, Any]]:
+    """Map a snapshot into a VectorIndex; only the alive masks are copied into memory."""
+    header, data_offset = read_header(path)
+    if verify:
+        verify_snapshot(path)
+    data = np.memmap(path, dtype=np.uint8, mode="r", offset=data_offset, shape=(header["data_bytes"],)) if header["data_bytes"] else None
+    segments = []
+    for layout in header["segments"]:
+        arrays = {}
+        for name in SEGMENT_ARRAYS:
+            spec = layout["arrays"][name]
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            start = spec["offset"]
+            raw = data[start:start + count * dtype.itemsize] if data is not None else np.empty(0, dtype=np.uint8)
+            arrays[name] = raw.view(dtype).reshape(spec["shape"])
+        segments.append(Segment.presorted(
+            arrays["ids"],
+            arrays["owner_ids"],
+            arrays["document_ids"],
+            arrays["vectors"],
+            np.array(arrays["alive"]),
+            {
+                int(owner): (int(start), int(end))
+                for owner, start, end in zip(arrays["owners"], arrays["starts"], arrays["ends"])
+            },
+            layout["projection_id"]
+        ))
+    return VectorIndex.from_segments(segments), header
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="build a shard's partition from the database and write it")
+    export_parser.add_argument("--shard", type=int, default=0)
+    export_parser.add_argument("--shards", type=int, default=1)
+    export_parser.add_argument("--strategy", default=None)
+    export_parser.add_argument("--out", required=True)
+    inspect_parser = commands.add_parser("inspect", help="print a snapshot's header")
+    inspect_parser.add_argument("path")
+    inspect_parser.add_argument("--verify", action="store_true", help="also check the data checksum")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        # Imported here: the shard server imports this module
+        from app.core.config import settings
+        from app.rag.shard_server import ShardServer
+        server = ShardServer(args.shard, args.shards, args.strategy or settings.SHARD_STRATEGY)
+        server.load()
+        server.snapshot(args.out)
+        header = read_header(args.out)[0]
+    else:
+        try:
+            header = verify_snapshot(args.path) if args.verify else read_header(args.path)[0]
+        except SnapshotError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+    summary = {key: value for key, value in header.items() if key != "segments"}
+    summary["segments"] = [
+        {"rows": segment["rows"], "projection_id": segment["projection_id"], "dim": (segment["arrays"]["vectors"]["shape"] + [0, 0])[1]}
+        for segment in header["segments"]
+    ]
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""Hot/cold tiering of a shard's vectors, per owner, under a memory budget.
+
+Most tenants are idle on any given day. With SHARD_MEMORY_BUDGET_BYTES set, a
+shard keeps one small VectorIndex per owner and only the owners queried most
+recently stay resident: when the resident total exceeds the budget, the owners
+with the oldest last query are evicted to a per-owner snapshot file
+(app/rag/snapshot.py) in SHARD_TIER_FOLDER. Their next question pages them
+back in lazily, from that file when it's still current (a memory map, no
+parsing) or else from the database.
+
+New chunks of a resident owner are added in place; for an evicted owner they
+only make its file stale, so the next page-in reads the database. Deleted
+documents are remembered and applied to whatever is paged in later; purged
+owners are kept out of page-ins and evictions that were already running.
+Files survive full reloads: revalidate() drops only the owners whose chunks
+or projection no longer match the database.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from app.core.metrics import TIER_EVICTIONS, TIER_LOOKUPS, TIER_PAGE_IN_SECONDS, TIER_RESIDENT_BYTES
+from app.rag.index import VectorIndex
+from app.rag.snapshot import SnapshotError, read_snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class TieredIndex:
+    """Drop-in for VectorIndex on a shard, for owner-scoped searches only.
+
+    `loader(owner_id)` builds an owner's index from the database.
+    """
+
+    def __init__(self, budget_bytes: int, folder: str, loader: Callable[[int], VectorIndex], label: str = "0"):
+        self.budget_bytes = budget_bytes
+        self.folder = folder
+        self.loader = loader
+        self.label = label
+        # Least recently queried first
+        self._resident: "OrderedDict[int, VectorIndex]" = OrderedDict()
+        self._bytes: Dict[int, int] = {}
+        # Owners being paged in, with the rows that arrived meanwhile
+        self._loading: Dict[int, threading.Event] = {}
+        self._pending: Dict[int, List[Tuple[int, int, int, object, int]]] = {}
+        # Owners whose tier file is being written, and those that got rows meanwhile
+        self._evicting: Set[int] = set()
+        self._stale: Set[int] = set()
+        self._removed_documents: Set[int] = set()
+        # Owners purged while being paged in
+        self._removed_owners: Set[int] = set()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.page_ins = {"disk": 0, "db": 0}
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, owner_id: int) -> str:
+        return os.path.join(self.folder, f"owner-{owner_id}.snap")
+
+    def _discard_file(self, owner_id: int) -> None:
+        try:
+            os.remove(self._path(owner_id))
+        except FileNotFoundError:
+            pass
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(self._bytes.values())
+
+    def _page_in(self, owner_id: int) -> VectorIndex:
+        started = time.perf_counter()
+        index, source = None, "db"
+        if os.path.exists(self._path(owner_id)):
+            try:
+                index, _ = read_snapshot(self._path(owner_id), verify=False)
+                source = "disk"
+            except (SnapshotError, OSError, ValueError) as e:
+                logger.warning(f"Ignoring tier file of owner {owner_id}: {str(e)}")
+        if index is None:
+            index = self.loader(owner_id)
+        with self._lock:
+            pending = self._pending.pop(owner_id, [])
+            removed = list(self._removed_documents)
+            purged = owner_id in self._removed_owners
+            self._removed_owners.discard(owner_id)
+        if purged:
+            # What was read predates the purge; rows added since are pending
+            index.remove_owners([owner_id])
+        if pending:
+            # Rows committed before the load began can be in both
+            fresh = ~np.isin(np.asarray([row[0] for row in pending], dtype=np.int64), index.alive_ids())
+            rows = [row for row, keep in zip(pending, fresh) if keep]
+            if rows:
+                index.add(*(list(column) for column in zip(*rows)))
+        if removed:
+            index.remove_documents(removed)
+        TIER_PAGE_IN_SECONDS.labels(source).observe(time.perf_counter() - started)
+        self.page_ins[source] += 1
+        return index
+
+    def _get(self, owner_id: int) -> VectorIndex:
+        while True:
+            with self._lock:
+                index = self._resident.get(owner_id)
+                if index is not None:
+                    self._resident.move_to_end(owner_id)
+                    TIER_LOOKUPS.labels("hit").inc()
+                    return index
+                event = self._loading.get(owner_id)
+                if event is None:
+                    event = self._loading[owner_id] = threading.Event()
+                    self._pending[owner_id] = []
+                    break
+            # Someone else is paging this owner in
+            event.wait()
+        TIER_LOOKUPS.labels("miss").inc()
+        try:
+            index = self._page_in(owner_id)
+            with self._lock:
+                self._resident[owner_id] = index
+                self._bytes[owner_id] = index.stats()["bytes"]
+        finally:
+            with self._lock:
+                self._loading.pop(owner_id, None)
+                self._pending.pop(owner_id, None)
+                self._removed_owners.discard(owner_id)
+            event.set()
+        self._enforce_budget(keep=owner_id)
+        return index
+
+    def _enforce_budget(self, keep: int) -> None:
+        while True:
+            with self._lock:
+                if self.resident_bytes <= self.budget_bytes or len(self._resident) <= 1:
+                    break
+                owner_id = next(iter(self._resident))
+                if owner_id == keep:
+                    self._resident.move_to_end(owner_id)
+                    owner_id = next(iter(self._resident))
+                index = self._resident.pop(owner_id)
+                self._bytes.pop(owner_id, None)
+                self._evicting.add(owner_id)
+            self.evictions += 1
+            TIER_EVICTIONS.labels(self.label).inc()
+            try:
+                if not os.path.exists(self._path(owner_id)):
+                    write_snapshot(index, self._path(owner_id), {"owner_id": owner_id})
+            except OSError as e:
+                # Only costs a database read on the next page-in
+                logger.error(f"Could not write tier file of owner {owner_id}: {str(e)}")
+            with self._lock:
+                self._evicting.discard(owner_id)
+                stale = owner_id in self._stale
+                self._stale.discard(owner_id)
+            if stale:
+                self._discard_file(owner_id)
+        TIER_RESIDENT_BYTES.labels(self.label).set(self.resident_bytes)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        owner_id: Optional[int] = None,
+        top_k: int = 5,
+        threshold: float = -1.0,
+        projection_id: int = 0
+    ) -> List[List[Tuple[int, float]]]:
+        if owner_id is None:
+            raise ValueError("A tiered shard only serves searches scoped to one owner")
+        return self._get(owner_id).search(queries, owner_id, top_k, threshold, projection_id)
+
+    def add(
+        self,
+        ids: Sequence[int],
+        owner_ids: Sequence[int],
+        document_ids: Sequence[int],
+        vectors,
+        projection_ids: Optional[Sequence[int]] = None
+    ) -> int:
+        projection_ids = projection_ids if projection_ids is not None else [0] * len(ids)
+        by_owner: Dict[int, List[int]] = {}
+        for row, owner_id in enumerate(owner_ids):
+            by_owner.setdefault(int(owner_id), []).append(row)
+        added = 0
+        for owner_id, rows in by_owner.items():
+            columns = [
+                [ids[row] for row in rows],
+                [owner_ids[row] for row in rows],
+                [document_ids[row] for row in rows],
+                [vectors[row] for row in rows],
+                [projection_ids[row] for row in rows]
+            ]
+            with self._lock:
+                if owner_id in self._loading:
+                    self._pending[owner_id].extend(zip(*columns))
+                    continue
+                index = self._resident.get(owner_id)
+                if index is not None:
+                    # A page-in from the database may already have read some of them
+                    fresh = ~np.isin(np.asarray(columns[0], dtype=np.int64), index.alive_ids())
+                    columns = [[value for value, keep in zip(column, fresh) if keep] for column in columns]
+                    # Under the lock, so an eviction can't snapshot the index halfway
+                    added += index.add(*columns)
+                    self._bytes[owner_id] = index.stats()["bytes"]
+                elif owner_id in self._evicting:
+                    self._stale.add(owner_id)
+            # A tier file no longer has everything: drop it, the next eviction
+            # writes a new one, or the next page-in reads the database
+            self._discard_file(owner_id)
+        TIER_RESIDENT_BYTES.labels(self.label).set(self.resident_bytes)
+        return added
+
+    def remove_documents(self, document_ids: Sequence[int]) -> int:
+        with self._lock:
+            self._removed_documents.update(int(document_id) for document_id in document_ids)
+            resident = list(self._resident.values())
+        return sum(index.remove_documents(document_ids) for index in resident)
+
+    def remove_owners(self, owner_ids: Sequence[int]) -> int:
+        removed = 0
+        for owner_id in owner_ids:
+            owner_id = int(owner_id)
+            with self._lock:
+                index = self._resident.pop(owner_id, None)
+                self._bytes.pop(owner_id, None)
+                if owner_id in self._loading:
+                    self._removed_owners.add(owner_id)
+                if owner_id in self._evicting:
+                    # Its file is being written: discarded once it is
+                    self._stale.add(owner_id)
+            if index is not None:
+                removed += index.stats()["alive"]
+            self._discard_file(owner_id)
+        TIER_RESIDENT_BYTES.labels(self.label).set(self.resident_bytes)
+        return removed
+
+    @staticmethod
+    def _matches(index: VectorIndex, chunk_ids: np.ndarray, projection_id: int) -> bool:
+        alive = np.sort(index.alive_ids())
+        if not np.array_equal(alive, chunk_ids):
+            return False
+        return all(segment.projection_id == projection_id for segment in index.segments() if segment.alive.any())
+
+    def revalidate(self, chunk_ids: Dict[int, np.ndarray], projections: Dict[int, int]) -> Dict[str, int]:
+        """Check resident owners and tier files against the database after a full reload.
+
+        `chunk_ids` maps each owner to the sorted ids of its live chunks in this
+        partition, `projections` each owner to its active projection. Owners
+        that differ in either are dropped and paged in from the database when
+        next queried; the rest stay resident or on disk.
+        """
+        empty = np.empty(0, dtype=np.int64)
+        with self._lock:
+            resident = list(self._resident.items())
+            # Committed before the database was read, so reflected in chunk_ids
+            removed_before = set(self._removed_documents)
+        kept = dropped = skipped = 0
+        for owner_id, index in resident:
+            if self._matches(index, chunk_ids.get(owner_id, empty), projections.get(owner_id, 0)):
+                kept += 1
+                continue
+            with self._lock:
+                if self._resident.get(owner_id) is index:
+                    del self._resident[owner_id]
+                    self._bytes.pop(owner_id, None)
+            dropped += 1
+        for name in os.listdir(self.folder):
+            if not (name.startswith("owner-") and name.endswith(".snap")):
+                continue
+            owner_id = int(name[len("owner-"):-len(".snap")])
+            with self._lock:
+                busy = owner_id in self._loading or owner_id in self._evicting
+            if busy:
+                # Checked on the next reload
+                skipped += 1
+                continue
+            try:
+                # As written: a file still holding rows of a deleted document is
+                # dropped, so page-ins never depend on the pruned removals below
+                index, _ = read_snapshot(self._path(owner_id), verify=False)
+                valid = self._matches(index, chunk_ids.get(owner_id, empty), projections.get(owner_id, 0))
+            except FileNotFoundError:
+                continue
+            except (SnapshotError, OSError, ValueError):
+                valid = False
+            if valid:
+                kept += 1
+            else:
+                self._discard_file(owner_id)
+                dropped += 1
+        with self._lock:
+            if not skipped and not self._loading and not self._evicting:
+                # No page-in or eviction can still need these
+                self._removed_documents -= removed_before
+        TIER_RESIDENT_BYTES.labels(self.label).set(self.resident_bytes)
+        return {"kept": kept, "dropped": dropped}
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            resident = list(self._resident.values())
+            owners = len(self._resident)
+        stats = [index.stats() for index in resident]
+        return {
+            "rows": sum(s["rows"] for s in stats),
+            "alive": sum(s["alive"] for s in stats),
+            "segments": sum(s["segments"] for s in stats),
+            "bytes": sum(s["bytes"] for s in stats),
+            "max_id": max((s["max_id"] for s in stats), default=0),
+            "budget_bytes": self.budget_bytes,
+            "resident_owners": owners,
+            "cold_files": sum(1 for name in os.listdir(self.folder) if name.endswith(".snap")),
+            "evictions": self.evictions,
+            "page_ins": dict(self.page_ins)
+        }
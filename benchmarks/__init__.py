@@ -0,0 +1,4 @@
+"""Offline, CPU-only benchmarks for the ingestion and retrieval code paths.
+
+Run `python -m benchmarks.run --help` from the repository root.
+"""
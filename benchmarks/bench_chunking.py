@@ -0,0 +1,20 @@
+"""Throughput of document_processor.create_chunks on synthetic text."""
+from typing import Any, Dict
+
+from benchmarks.common import measure
+from benchmarks.corpus import generate_text
+
+
+def run(args) -> Dict[str, Any]:
+    from app.rag.document_processor import create_chunks
+
+    results = {}
+    for n_words in (2_000, 20_000, 200_000):
+        text = generate_text(n_words, seed=args.seed)
+        chunks = create_chunks(text, args.chunk_size, args.chunk_overlap)
+        stats = measure(lambda: create_chunks(text, args.chunk_size, args.chunk_overlap), repeat=args.repeat)
+        stats["chars"] = len(text)
+        stats["chunks"] = len(chunks)
+        stats["mb_per_second"] = len(text) / 1e6 / (stats["mean_ms"] / 1000)
+        results[f"{n_words}_words"] = stats
+    return results
@@ -0,0 +1,32 @@
+"""Embedding throughput of generate_embeddings at different batch sizes.
+
+Needs the sentence-transformers model in the local Hugging Face cache; the
+runner forces offline mode, so the suite is skipped rather than downloading.
+"""
+import time
+from typing import Any, Dict
+
+from benchmarks.corpus import generate_chunk_texts
+
+
+def run(args) -> Dict[str, Any]:
+    from app.rag import embeddings
+
+    try:
+        embeddings.get_model()
+    except Exception as e:
+        return {"skipped": f"embedding model not available offline: {e}"}
+
+    texts = generate_chunk_texts(args.embedding_texts, chunk_words=args.chunk_size // 6, seed=args.seed)
+    results = {}
+    for batch_size in (1, 8, 32, 64, 128):
+        embeddings.generate_embeddings(texts[:batch_size], batch_size=batch_size)  # warm up
+        start = time.perf_counter()
+        embeddings.generate_embeddings(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        results[f"batch_{batch_size}"] = {
+            "texts": len(texts),
+            "seconds": elapsed,
+            "texts_per_second": len(texts) / elapsed,
+        }
+    return results
@@ -0,0 +1,88 @@
+"""Bulk insertion of document chunks with different write strategies.
+
+Defaults to a throwaway SQLite file; pass --database-url to measure against
+a local Postgres instead.
+"""
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+from benchmarks.corpus import generate_chunk_texts, generate_embeddings
+
+
+def run(args) -> Dict[str, Any]:
+    from sqlalchemy import create_engine, insert
+    from sqlalchemy.orm import sessionmaker
+
+    from app.core.database import Base
+    from app.db import models
+
+    database_url = args.database_url
+    temp_dir = None
+    if not database_url:
+        temp_dir = tempfile.mkdtemp(prefix="rag-bench-")
+        database_url = f"sqlite:///{os.path.join(temp_dir, 'bench.db')}"
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    n_rows = args.insert_rows
+    texts = generate_chunk_texts(min(n_rows, 1000), chunk_words=args.chunk_size // 6, seed=args.seed)
+    vectors = generate_embeddings(n_rows, args.dim, seed=args.seed).tolist()
+
+    with Session() as db:
+        user = models.User(email=f"bench-{time.time()}@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+        document = models.Document(title="bench", filename="bench.txt", file_path="", content_type="text/plain", owner_id=user.id)
+        db.add(document)
+        db.commit()
+        document_id = document.id
+
+    def rows(limit):
+        for i in range(limit):
+            yield texts[i % len(texts)], vectors[i]
+
+    def per_row_commit(limit):
+        # What the original ingestion loop did: one INSERT + COMMIT + SELECT per chunk
+        with Session() as db:
+            for content, embedding in rows(limit):
+                chunk = models.DocumentChunk(content=content, embedding=embedding, document_id=document_id)
+                db.add(chunk)
+                db.commit()
+                db.refresh(chunk)
+
+    def add_all_single_commit(limit):
+        with Session() as db:
+            db.add_all([
+                models.DocumentChunk(content=content, embedding=embedding, document_id=document_id)
+                for content, embedding in rows(limit)
+            ])
+            db.commit()
+
+    def core_executemany(limit):
+        with engine.begin() as connection:
+            connection.execute(
+                insert(models.DocumentChunk.__table__),
+                [{"content": content, "embedding": embedding, "document_id": document_id} for content, embedding in rows(limit)],
+            )
+
+    results: Dict[str, Any] = {"database": engine.dialect.name}
+    strategies = {
+        # Row-at-a-time commits are orders of magnitude slower; keep the run bounded
+        "per_row_commit": (per_row_commit, min(n_rows, 2000)),
+        "add_all_single_commit": (add_all_single_commit, n_rows),
+        "core_executemany": (core_executemany, n_rows),
+    }
+    for name, (strategy, limit) in strategies.items():
+        start = time.perf_counter()
+        strategy(limit)
+        elapsed = time.perf_counter() - start
+        results[name] = {"rows": limit, "seconds": elapsed, "rows_per_second": limit / elapsed}
+
+    engine.dispose()
+    if temp_dir:
+        os.remove(os.path.join(temp_dir, "bench.db"))
+        os.rmdir(temp_dir)
+    return results
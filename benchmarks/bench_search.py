@@ -0,0 +1,114 @@
+"""Similarity search latency and recall@k against exact search.
+
+Ground truth is an exact blocked matrix product over the whole corpus (works on
+memmapped corpora of millions of rows). Methods that go through the
+production code paths build the same chunk dicts the API builds, so they are
+capped at --max-python-chunks to keep runs bounded.
+"""
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from benchmarks.common import percentiles
+from benchmarks.corpus import generate_embeddings, generate_queries
+
+# name -> fn(corpus, queries, k) -> (per-query latencies in seconds, result row ids per query)
+SearchMethod = Callable[[np.ndarray, np.ndarray, int], Tuple[List[float], List[List[int]]]]
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int, block_size: int = 200_000) -> np.ndarray:
+    """Exact top-k row ids per query (rows are unit norm, so dot = cosine)."""
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), k), dtype=np.int64)
+    for start in range(0, len(corpus), block_size):
+        block = np.asarray(corpus[start:start + block_size])
+        scores = queries @ block.T
+        kk = min(k, scores.shape[1])
+        top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        merged_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        merged_ids = np.concatenate([best_ids, top + start], axis=1)
+        order = np.argsort(-merged_scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(merged_scores, order, axis=1)
+        best_ids = np.take_along_axis(merged_ids, order, axis=1)
+    return best_ids
+
+
+def _chunk_dicts(corpus: np.ndarray) -> List[Dict[str, Any]]:
+    return [{"id": i, "content": "", "embedding": row.tolist()} for i, row in enumerate(corpus)]
+
+
+def numpy_matrix_vector(corpus, queries, k):
+    """One matrix-vector product per query over a resident float32 matrix."""
+    matrix = np.asarray(corpus)
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        scores = matrix @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        results.append(top[np.argsort(-scores[top])].tolist())
+        latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+
+def find_relevant_chunks(corpus, queries, k):
+    """The per-chunk Python loop used by ask_question."""
+    from app.rag.embeddings import find_relevant_chunks as search
+
+    chunks = _chunk_dicts(corpus)
+    latencies, results = [], []
+    for query in queries:
+        query_list = query.tolist()
+        start = time.perf_counter()
+        found = search(query_list, chunks, top_k=k, threshold=-1.0)
+        latencies.append(time.perf_counter() - start)
+        results.append([chunk["id"] for chunk in found])
+    return latencies, results
+
+
+def find_relevant_chunks_batch(corpus, queries, k):
+    """The matrix-matrix path used by the batch endpoint (latency amortized per query)."""
+    from app.rag.embeddings import find_relevant_chunks_batch as search
+
+    chunks = _chunk_dicts(corpus)
+    start = time.perf_counter()
+    found = search(queries.tolist(), chunks, top_k=k, threshold=-1.0)
+    per_query = (time.perf_counter() - start) / max(1, len(queries))
+    return [per_query] * len(queries), [[chunk["id"] for chunk in row] for row in found]
+
+
+SEARCH_METHODS: Dict[str, SearchMethod] = {
+    "numpy_matrix_vector": numpy_matrix_vector,
+    "find_relevant_chunks": find_relevant_chunks,
+    "find_relevant_chunks_batch": find_relevant_chunks_batch,
+}
+# Methods that materialize Python chunk dicts and are capped at --max-python-chunks
+PYTHON_PATH_METHODS = {"find_relevant_chunks", "find_relevant_chunks_batch"}
+
+
+def recall_at_k(results: List[List[int]], truth: np.ndarray, k: int) -> float:
+    hits = sum(len(set(found[:k]) & set(expected[:k].tolist())) for found, expected in zip(results, truth))
+    return hits / (len(truth) * k)
+
+
+def run(args) -> Dict[str, Any]:
+    corpus = generate_embeddings(args.chunks, args.dim, seed=args.seed, path=args.corpus_path)
+    queries = generate_queries(args.queries, args.dim, seed=args.seed)
+    k = args.top_k
+
+    start = time.perf_counter()
+    truth = exact_top_k(corpus, queries, k)
+    results: Dict[str, Any] = {"ground_truth_seconds": time.perf_counter() - start, "methods": {}}
+
+    for name in args.search_methods:
+        method = SEARCH_METHODS[name]
+        method_corpus, method_truth = corpus, truth
+        if name in PYTHON_PATH_METHODS and len(corpus) > args.max_python_chunks:
+            method_corpus = np.asarray(corpus[:args.max_python_chunks])
+            method_truth = exact_top_k(method_corpus, queries, k)
+        latencies, found = method(method_corpus, queries, k)
+        stats = percentiles(latencies)
+        stats["corpus_size"] = len(method_corpus)
+        stats[f"recall_at_{k}"] = recall_at_k(found, method_truth, k)
+        results["methods"][name] = stats
+    return results
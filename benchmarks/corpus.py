@@ -0,0 +1,100 @@
+"""Seeded synthetic corpora: texts for chunking and embedding matrices for search.
+
+Embeddings are drawn around a fixed number of cluster centres so that nearest
+neighbours are meaningful (uniform random vectors make every query equidistant
+from everything and recall numbers useless). Large corpora (up to millions of
+chunks) are generated block by block, optionally straight into a memmap file.
+"""
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+WORDS = (
+    "retrieval augmented generation document chunk embedding vector query answer model "
+    "context passage index search latency throughput tenant storage database replica "
+    "partition shard cluster memory cache network request response token prompt score "
+    "ranking recall precision dimension projection matrix batch pipeline worker stream"
+).split()
+
+
+def generate_text(n_words: int, seed: int = 0) -> str:
+    """Sentences of random vocabulary words, roughly like extracted document text."""
+    rng = np.random.default_rng(seed)
+    words = rng.choice(WORDS, size=n_words)
+    sentences = []
+    position = 0
+    while position < n_words:
+        length = int(rng.integers(8, 25))
+        sentence = " ".join(words[position:position + length])
+        sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+        position += length
+    return " ".join(sentences)
+
+
+def generate_chunk_texts(n_chunks: int, chunk_words: int = 150, seed: int = 0) -> List[str]:
+    return [generate_text(chunk_words, seed + i) for i in range(n_chunks)]
+
+
+def _centres(n_clusters: int, dim: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    return centres / np.linalg.norm(centres, axis=1, keepdims=True)
+
+
+def iter_embedding_blocks(
+    n: int,
+    dim: int = 384,
+    seed: int = 0,
+    n_clusters: int = 256,
+    noise: float = 0.35,
+    block_size: int = 100_000,
+    stream: int = 0,
+) -> Iterator[np.ndarray]:
+    """Yield unit-norm float32 embedding blocks; same seed, same vectors.
+
+    `stream` selects an independent sample around the same cluster centres
+    (the corpus uses stream 0, queries stream 1).
+    """
+    centres = _centres(n_clusters, dim, seed)
+    for block_index, start in enumerate(range(0, n, block_size)):
+        rng = np.random.default_rng((seed, stream, block_index))
+        size = min(block_size, n - start)
+        assignment = rng.integers(0, n_clusters, size=size)
+        block = centres[assignment] + noise * rng.standard_normal((size, dim)).astype(np.float32) / np.sqrt(dim)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        yield block
+
+
+def generate_embeddings(
+    n: int,
+    dim: int = 384,
+    seed: int = 0,
+    n_clusters: int = 256,
+    path: Optional[str] = None,
+) -> np.ndarray:
+    """Build an (n, dim) float32 matrix, in memory or as a memmap at `path`."""
+    if path:
+        matrix = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(n, dim))
+    else:
+        matrix = np.empty((n, dim), dtype=np.float32)
+    start = 0
+    for block in iter_embedding_blocks(n, dim, seed, n_clusters):
+        matrix[start:start + len(block)] = block
+        start += len(block)
+    if path:
+        matrix.flush()
+    return matrix
+
+
+def generate_queries(n: int, dim: int = 384, seed: int = 0, n_clusters: int = 256) -> np.ndarray:
+    """Queries drawn from the same clusters as the corpus, but different points."""
+    if not n:
+        return np.empty((0, dim), np.float32)
+    return next(iter_embedding_blocks(n, dim, seed, n_clusters, block_size=n, stream=1))
+
+
+def generate_owner_ids(n: int, n_owners: int = 100, seed: int = 0) -> np.ndarray:
+    """Skewed (Zipf-like) owner ids: a few large tenants, many small ones."""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, n_owners + 1)
+    return rng.choice(n_owners, size=n, p=weights / weights.sum()).astype(np.int64) + 1
@@ -0,0 +1,103 @@
+"""Run the benchmark suites and write machine-readable JSON.
+
+    python -m benchmarks.run --suites chunking,search --chunks 100000 --output bench.json
+
+Results carry the git commit and environment so runs can be compared across
+commits. Everything runs offline on CPU. To see where the time goes in a live
+worker instead, start the API with PROFILING_ENABLED=true and use the admin
+/profile and /memory endpoints (app/core/profiling.py).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# Must be set before app modules are imported
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+os.environ.setdefault("UPLOAD_FOLDER", os.path.join(tempfile.gettempdir(), "rag-bench-uploads"))
+
+SUITES = ("chunking", "embedding", "search", "insert")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def parse_args(argv=None):
+    from benchmarks.bench_search import SEARCH_METHODS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"comma-separated subset of {', '.join(SUITES)}")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunks", type=int, default=10_000, help="synthetic corpus size (10k to 5M)")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--corpus-path", default=None, help="build the corpus as a .npy memmap here (for millions of chunks)")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--search-methods", default=",".join(SEARCH_METHODS))
+    parser.add_argument("--max-python-chunks", type=int, default=50_000, help="corpus cap for methods that build Python chunk dicts")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--embedding-texts", type=int, default=256)
+    parser.add_argument("--insert-rows", type=int, default=10_000)
+    parser.add_argument("--database-url", default=None, help="database for the insert suite (default: temporary SQLite)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+    args.suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    args.search_methods = [method.strip() for method in args.search_methods.split(",") if method.strip()]
+    unknown = set(args.suites) - set(SUITES) or set(args.search_methods) - set(SEARCH_METHODS)
+    if unknown:
+        parser.error(f"unknown suite or method: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    import numpy as np
+    from benchmarks import bench_chunking, bench_embedding, bench_insert, bench_search
+
+    runners = {
+        "chunking": bench_chunking.run,
+        "embedding": bench_embedding.run,
+        "search": bench_search.run,
+        "insert": bench_insert.run,
+    }
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.time(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {key: value for key, value in vars(args).items() if key != "output"},
+        },
+        "results": {},
+    }
+    for suite in args.suites:
+        print(f"running {suite}...", file=sys.stderr)
+        start = time.perf_counter()
+        report["results"][suite] = runners[suite](args)
+        report["results"][suite]["suite_seconds"] = time.perf_counter() - start
+
+    payload = json.dumps(report, indent=2, default=float)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+# Loaded automatically by gunicorn when started from the repository root
+import os
+import shutil
+
+
+def on_starting(server):
+    # Samples left over from a previous run would be aggregated into /metrics
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Drop live gauges of dead workers so they don't linger in the totals
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,290 @@
+"""End-to-end load test of the API with open-loop (Poisson) arrivals.
+
+    # everything local: Ollama stub + API on SQLite, 2 minutes of mixed traffic
+    python -m loadtest.run --start-stack --duration 120 --users 20 \\
+        --question-rate 5 --upload-rate 0.5 --poll-rate 10 --output load.json
+
+    # against a running deployment (or a local Postgres: --database-url postgresql://...)
+    python -m loadtest.run --base-url http://10.0.0.5:8000 --question-rate 2
+
+The stack started by --start-stack has profiling on; a deployment under test
+needs PROFILING_ENABLED=true to be profiled (app/core/profiling.py) while the
+load runs.
+
+Each traffic class has its own arrival rate (requests/second across all users)
+that does not slow down when the server does, so queueing shows up as latency
+instead of silently lowering the offered load. Latency is measured from the
+moment a request was due, which includes time spent waiting for a free client
+slot (--concurrency). Traffic mirrors the frontend: uploads, polling the
+document list while documents process, questions and history views.
+
+The report has, per endpoint: requests, errors by status, achieved throughput
+and p50/p95/p99 latency, plus the parameters and git commit of the run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.common import percentiles
+from benchmarks.corpus import generate_text
+
+SCENARIOS = ("upload", "poll", "question", "history")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Recorder:
+    """Latency samples and outcomes per endpoint."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+
+    def record(self, endpoint: str, latency: float, status: str) -> None:
+        self.latencies[endpoint].append(latency)
+        self.statuses[endpoint][status] += 1
+
+    def report(self, elapsed: float) -> Dict[str, Dict]:
+        report = {}
+        for endpoint, samples in sorted(self.latencies.items()):
+            statuses = self.statuses[endpoint]
+            errors = {status: count for status, count in statuses.items() if not status.startswith("2")}
+            report[endpoint] = {
+                **percentiles(samples),
+                "throughput_rps": len(samples) / elapsed,
+                "errors": errors,
+                "error_rate": sum(errors.values()) / len(samples),
+            }
+        return report
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.api = f"{args.base_url.rstrip('/')}/api/v1"
+        self.rng = random.Random(args.seed)
+        self.recorder = Recorder()
+        self.slots = asyncio.Semaphore(args.concurrency)
+        self.tokens: List[str] = []
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def _call(self, endpoint: str, due: float, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        async with self.slots:
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                status = str(response.status_code)
+            except httpx.TimeoutException:
+                response, status = None, "timeout"
+            except httpx.HTTPError as e:
+                response, status = None, type(e).__name__
+        self.recorder.record(endpoint, time.perf_counter() - due, status)
+        return response
+
+    async def setup_users(self) -> None:
+        run_id = f"{int(time.time())}-{os.getpid()}"
+        for i in range(self.args.users):
+            email, password = f"load-{run_id}-{i}@example.com", "load-test-password"
+            due = time.perf_counter()
+            await self._call("POST /auth/register", due, "POST", f"{self.api}/auth/register",
+                             params={"email": email, "password": password})
+            due = time.perf_counter()
+            response = await self._call("POST /auth/token", due, "POST", f"{self.api}/auth/token",
+                                        data={"username": email, "password": password})
+            if response is None or response.status_code != 200:
+                raise RuntimeError(f"Could not log in load-test user {email}")
+            self.tokens.append(response.json()["access_token"])
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.rng.choice(self.tokens)}"}
+
+    async def upload(self, due: float) -> None:
+        text = generate_text(self.args.upload_words, seed=self.rng.randrange(1 << 30))
+        await self._call(
+            "POST /documents/", due, "POST", f"{self.api}/documents/", headers=self._headers(),
+            data={"title": "load test document"},
+            files={"file": ("load-test.txt", text.encode(), "text/plain")},
+        )
+
+    async def poll(self, due: float) -> None:
+        # What the frontend does while documents show "Processing..."
+        await self._call("GET /documents/", due, "GET", f"{self.api}/documents/", headers=self._headers())
+
+    async def question(self, due: float) -> None:
+        question = generate_text(self.rng.randint(6, 20), seed=self.rng.randrange(1 << 30))
+        await self._call("POST /queries/", due, "POST", f"{self.api}/queries/",
+                         headers=self._headers(), params={"question": question})
+
+    async def history(self, due: float) -> None:
+        await self._call("GET /queries/history", due, "GET", f"{self.api}/queries/history", headers=self._headers())
+
+    async def _arrivals(self, scenario: str, rate: float, deadline: float, tasks: set) -> None:
+        if rate <= 0:
+            return
+        handler = getattr(self, scenario)
+        due = time.perf_counter()
+        while True:
+            due += self.rng.expovariate(rate)
+            if due >= deadline:
+                return
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            task = asyncio.create_task(handler(due))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def run(self) -> Dict:
+        timeout = httpx.Timeout(self.args.timeout)
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+            self.client = client
+            await self.setup_users()
+            # Setup requests are not part of the measured mix
+            setup = self.recorder.report(1.0)
+            self.recorder = Recorder()
+
+            tasks: set = set()
+            start = time.perf_counter()
+            deadline = start + self.args.duration
+            await asyncio.gather(*(
+                self._arrivals(scenario, getattr(self.args, f"{scenario}_rate"), deadline, tasks)
+                for scenario in SCENARIOS
+            ))
+            if tasks:
+                await asyncio.wait(set(tasks), timeout=self.args.timeout)
+            elapsed = time.perf_counter() - start
+        return {"setup": setup, "elapsed_seconds": elapsed, "endpoints": self.recorder.report(elapsed)}
+
+
+class LocalStack:
+    """Starts the Ollama stub and the API (uvicorn) as subprocesses."""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes: List[subprocess.Popen] = []
+        self.workdir = tempfile.mkdtemp(prefix="rag-loadtest-")
+
+    def __enter__(self) -> str:
+        args = self.args
+        stub_port, api_port = _free_port(), _free_port()
+        self.processes.append(subprocess.Popen([
+            sys.executable, "-m", "loadtest.stub_ollama", "--port", str(stub_port),
+            "--ttft-ms", str(args.ttft_ms), "--token-ms", str(args.token_ms),
+            "--tokens", str(args.tokens), "--error-rate", str(args.llm_error_rate), "--seed", str(args.seed),
+        ]))
+        env = {
+            **os.environ,
+            "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(self.workdir, 'loadtest.db')}",
+            "OLLAMA_BASE_URL": f"http://127.0.0.1:{stub_port}",
+            "UPLOAD_FOLDER": os.path.join(self.workdir, "uploads"),
+            "WEB_CONCURRENCY": str(args.workers),
+            # Every simulated user logs in from 127.0.0.1
+            "AUTH_RATE_LIMIT_PER_IP": str(max(1000, 4 * args.users)),
+            "HF_HUB_OFFLINE": os.environ.get("HF_HUB_OFFLINE", "1"),
+            "TRANSFORMERS_OFFLINE": os.environ.get("TRANSFORMERS_OFFLINE", "1"),
+            # So a run can be profiled through /admin/profile and /admin/memory
+            "PROFILING_ENABLED": os.environ.get("PROFILING_ENABLED", "true"),
+        }
+        self.processes.append(subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(api_port),
+            "--workers", str(args.workers), "--log-level", "warning",
+        ], env=env))
+        base_url = f"http://127.0.0.1:{api_port}"
+        self._wait_healthy(f"{base_url}/health")
+        return base_url
+
+    def _wait_healthy(self, url: str, timeout: float = 120.0) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if any(process.poll() is not None for process in self.processes):
+                raise RuntimeError("A stack process exited during startup")
+            try:
+                if httpx.get(url, timeout=2).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f"API did not become healthy within {timeout}s")
+
+    def __exit__(self, *exc) -> None:
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--start-stack", action="store_true", help="start the Ollama stub and the API locally")
+    parser.add_argument("--database-url", default=None, help="with --start-stack (default: temporary SQLite)")
+    parser.add_argument("--workers", type=int, default=1, help="API worker processes with --start-stack")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="stub time to first token")
+    parser.add_argument("--token-ms", type=float, default=25.0, help="stub time per token")
+    parser.add_argument("--tokens", type=int, default=120, help="stub tokens per answer")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of stub requests failing")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of measured traffic")
+    parser.add_argument("--concurrency", type=int, default=64, help="max in-flight requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--upload-rate", type=float, default=0.2, help="uploads per second")
+    parser.add_argument("--poll-rate", type=float, default=2.0, help="document list requests per second")
+    parser.add_argument("--question-rate", type=float, default=1.0, help="questions per second")
+    parser.add_argument("--history-rate", type=float, default=0.5, help="history requests per second")
+    parser.add_argument("--upload-words", type=int, default=2000, help="size of each uploaded text file")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="write JSON here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.start_stack:
+        with LocalStack(args) as base_url:
+            args.base_url = base_url
+            results = asyncio.run(LoadTest(args).run())
+    else:
+        results = asyncio.run(LoadTest(args).run())
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.time(),
+            "params": {key: value for key, value in vars(args).items() if key != "output"},
+        },
+        **results,
+    }
+    payload = json.dumps(report, indent=2, default=float)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Stand-in for the Ollama worker, for load tests without a GPU box.
+
+    python -m loadtest.stub_ollama --port 11500 --ttft-ms 300 --token-ms 25 --tokens 120
+
+Implements the parts of the API the app uses: POST /api/generate (streaming
+NDJSON or a single JSON body, returns a `context` to continue a conversation)
+and GET /api/tags. Latency is emulated with a time-to-first-token followed by
+one token every --token-ms, with optional jitter, and --error-rate makes a
+fraction of requests fail with a 500 like an overloaded worker would.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "the document describes a process where each step depends on the previous "
+    "one and results are stored for later review by the team"
+).split()
+
+
+def create_app(
+    ttft_ms: float = 300.0,
+    token_ms: float = 25.0,
+    tokens: int = 120,
+    jitter: float = 0.2,
+    error_rate: float = 0.0,
+    seed: int = 0,
+) -> FastAPI:
+    app = FastAPI(title="Ollama stub")
+    rng = random.Random(seed)
+
+    def delay(ms: float) -> float:
+        return max(0.0, ms * (1 + rng.uniform(-jitter, jitter))) / 1000
+
+    async def generate_tokens(count: int):
+        await asyncio.sleep(delay(ttft_ms))
+        for i in range(count):
+            if i:
+                await asyncio.sleep(delay(token_ms))
+            yield WORDS[i % len(WORDS)] + " "
+
+    def final_chunk(request_body: dict, prompt_tokens: int, started: float) -> dict:
+        # Conversations send back the previous context; grow it like Ollama does
+        context = list(request_body.get("context") or []) + list(range(prompt_tokens + tokens))
+        return {
+            "model": request_body.get("model", "stub"),
+            "response": "",
+            "done": True,
+            "context": context[-4096:],
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": tokens,
+        }
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        started = time.perf_counter()
+        if error_rate and rng.random() < error_rate:
+            await asyncio.sleep(delay(ttft_ms))
+            return JSONResponse({"error": "stub: simulated overload"}, status_code=500)
+        prompt_tokens = len(str(body.get("prompt", "")).split())
+        model = body.get("model", "stub")
+
+        if not body.get("stream", True):
+            text = "".join([token async for token in generate_tokens(tokens)])
+            return {**final_chunk(body, prompt_tokens, started), "response": text}
+
+        async def stream():
+            async for token in generate_tokens(tokens):
+                yield json.dumps({"model": model, "response": token, "done": False}) + "\n"
+            yield json.dumps(final_chunk(body, prompt_tokens, started)) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": "tinyllama:latest"}, {"name": "stub:latest"}]}
+
+    return app
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="time to first token")
+    parser.add_argument("--token-ms", type=float, default=25.0, help="time between tokens")
+    parser.add_argument("--tokens", type=int, default=120, help="tokens per answer")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative +/- jitter on every delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    app = create_app(args.ttft_ms, args.token_ms, args.tokens, args.jitter, args.error_rate, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
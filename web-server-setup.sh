@@ -69,6 +69,13 @@ WORKER_INTERNAL_IP=10.128.0.10
 UPLOAD_FOLDER=/mnt/filestore
 OLLAMA_BASE_URL=http://10.128.0.10:11434
 OLLAMA_MODEL=tinyllama
+
+# gunicorn workers; also used to split DB_MAX_CONNECTIONS across worker pools
+WEB_CONCURRENCY=4
+DB_MAX_CONNECTIONS=50
+
+# Shared by all gunicorn workers so /metrics aggregates them (wiped by gunicorn.conf.py on start)
+PROMETHEUS_MULTIPROC_DIR=/tmp/rag-saas-metrics
 EOF
 
 # Create systemd service for API
@@ -80,7 +87,11 @@ After=network.target cloud-sql-proxy.service
 [Service]
 User=root
 WorkingDirectory=/opt/rag-saas
-ExecStart=/opt/rag-saas/venv/bin/gunicorn -w 4 -k uvicorn.workers.UvicornWorker app.main:app --bind 0.0.0.0:8000
+# One-time partitioning of an existing query log (a no-op afterwards); it can
+# take long on a large table, so it runs before the workers, without a timeout
+ExecStartPre=/opt/rag-saas/venv/bin/python -m app.db.query_log convert
+TimeoutStartSec=infinity
+ExecStart=/opt/rag-saas/venv/bin/gunicorn -w ${WEB_CONCURRENCY} -k uvicorn.workers.UvicornWorker app.main:app --bind 0.0.0.0:8000
 Restart=always
 RestartSec=3
 Environment=PYTHONPATH=/opt/rag-saas